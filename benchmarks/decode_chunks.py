@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# compare the original try/except chunk decoder with the schema driven one
+#
+#   ./benchmarks/decode_chunks.py -m ../data/m3-map.xml
+
+import argparse
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mapxml import process_chunk
+from records import RECORD_TYPES
+
+# the decoder previously copied into map2svg.py, map2dot.py and map2monsters.py
+def legacy_process_chunk(chunk_root):
+    chunk_dict = defaultdict(list)
+    for entry in chunk_root:
+        chunk_dict[entry.tag].append(dict(entry.attrib))
+        if len(list(entry)) > 0:
+            chunk_dict[entry.tag][-1]['children'] = legacy_process_chunk(entry)
+        for key,val in chunk_dict[entry.tag][-1].items():
+            try:
+                chunk_dict[entry.tag][-1][key] = int(val)
+                continue
+            except:
+                pass
+            try:
+                chunk_dict[entry.tag][-1][key] = float(val)
+                continue
+            except:
+                pass
+        chunk_dict[entry.tag][-1]['text'] = entry.text
+        if 'index' not in chunk_dict[entry.tag][-1]:
+            chunk_dict[entry.tag][-1]['index'] = 0
+        if chunk_dict[entry.tag][-1]['index'] != len(chunk_dict[entry.tag])-1:
+            print ('out of order entry: {}'.format(chunk_dict[entry.tag]))
+    return chunk_dict
+
+# records leave out the text their elements don't have
+def without_record_text(chunk_dict):
+    stripped = dict()
+    for tag, records in chunk_dict.items():
+        if tag in RECORD_TYPES:
+            records = [{k: v for k, v in r.items() if 'text' != k or v is not None} for r in records]
+        stripped[tag] = records
+    return stripped
+
+def collect_chunks(map_xml_path):
+    chunks = defaultdict(list)
+    root = ET.parse(map_xml_path).getroot()
+    for entry in root.iter('entry'):
+        for chunk in entry.iter('chunk'):
+            if len(chunk) > 0:
+                chunks[chunk.attrib.get('type')].append(chunk)
+    return chunks
+
+def time_decoder(decoder, chunks, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for chunk in chunks:
+            decoder(chunk)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the map XML chunk decoders')
+    parser.add_argument('-m', '--map', dest='map', type=str, required=True, help='a map XML file')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3, help='runs per decoder, the best is reported')
+    args = parser.parse_args()
+
+    chunks = collect_chunks(args.map)
+    rows = []
+    for chunk_type in sorted(chunks.keys(), key=str):
+        for chunk in chunks[chunk_type]:
+            if without_record_text(legacy_process_chunk(chunk)) != process_chunk(chunk):
+                print ('decoders disagree on chunk: {}'.format(chunk_type))
+                sys.exit(1)
+        legacy = time_decoder(legacy_process_chunk, chunks[chunk_type], args.repeat)
+        schema = time_decoder(process_chunk, chunks[chunk_type], args.repeat)
+        rows.append((chunk_type, len(chunks[chunk_type]), legacy, schema))
+    print ('{:<6} {:>6} {:>10} {:>10} {:>8}'.format('chunk', 'count', 'legacy ms', 'schema ms', 'speedup'))
+    for chunk_type, count, legacy, schema in rows:
+        print ('{:<6} {:>6} {:>10.1f} {:>10.1f} {:>7.2f}x'.format(chunk_type, count, legacy*1000, schema*1000, legacy/schema))
+    legacy = sum(r[2] for r in rows)
+    schema = sum(r[3] for r in rows)
+    print ('{:<6} {:>6} {:>10.1f} {:>10.1f} {:>7.2f}x'.format('total', sum(r[1] for r in rows), legacy*1000, schema*1000, legacy/schema))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# time each map2svg stage on synthetic maps of growing size
+#
+# a map is written for every size and run through map2svg --profile, the
+# stage totals are printed side by side with how each grows between the two
+# largest sizes, about 1 for a linear stage and 2 for a quadratic one
+#
+# options not listed here are passed on to map2svg, e.g. --columnar
+#
+#   ./benchmarks/map_stages.py --sizes 1000 10000 50000 -o stages.json
+
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from synth_map import add_options_arguments, options_from_args, write_map
+
+# map2svg runs in its own process, as it would from the command line
+MAP2SVG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'map2svg.py')
+
+def run_size(directory, polygons, map2svg_args):
+    options = options_from_args(args, polygons)
+    map_path = os.path.join(directory, 'synth-{}.map.xml'.format(polygons))
+    with open(map_path, 'w') as f:
+        write_map(f, options, args.levels)
+    best = None
+    for _ in range(args.repeat):
+        profile_path = os.path.join(directory, 'profile-{}.json'.format(polygons))
+        command = [sys.executable, MAP2SVG, '-m', map_path, '-d', os.path.join(directory, str(polygons)), '-b', '',
+            '--no-cache', '--profile', profile_path] + map2svg_args
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        seconds = time.perf_counter() - start
+        with open(profile_path, 'r') as f:
+            totals = json.load(f)['totals']
+        # the fastest run has the least noise
+        if best is None or seconds < best['seconds']:
+            best = {'polygons': polygons, 'seconds': seconds, 'stages': totals}
+    return best
+
+# log-log slope of a stage's time between two sizes
+def growth(small, large, stage):
+    small_seconds = small['stages'].get(stage, {}).get('seconds', 0)
+    large_seconds = large['stages'].get(stage, {}).get('seconds', 0)
+    if small_seconds <= 0 or large_seconds <= 0:
+        return None
+    return math.log(large_seconds / small_seconds) / math.log(large['polygons'] / small['polygons'])
+
+def print_table(runs):
+    stages = []
+    for run in runs:
+        stages.extend(s for s in run['stages'] if s not in stages)
+    width = max(len(s) for s in stages + ['total'])
+    header = '{:<{}}'.format('stage', width) + ''.join('{:>12}'.format(r['polygons']) for r in runs)
+    if 1 < len(runs):
+        header += '{:>8}'.format('growth')
+    print (header)
+    for stage in stages:
+        line = '{:<{}}'.format(stage, width)
+        line += ''.join('{:>12.4f}'.format(r['stages'].get(stage, {}).get('seconds', 0)) for r in runs)
+        if 1 < len(runs):
+            slope = growth(runs[-2], runs[-1], stage)
+            line += '{:>8}'.format('-' if slope is None else '{:.2f}'.format(slope))
+        print (line)
+    print ('{:<{}}'.format('total', width) + ''.join('{:>12.4f}'.format(r['seconds']) for r in runs))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time map2svg stages on synthetic maps of several sizes')
+    parser.add_argument('--sizes', dest='sizes', type=int, nargs='+', default=[1000, 10000, 50000], help='polygons per level of each map')
+    parser.add_argument('--levels', dest='levels', type=int, default=1, help='levels per map')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=1, help='runs per size, the fastest is kept')
+    parser.add_argument('-o', '--output', dest='output', type=str, help='write the stage timings of every size to this JSON file')
+    parser.add_argument('-k', '--keep', dest='keep', type=str, help='write the maps and SVGs to this directory instead of a temporary one')
+    add_options_arguments(parser)
+    args, map2svg_args = parser.parse_known_args()
+
+    runs = []
+    with tempfile.TemporaryDirectory() as temp_directory:
+        directory = args.keep or temp_directory
+        os.makedirs(directory, exist_ok=True)
+        for polygons in sorted(args.sizes):
+            print ('{} polygons'.format(polygons), file=sys.stderr)
+            runs.append(run_size(directory, polygons, map2svg_args))
+    print_table(runs)
+
+    if args.output:
+        results = {
+            'options': {k: v for k, v in vars(args).items() if k not in ['output', 'keep']},
+            'map2svg_args': map2svg_args,
+            'runs': runs,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
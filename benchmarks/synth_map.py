@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+
+# write a synthetic map XML in the shape map2xml.pl produces, for
+# benchmarking the map tools on levels larger than the Bungie scenarios
+#
+# each level is a grid of square polygons, some split into two triangles,
+# with random heights, platforms, light and tag switches, trigger polygons,
+# teleporters, terminals and objects
+#
+#   ./benchmarks/synth_map.py -o ../_tmp/data/synth-map.xml -p 10000 --levels 2
+
+import argparse
+import math
+import random
+import sys
+
+WORLD_ONE = 1024
+MAX_COORDINATE = 32767
+
+# polygon types
+NORMAL = 0
+PLATFORM = 5
+LIGHT_ON_TRIGGER = 6
+PLATFORM_ON_TRIGGER = 7
+LIGHT_OFF_TRIGGER = 8
+PLATFORM_OFF_TRIGGER = 9
+TELEPORTER = 10
+
+# side flags and panel types, per map type
+CONTROL_PANEL = 0x2
+LIGHT_SWITCH = {1: 4, 2: 4}
+PLATFORM_SWITCH = {1: 5, 2: 5}
+TAG_SWITCH = {1: 7, 2: 3}
+
+# static platform flags: activates light, activates adjacent platforms on activation
+PLATFORM_FLAGS = [0x40, 0x80, 0xC0, 0x40 | 0x20000, 0x2000000 | 0x40, 0x80 | 0x80000]
+
+def attributes(values):
+    return ' '.join('{}="{}"'.format(k, v) for k, v in values.items())
+
+def indexed_values(name, values, count=8):
+    return {'{}_{}'.format(name, i): values[i] if i < len(values) else -1 for i in range(count)}
+
+class Options(object):
+    def __init__(self, polygons=1000, line_density=0.2, platforms=0.05, lights=None, tags=8,
+            terminals=8, objects=None, map_type=2, seed=1):
+        self.polygons = polygons
+        self.line_density = line_density
+        self.platforms = platforms
+        self.lights = lights if lights is not None else max(2, polygons // 20)
+        self.tags = tags
+        self.terminals = terminals
+        self.objects = objects if objects is not None else max(3, polygons // 10)
+        self.map_type = map_type
+        self.seed = seed
+
+class SynthLevel(object):
+    def __init__(self, index, options, rnd):
+        self.index = index
+        self.options = options
+        self.rnd = rnd
+        # split cells hold two polygons
+        self.cells = max(1, round(options.polygons / (1 + options.line_density)))
+        self.width = max(1, math.ceil(math.sqrt(self.cells)))
+        self.height = max(1, math.ceil(self.cells / self.width))
+        # keep every endpoint inside the map coordinates
+        self.size = min(WORLD_ONE, 2 * MAX_COORDINATE // max(self.width, self.height))
+        self.endpoints = []
+        self.lines = []
+        self.line_map = dict()
+        self.polygons = []
+        self.sides = []
+        self.build_geometry()
+        self.assign_lights()
+        self.assign_types()
+        self.build_sides()
+
+    def endpoint(self, i, j):
+        return j * (self.width + 1) + i
+
+    def line(self, endpoint1, endpoint2, poly):
+        key = (min(endpoint1, endpoint2), max(endpoint1, endpoint2))
+        if key in self.line_map:
+            line = self.lines[self.line_map[key]]
+            line['ccw_poly'] = poly
+            return line['index']
+        self.line_map[key] = len(self.lines)
+        self.lines.append({
+            'index': len(self.lines), 'endpoint1': endpoint1, 'endpoint2': endpoint2,
+            'flags': 0x4000 if self.rnd.random() < 0.2 else 0,
+            'cw_side': -1, 'ccw_side': -1, 'cw_poly': poly, 'ccw_poly': -1,
+        })
+        return len(self.lines) - 1
+
+    def build_geometry(self):
+        origin_x = -(self.width * self.size) // 2
+        origin_y = -(self.height * self.size) // 2
+        for j in range(self.height + 1):
+            for i in range(self.width + 1):
+                self.endpoints.append((origin_x + i * self.size, origin_y + j * self.size))
+        cells = self.cells
+        # enough split cells to make up the polygon count
+        split = set(self.rnd.sample(range(cells), min(cells, max(0, self.options.polygons - cells))))
+        for cell in range(cells):
+            i, j = cell % self.width, cell // self.width
+            corners = [self.endpoint(i, j), self.endpoint(i + 1, j), self.endpoint(i + 1, j + 1), self.endpoint(i, j + 1)]
+            if cell in split:
+                self.add_polygon(corners[:3])
+                self.add_polygon([corners[0], corners[2], corners[3]])
+            else:
+                self.add_polygon(corners)
+        # neighbours share a line, its two polygons are adjacent
+        for poly in self.polygons:
+            poly['adjacent'] = []
+            for line_index in poly['lines']:
+                line = self.lines[line_index]
+                other = line['ccw_poly'] if poly['index'] == line['cw_poly'] else line['cw_poly']
+                poly['adjacent'].append(other)
+
+    def add_polygon(self, vertices):
+        index = len(self.polygons)
+        floor = self.rnd.choice([0, 0, 0, 512, 1024, -512])
+        ceiling = floor + self.rnd.choice([1024, 2048, 3072])
+        if self.rnd.random() < 0.02:
+            ceiling = floor
+        self.polygons.append({
+            'index': index,
+            'vertices': vertices,
+            'lines': [self.line(vertices[k], vertices[(k + 1) % len(vertices)], index) for k in range(len(vertices))],
+            'floor_height': floor,
+            'ceiling_height': ceiling,
+            'type': NORMAL,
+            'permutation': 0,
+        })
+
+    # like a drawn map, each light covers a patch of neighbouring polygons
+    def assign_lights(self):
+        count = len(self.polygons)
+        for poly in self.polygons:
+            poly['light'] = min(self.options.lights - 1, poly['index'] * self.options.lights // count + self.rnd.choice([0, 0, 0, 1]))
+
+    def assign_types(self):
+        count = len(self.polygons)
+        platform = self.options.platforms
+        for poly in self.polygons:
+            r = self.rnd.random()
+            if r < platform:
+                poly['type'] = PLATFORM
+            elif r < platform + 0.02:
+                poly['type'] = self.rnd.choice([LIGHT_ON_TRIGGER, LIGHT_OFF_TRIGGER])
+                poly['permutation'] = self.rnd.randrange(self.options.lights)
+            elif r < platform + 0.04:
+                poly['type'] = self.rnd.choice([PLATFORM_ON_TRIGGER, PLATFORM_OFF_TRIGGER])
+                poly['permutation'] = self.rnd.randrange(count)
+            elif r < platform + 0.05:
+                poly['type'] = TELEPORTER
+                poly['permutation'] = self.rnd.randrange(count)
+
+    def build_sides(self):
+        map_type = self.options.map_type
+        for line in self.lines:
+            for side_key, poly_key in (('cw_side', 'cw_poly'), ('ccw_side', 'ccw_poly')):
+                poly_index = line[poly_key]
+                if poly_index < 0:
+                    continue
+                other = line['ccw_poly'] if 'cw_poly' == poly_key else line['cw_poly']
+                poly = self.polygons[poly_index]
+                if 0 <= other and self.rnd.random() < 0.8:
+                    other_poly = self.polygons[other]
+                    if (poly['floor_height'], poly['ceiling_height']) == (other_poly['floor_height'], other_poly['ceiling_height']):
+                        continue
+                side = {
+                    'index': len(self.sides), 'type': 0, 'flags': 0, 'poly': poly_index, 'line': line['index'],
+                    'panel_type': 0, 'panel_permutation': 0,
+                    'primary_transfer': 9 if self.rnd.random() < 0.02 else 0,
+                    'primary_light': poly['light'],
+                    'secondary_light': poly['light'],
+                    'transparent_light': poly['light'],
+                }
+                if self.rnd.random() < 0.06:
+                    side['flags'] = CONTROL_PANEL
+                    switch = self.rnd.choice([LIGHT_SWITCH, PLATFORM_SWITCH, TAG_SWITCH])
+                    side['panel_type'] = switch[map_type]
+                    if LIGHT_SWITCH is switch:
+                        side['panel_permutation'] = self.rnd.randrange(self.options.lights)
+                    elif PLATFORM_SWITCH is switch:
+                        side['panel_permutation'] = self.rnd.randrange(len(self.polygons))
+                    else:
+                        side['panel_permutation'] = self.rnd.randrange(1, self.options.tags + 1)
+                self.sides.append(side)
+                line[side_key] = side['index']
+
+    def write(self, out):
+        rnd = self.rnd
+        options = self.options
+        out.write('<entry index="{}">\n'.format(self.index))
+        out.write('<chunk type="NAME" size="66">Synthetic {} &amp; Friends</chunk>\n'.format(self.index))
+        out.write('<chunk type="Minf" size="88"><mapinfo index="0" environment_code="1" physics_model="0" song_index="0" mission_flags="0" environment_flags="{}" level_name="Synthetic" entry_point_flags="1"/></chunk>\n'.format(rnd.choice([0, 4])))
+        out.write('<chunk type="EPNT" size="1">\n')
+        for index, (x, y) in enumerate(self.endpoints):
+            out.write('<endpoint {}/>\n'.format(attributes({
+                'index': index, 'flags': 0, 'highest_adjacent_floor_height': 0, 'lowest_adjacent_ceiling_height': WORLD_ONE,
+                'x': x, 'y': y, 'transformed_x': x, 'transformed_y': y, 'supporting_polygon_index': 0,
+            })))
+        out.write('</chunk>\n<chunk type="LINS" size="1">\n')
+        for line in self.lines:
+            out.write('<line {}/>\n'.format(attributes({
+                'index': line['index'], 'endpoint1': line['endpoint1'], 'endpoint2': line['endpoint2'], 'flags': line['flags'],
+                'length': self.size, 'highest_adjacent_floor': 0, 'lowest_adjacent_ceiling': WORLD_ONE,
+                'cw_side': line['cw_side'], 'ccw_side': line['ccw_side'], 'cw_poly': line['cw_poly'], 'ccw_poly': line['ccw_poly'],
+            })))
+        out.write('</chunk>\n<chunk type="SIDS" size="1">\n')
+        for side in self.sides:
+            out.write('<side {}/>\n'.format(attributes(side)))
+        out.write('</chunk>\n<chunk type="POLY" size="1">\n')
+        for poly in self.polygons:
+            xs = [self.endpoints[v][0] for v in poly['vertices']]
+            ys = [self.endpoints[v][1] for v in poly['vertices']]
+            transfer = 9 if rnd.random() < 0.01 else 0
+            out.write('<polygon {}/>\n'.format(attributes({
+                'index': poly['index'], 'type': poly['type'], 'flags': 0, 'permutation': poly['permutation'],
+                'vertex_count': len(poly['vertices']),
+                **indexed_values('endpoint_index', poly['vertices']),
+                **indexed_values('line_index', poly['lines']),
+                'floor_texture': 0x1200, 'ceiling_texture': 0x1201,
+                'floor_height': poly['floor_height'], 'ceiling_height': poly['ceiling_height'],
+                'floor_lightsource_index': poly['light'],
+                'ceiling_lightsource_index': poly['light'],
+                'area': self.size * self.size,
+                'floor_transfer_mode': transfer, 'ceiling_transfer_mode': transfer,
+                **indexed_values('adjacent_polygon_index', poly['adjacent']),
+                'center_x': sum(xs) // len(xs), 'center_y': sum(ys) // len(ys),
+                **indexed_values('side_index', []),
+                'media_index': rnd.randrange(2) if 2 == options.map_type and rnd.random() < 0.1 else -1,
+                'media_lightsource_index': poly['light'],
+            })))
+        out.write('</chunk>\n<chunk type="LITE" size="1">\n')
+        for index in range(options.lights):
+            # most lights have no tag, tag switches reach a few
+            tag = rnd.randrange(1, options.tags + 1) if rnd.random() < 0.1 else 0
+            # Marathon 1 lights have no tag
+            tag_attribute = ' tag="{}"'.format(tag) if 2 == options.map_type else ''
+            out.write('<light index="{}" type="0" flags="0" phase="0"{} intensity="0.5">\n'.format(index, tag_attribute))
+            out.write('<primary_active function="0" period="30" delta_period="0" intensity="1.0" delta_intensity="0.0"/>\n')
+            out.write('</light>\n')
+        out.write('</chunk>\n<chunk type="OBJS" size="1">\n')
+        for index in range(options.objects):
+            # the first object is the player start
+            object_type = 3 if 0 == index else rnd.choice([0, 1, 2, 4, 5])
+            poly = rnd.choice(self.polygons)
+            xs = [self.endpoints[v][0] for v in poly['vertices']]
+            ys = [self.endpoints[v][1] for v in poly['vertices']]
+            out.write('<object {}/>\n'.format(attributes({
+                'index': index, 'type': object_type, 'object_index': rnd.randrange(10), 'facing': rnd.choice([0, 128, 256]),
+                'polygon_index': poly['index'], 'location_x': sum(xs) // len(xs), 'location_y': sum(ys) // len(ys),
+                'location_z': 0, 'flags': 0,
+            })))
+        out.write('</chunk>\n')
+        self.write_platforms(out)
+        if 2 == options.map_type:
+            out.write('<chunk type="medi" size="1">\n')
+            for index in range(2):
+                out.write('<media {}/>\n'.format(attributes({
+                    'index': index, 'type': index, 'flags': 0, 'light_index': rnd.randrange(options.lights),
+                    'current_direction': 0, 'current_magnitude': 0.25, 'low': 512, 'high': WORLD_ONE,
+                    'origin_x': 0, 'origin_y': 0, 'height': 512, 'minimum_light_intensity': 0.1, 'texture': 0, 'transfer_mode': 0,
+                })))
+            out.write('</chunk>\n')
+        out.write('<chunk type="NOTE" size="1">\n')
+        for index in range(2):
+            out.write('<annotation index="{0}" type="0" location_x="{1}" location_y="{2}" polygon_index="{0}">Note {0}</annotation>\n'.format(index, 100 * index, -100 * index))
+        out.write('</chunk>\n<chunk type="term" size="1">\n')
+        for index in range(options.terminals):
+            out.write('<terminal index="{}" flags="0" lines_per_page="22">\n'.format(index))
+            out.write('<grouping index="0" flags="0" type="1" permutation="0" start_index="0" length="10" maximum_index="0"/>\n')
+            out.write('<grouping index="1" flags="0" type="{}" permutation="{}" start_index="0" length="0" maximum_index="0"/>\n'.format(rnd.choice([6, 7]), rnd.randrange(len(self.polygons))))
+            out.write('<font_change index="0" offset="0" face="0" color="0"/>\n')
+            out.write('<text>Terminal {}</text>\n'.format(index))
+            out.write('</terminal>\n')
+        out.write('</chunk>\n</entry>\n')
+
+    def write_platforms(self, out):
+        rnd = self.rnd
+        m1 = 1 == self.options.map_type
+        out.write('<chunk type="{}" size="1">\n'.format('plat' if m1 else 'PLAT'))
+        platforms = [p for p in self.polygons if PLATFORM == p['type']]
+        for index, poly in enumerate(platforms):
+            platform = {'index': index, 'type': 0, 'speed': 30, 'delay': 30}
+            flags = rnd.choice(PLATFORM_FLAGS)
+            tag = rnd.randrange(1, self.options.tags + 1) if rnd.random() < 0.5 else 0
+            if m1:
+                platform.update({
+                    'static_flags': flags,
+                    'minimum_floor_height': poly['floor_height'], 'maximum_floor_height': poly['floor_height'] + 512,
+                    'minimum_ceiling_height': poly['ceiling_height'], 'maximum_ceiling_height': poly['ceiling_height'],
+                    'polygon_index': poly['index'], 'tag': tag,
+                })
+            else:
+                platform.update({
+                    'maximum_height': rnd.choice([-1, poly['ceiling_height']]),
+                    'minimum_height': rnd.choice([-1, poly['floor_height']]),
+                    'static_flags': flags, 'polygon_index': poly['index'], 'tag': tag,
+                })
+            out.write('<platform {}/>\n'.format(attributes(platform)))
+        out.write('</chunk>\n')
+
+def write_map(out, options, levels=1):
+    rnd = random.Random(options.seed)
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n<wadfile>\n')
+    out.write('<wadinfo type="{}" size="1" count="{}">Map</wadinfo>\n'.format(options.map_type, levels))
+    for index in range(levels):
+        SynthLevel(index, options, rnd).write(out)
+    out.write('</wadfile>\n')
+
+# every option but the polygon count
+def add_options_arguments(parser):
+    parser.add_argument('--line-density', dest='line_density', type=float, default=0.2, help='share of grid cells split into two triangles, adding a line each')
+    parser.add_argument('--platforms', dest='platforms', type=float, default=0.05, help='share of polygons that are platforms')
+    parser.add_argument('--lights', dest='lights', type=int, help='lights per level, default one per 20 polygons')
+    parser.add_argument('--tags', dest='tags', type=int, default=8, help='distinct light and platform tags, tag switches use these')
+    parser.add_argument('--terminals', dest='terminals', type=int, default=8, help='terminals per level')
+    parser.add_argument('--objects', dest='objects', type=int, help='objects per level, default one per 10 polygons')
+    parser.add_argument('--map-type', dest='map_type', type=int, choices=[1, 2], default=2, help='1 for a Marathon 1 map, 2 for Marathon 2 and later')
+    parser.add_argument('--seed', dest='seed', type=int, default=1, help='random seed, the same options and seed write the same map')
+
+def options_from_args(args, polygons):
+    return Options(polygons, args.line_density, args.platforms, args.lights, args.tags,
+        args.terminals, args.objects, args.map_type, args.seed)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic map XML for benchmarks')
+    parser.add_argument('-o', '--output', dest='output', type=str, help='the map XML to write, standard output by default')
+    parser.add_argument('-p', '--polygons', dest='polygons', type=int, default=1000, help='polygons per level')
+    parser.add_argument('--levels', dest='levels', type=int, default=1, help='number of levels')
+    add_options_arguments(parser)
+    args = parser.parse_args()
+
+    options = options_from_args(args, args.polygons)
+    if args.output:
+        with open(args.output, 'w') as f:
+            write_map(f, options, args.levels)
+    else:
+        write_map(sys.stdout, options, args.levels)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+
+# build every scenario listed in maps.json with one pool of workers
+#
+# the levels of all scenarios are queued on the same pool, so a slow level of
+# one scenario overlaps the others; each scenario's map.json and _preview.html
+# are written once its last level is done
+#
+# levels whose inputs haven't changed since the last build, as recorded in
+# each scenario's build manifest, are skipped and their files left untouched
+#
+# with --watch the levels are decoded once and kept in memory, the site is
+# served on localhost and a change to a map, ignore, chapters or collections
+# file regenerates only the levels it affects before the browser reloads;
+# a change to the build's own modules restarts it
+#
+# inputs are found by filling in the scenario's map_info name, e.g. m3:
+# {name} -> m3, {NAME} -> M3
+#
+#   ./build_site.py -d ../_tmp/site --map '../_tmp/data/{name}-map.xml' \
+#       --ignore '../_tmp/repos/marathon-utils/map-extras/{NAME}_ignored_polys.txt'
+#
+#   ./build_site.py -d site --watch --port 8000
+
+import argparse
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import redirect_stdout
+from functools import partial
+import copy
+import io
+import json
+import os
+import pickle
+import sys
+import time
+import traceback
+
+import map2monsters
+import map2svg
+from map2site import merge_chunk_types
+from mapxml import iter_levels, iter_level_digests
+from levelcache import add_cache_arguments, open_cache
+from manifest import GENERATOR_MODULES, Manifest, generator_version, file_digest, value_digest
+from watch import FileWatcher, ReloadServer, iter_files, restart
+
+# options that change the generated files
+OUTPUT_OPTIONS = ['precision', 'merge_borders', 'legacy_json']
+# modules whose change restarts --watch, the kept levels and running code are stale
+BUILD_MODULES = GENERATOR_MODULES + ['build_site', 'map2site', 'levelcache', 'manifest', 'watch']
+
+class Scenario(object):
+    def __init__(self, map_entry):
+        self.name = map_entry['map_info']
+        self.paths = {'name': self.name, 'NAME': self.name.upper()}
+        self.map_path = args.map.format(**self.paths)
+        self.read_inputs()
+        # the map2svg and map2monsters options of this scenario
+        self.args = copy.copy(args)
+        self.args.output_directory = os.path.join(args.output_directory, self.name)
+        self.base_prefix = self.name + '/'
+        self.clear_levels()
+        self.manifest = Manifest(self.args.output_directory, args.rebuild)
+        self.level_numbers = []
+
+    # the ignored polygons, chapters and collections, read again when watching
+    def read_inputs(self):
+        self.ignore_path = existing_path(args.ignores, self.paths, 'ignore file')
+        self.chapters_path = existing_path(args.chapters, self.paths, 'chapters file')
+        self.collections_path = existing_path(args.collections, self.paths, None)
+        self.ignore_map = map2svg.read_ignore_file(self.ignore_path)
+        self.chapters_dict = map2svg.read_chapters_file(self.chapters_path)
+        self.collections = None
+        if self.collections_path:
+            self.collections = map2monsters.read_collections_file(self.collections_path)
+
+    # the levels recorded for map.json and the preview, emptied before each watch rebuild
+    def clear_levels(self):
+        self.map_info = {
+            'levels': []
+        }
+        self.previews = []
+
+    def start(self):
+        print ('map: {}'.format(self.map_path))
+
+    # the inputs of each wanted level, in the order iter_levels yields them
+    def level_inputs(self, generator):
+        common = {
+            'generator': generator,
+            'options': value_digest({o: getattr(args, o) for o in OUTPUT_OPTIONS}),
+            'collections': file_digest(self.collections_path),
+        }
+        self.level_numbers = []
+        for map_type, level_number, digest in iter_level_digests(self.map_path, args.levels):
+            self.level_numbers.append(level_number)
+            yield level_number, dict(common,
+                map_type=map_type,
+                entry=digest,
+                ignore=value_digest(sorted(self.ignore_map.get(int(level_number), ()))),
+            )
+
+    def levels(self, level_indexes):
+        tools = [map2svg]
+        if self.collections is not None:
+            tools.append(map2monsters)
+        map2svg.mkdir_p(self.args.output_directory)
+        chunk_types, chunk_types_ignored = merge_chunk_types(*tools)
+        yield from iter_levels(self.map_path, chunk_types, chunk_types_ignored, level_indexes, open_cache(args))
+
+    # inputs is None for a level that was already built
+    def record_level(self, level_number, inputs, level_name, base_name, log):
+        sys.stdout.write(log)
+        if inputs is not None:
+            outputs = [base_name + suffix for suffix in ('.svg', '.json', '_MNov.json')]
+            self.manifest.record(level_number, inputs, level_name, base_name, outputs)
+        self.previews.append(map2svg.record_level(int(level_number), level_name, base_name, self.chapters_dict, self.map_info, self.base_prefix))
+
+    def write_map_info(self):
+        map2svg.args = self.args
+        map2svg.write_map_info(self.map_info, self.previews)
+        # a partial build keeps the levels it didn't look at
+        self.manifest.save(None if args.levels else self.level_numbers)
+
+# a scenario input, skipped with a note when the file is missing
+def existing_path(template, paths, description):
+    if not template:
+        return None
+    path = template.format(**paths)
+    if os.path.exists(path):
+        return path
+    if description:
+        print ('no {}: {}'.format(description, path))
+    return None
+
+def build_level(scenario_args, map_type, level_number, name, level_dict, ignore_polys, collections):
+    # the tools read their options from a module level args
+    map2svg.args = map2monsters.args = scenario_args
+    log = io.StringIO()
+    with redirect_stdout(log):
+        # map2svg runs last as it fills in platform extrema and may convert to columnar
+        if collections is not None:
+            map2monsters.process_level(map_type, level_number, name, level_dict, collections, os.path.join(scenario_args.output_directory, ''))
+        level_name, base_name = map2svg.generate_level(map_type, level_number, name, level_dict, ignore_polys)
+    return (level_name, base_name, log.getvalue())
+
+def completed(*result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+# run in this process when there is only one job
+def run_now(fn, *fn_args):
+    return completed(*fn(*fn_args))
+
+# results are handled in the order the levels were read, so the log and
+# map.json match a serial build; at most two levels per job are in flight
+def build_site(scenarios, jobs):
+    pending = deque()
+    def finish():
+        callback, future = pending.popleft()
+        callback(*future.result())
+    pool = None
+    submit = run_now
+    if 1 < jobs:
+        pool = ProcessPoolExecutor(jobs)
+        submit = pool.submit
+    generator = generator_version()
+    try:
+        for scenario in scenarios:
+            pending.append((scenario.start, completed()))
+            inputs = list(scenario.level_inputs(generator))
+            built = {n: scenario.manifest.current(n, i) for n, i in inputs}
+            # only the changed levels are read
+            levels = scenario.levels([int(n) for n, i in inputs if built[n] is None])
+            for level_number, level_inputs in inputs:
+                level = built[level_number]
+                if level is not None:
+                    log = '{:0>2} {}: unchanged\n'.format(level_number, level['name'])
+                    pending.append((partial(scenario.record_level, level_number, None), completed(level['name'], level['base_name'], log)))
+                    continue
+                map_type, _, name, level_dict = next(levels)
+                ignore_polys = scenario.ignore_map.get(int(level_number), set())
+                pending.append((partial(scenario.record_level, level_number, level_inputs), submit(build_level, scenario.args, map_type, level_number, name, level_dict, ignore_polys, scenario.collections)))
+                while len(pending) >= 2 * jobs:
+                    finish()
+            pending.append((scenario.write_map_info, completed()))
+        while pending:
+            finish()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+# a scenario for --watch, its levels decoded once and kept in memory
+class WatchedScenario(object):
+    def __init__(self, scenario):
+        self.scenario = scenario
+        # level number: (entry digest, map type, name, pickled level)
+        self.levels = dict()
+
+    # the input files of the scenario, whether or not they exist yet
+    def paths(self):
+        paths = [self.scenario.map_path]
+        for template in (args.ignores, args.chapters, args.collections):
+            if template:
+                paths.append(template.format(**self.scenario.paths))
+        return paths
+
+    # regenerate the levels whose inputs changed and rewrite map.json
+    def rebuild(self, generator):
+        scenario = self.scenario
+        inputs = list(scenario.level_inputs(generator))
+        # only entries whose bytes changed are read from the map again
+        stale = {n: i['entry'] for n, i in inputs if self.levels.get(n, (None,))[0] != i['entry']}
+        if stale:
+            for map_type, level_number, name, level_dict in scenario.levels([int(n) for n in stale]):
+                # decode every chunk now rather than on each rebuild
+                for chunk_type in level_dict:
+                    level_dict[chunk_type]
+                self.levels[level_number] = (stale[level_number], map_type, name, pickle.dumps(level_dict))
+        self.levels = {n: self.levels[n] for n, i in inputs}
+        scenario.clear_levels()
+        for level_number, level_inputs in inputs:
+            level = scenario.manifest.current(level_number, level_inputs)
+            if level is not None:
+                scenario.record_level(level_number, None, level['name'], level['base_name'], '')
+                continue
+            _, map_type, name, data = self.levels[level_number]
+            ignore_polys = scenario.ignore_map.get(int(level_number), set())
+            # generating changes the level, each build gets its own copy
+            result = build_level(scenario.args, map_type, level_number, name, pickle.loads(data), ignore_polys, scenario.collections)
+            scenario.record_level(level_number, level_inputs, *result)
+        scenario.write_map_info()
+
+# build, then serve the site and rebuild whatever its inputs change
+def watch_site(scenarios, maps_path, port):
+    watched = [WatchedScenario(s) for s in scenarios]
+    generator = generator_version()
+    for w in watched:
+        w.scenario.start()
+        w.rebuild(generator)
+    server = ReloadServer(args.output_directory, port)
+    server.start()
+    module_directory = os.path.dirname(os.path.abspath(__file__))
+    restart_paths = [maps_path] + [os.path.join(module_directory, name + '.py') for name in BUILD_MODULES]
+    # generated files are left out, a rebuild reloads the browser itself
+    scenario_directories = [s.args.output_directory for s in scenarios]
+    def list_paths():
+        paths = list(restart_paths)
+        for w in watched:
+            paths.extend(w.paths())
+        paths.extend(iter_files(args.output_directory, scenario_directories))
+        return paths
+    watcher = FileWatcher(list_paths)
+    try:
+        while True:
+            changed = watcher.wait()
+            start = time.perf_counter()
+            for path in changed:
+                print ('changed: {}'.format(path))
+            if any(p in restart_paths for p in changed):
+                print ('restarting')
+                server.close()
+                restart()
+            try:
+                for w in watched:
+                    scenario_changed = [p for p in changed if p in w.paths()]
+                    if not scenario_changed:
+                        continue
+                    # monster overlays need chunks the kept levels may not have
+                    if args.collections and args.collections.format(**w.scenario.paths) in scenario_changed:
+                        w.levels.clear()
+                    w.scenario.read_inputs()
+                    w.rebuild(generator)
+            except Exception:
+                # a broken input is reported and the next change tried again
+                traceback.print_exc()
+                continue
+            server.reload()
+            print ('reloaded in {:.2f}s'.format(time.perf_counter() - start))
+    except KeyboardInterrupt:
+        server.close()
+
+def read_scenarios(maps_path, names=None):
+    with open(maps_path, 'r') as f:
+        map_entries = json.load(f)
+    return [Scenario(m) for m in map_entries if not names or m['map_info'] in names]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the SVGs, level JSON and overlays of every scenario in maps.json')
+    parser.add_argument('-d', '--dir', dest='output_directory', default='site', help='the site directory, each scenario is written to its map_info subdirectory')
+    parser.add_argument('--maps', dest='maps', type=str, help='the scenario list, defaults to maps.json in the site directory')
+    parser.add_argument('-s', '--scenario', dest='scenarios', type=str, nargs='+', help='which scenarios to build, by map_info name')
+    parser.add_argument('-m', '--map', dest='map', type=str, default='../data/{name}.map.xml', help='map XML or wadfile of a scenario')
+    parser.add_argument('-i', '--ignore', dest='ignores', type=str, default='../marathon-utils/map-extras/{NAME}_ignored_polys.txt', help='polygons to ignore for a scenario')
+    parser.add_argument('-c', '--chapters', dest='chapters', type=str, default='map_info/{name}-chapters.txt', help='chapter markers of a scenario')
+    parser.add_argument('--collections', dest='collections', type=str, default='map_info/{name}-collections.json', help='collection names of a scenario, writes monster overlays when it exists')
+    parser.add_argument('-l', '--level', dest='levels', type=int, nargs='+', help='which levels to generate')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=0, help='generate levels in this many processes, 0 for one per CPU')
+    parser.add_argument('--rebuild', dest='rebuild', action='store_true', help='regenerate every level, ignoring the build manifests')
+    parser.add_argument('--watch', dest='watch', action='store_true', help='keep the levels in memory, serve the site and rebuild the levels whose inputs change, reloading the browser')
+    parser.add_argument('--port', dest='port', type=int, default=8000, help='the port --watch serves the site on')
+    add_cache_arguments(parser)
+    parser.add_argument('--columnar', dest='columnar', action='store_true', help='hold endpoints in NumPy arrays, requires numpy')
+    parser.add_argument('--precision', dest='precision', type=int, default=map2svg.DEFAULT_PRECISION, help='decimals written for coordinates (default {}), a negative value keeps full float precision'.format(map2svg.DEFAULT_PRECISION))
+    parser.add_argument('--precision-report', dest='precision_report', action='store_true', help='print the bytes saved by rounding for each level')
+    parser.add_argument('--merge-borders', dest='merge_borders', action='store_true', help='draw each border class as one path instead of a line per map line')
+    parser.add_argument('--legacy-json', dest='legacy_json', action='store_true', help='write indented level JSON with polygons keyed by index instead of the compact arrays')
+    args = parser.parse_args()
+
+    maps_path = args.maps or os.path.join(args.output_directory, 'maps.json')
+    if args.watch:
+        watch_site(read_scenarios(maps_path, args.scenarios), maps_path, args.port)
+    else:
+        build_site(read_scenarios(maps_path, args.scenarios), args.jobs or os.cpu_count())
+        print ('done')
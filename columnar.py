@@ -0,0 +1,139 @@
+# optional columnar level model: the endpoints are packed into a structured
+# NumPy array that generators can consume in bulk, while RecordView keeps the
+# dict access existing generators rely on
+#
+# numpy is not in REQUIREMENTS, it is only needed for --columnar
+
+from collections.abc import Mapping, Sequence
+import operator
+import re
+
+# imported on first use so plain runs don't pay for numpy
+np = None
+
+# only chunks some generator reads in bulk, lines, polygons and sides are read
+# one field at a time and a view is slower at that than a slotted record
+COLUMNAR_CHUNKS = {
+    'EPNT': 'endpoint',
+}
+
+INDEXED_RE = re.compile('^(?P<field>.+)_(?P<index>\d+)$')
+
+class Columns(object):
+    # a structured array for one element tag, e.g. all POLY polygons
+    # indexed attributes (endpoint_index_0..7) are stored as one (n, 8) field
+    def __init__(self, records):
+        self.names = list(records[0].keys())
+        groups = dict()
+        for name in self.names:
+            match = INDEXED_RE.match(name)
+            if match:
+                groups.setdefault(match['field'], []).append(int(match['index']))
+        self.keys = dict()
+        dtype = []
+        for name in self.names:
+            match = INDEXED_RE.match(name)
+            if match and match['field'] not in self.names and len(groups[match['field']]) > 1:
+                field = match['field']
+                self.keys[name] = (field, int(match['index']))
+                if field not in [d[0] for d in dtype]:
+                    dtype.append((field, np.int32, (max(groups[field]) + 1,)))
+                continue
+            self.keys[name] = (name, None)
+            dtype.append((name, np.int32))
+        self.array = np.zeros(len(records), dtype=dtype)
+        for name, (field, index) in self.keys.items():
+            values = [r[name] for r in records]
+            if index is None:
+                self.array[field] = values
+            else:
+                self.array[field][:, index] = values
+        # plain ints for single values, numpy scalars are slow to read one by one
+        self.values = {name: self.column(name).tolist() for name in self.names}
+
+    def __len__(self):
+        return len(self.array)
+
+    def column(self, name):
+        field, index = self.keys[name]
+        if index is None:
+            return self.array[field]
+        return self.array[field][:, index]
+
+    def value(self, name, row):
+        return self.values[name][row]
+
+class RecordView(Mapping):
+    __slots__ = ('columns', 'row')
+
+    def __init__(self, columns, row):
+        self.columns = columns
+        self.row = row
+
+    def __getitem__(self, key):
+        return self.columns.values[key][self.row]
+
+    def __contains__(self, key):
+        return key in self.columns.keys
+
+    # attribute access as on records.Record
+    def __getattr__(self, name):
+        try:
+            return self.columns.values[name][self.row]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __iter__(self):
+        return iter(self.columns.names)
+
+    def __len__(self):
+        return len(self.columns.names)
+
+class ColumnarList(Sequence):
+    # list-like access to a Columns, yielding a RecordView per element
+    def __init__(self, columns):
+        self.columns = columns
+        self.views = [RecordView(columns, row) for row in range(len(columns))]
+
+    def __getitem__(self, index):
+        return self.views[index]
+
+    def __len__(self):
+        return len(self.views)
+
+def can_pack(records):
+    if not records:
+        return False
+    # compared in order, key views compare as sets one lookup at a time
+    keys = tuple(records[0])
+    values = operator.itemgetter(*keys)
+    for record in records:
+        if tuple(record) != keys:
+            return False
+        # children and text aren't integers either
+        for value in values(record):
+            if type(value) is not int:
+                return False
+    return True
+
+# convert the columnar chunks of a decoded level in place
+# chunks that don't fit the model (non integer values, children) stay as dicts
+def to_columnar(level_dict):
+    global np
+    if np is None:
+        try:
+            import numpy as np
+        except ImportError:
+            raise Exception('the columnar level model requires numpy')
+    for chunk_type, tag in COLUMNAR_CHUNKS.items():
+        chunk_dict = level_dict.get(chunk_type)
+        if not chunk_dict or not can_pack(chunk_dict[tag]):
+            continue
+        chunk_dict[tag] = ColumnarList(Columns(chunk_dict[tag]))
+    return level_dict
+
+def columns(level_dict, chunk_type):
+    records = level_dict[chunk_type][COLUMNAR_CHUNKS[chunk_type]]
+    if isinstance(records, ColumnarList):
+        return records.columns
+    return None
@@ -0,0 +1,46 @@
+# a level's chunks by type, shared by the XML and binary wadfile readers
+#
+# each chunk is decoded on first access and then kept, so a tool only pays
+# for the chunks it reads, whatever it lists in CHUNK_TYPES
+
+from collections.abc import MutableMapping
+
+class Level(MutableMapping):
+    __slots__ = ('chunks', 'pending')
+
+    def __init__(self):
+        self.chunks = dict()
+        self.pending = set()
+
+    # load is called with no arguments the first time chunk_type is read
+    def defer(self, chunk_type, load):
+        self.chunks[chunk_type] = load
+        self.pending.add(chunk_type)
+
+    def __getitem__(self, chunk_type):
+        chunk_dict = self.chunks[chunk_type]
+        if chunk_type in self.pending:
+            chunk_dict = self.chunks[chunk_type] = chunk_dict()
+            self.pending.discard(chunk_type)
+        return chunk_dict
+
+    def __setitem__(self, chunk_type, chunk_dict):
+        self.pending.discard(chunk_type)
+        self.chunks[chunk_type] = chunk_dict
+
+    def __delitem__(self, chunk_type):
+        self.pending.discard(chunk_type)
+        del self.chunks[chunk_type]
+
+    # membership must not decode the chunk
+    def __contains__(self, chunk_type):
+        return chunk_type in self.chunks
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def is_decoded(self, chunk_type):
+        return chunk_type in self.chunks and chunk_type not in self.pending
@@ -0,0 +1,215 @@
+# on-disk cache of decoded map XML levels, used with --cache
+#
+# each level is stored as zlib compressed marshal data under the sha256 of the
+# raw <entry> bytes and the decoder version, so an unchanged level decoded by
+# any of the map tools is reused by the others without touching ElementTree
+# chunks are marshalled separately and only unmarshalled when a tool reads them
+#
+# a chunk is only decoded once a tool reads it, as without the cache, and
+# added to the level's entry afterwards; the entry holds every chunk any tool
+# has read so far, the others are decoded from the map XML when first needed
+
+from collections import defaultdict
+from functools import partial
+import hashlib
+import marshal
+import os
+import threading
+import xml.etree.ElementTree as ET
+import zlib
+
+from mapxml import DECODER_VERSION, level_items
+from records import make_record
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'marathon-svg')
+DEFAULT_CACHE_SIZE = 256 # MB
+CACHE_SUFFIX = '.level'
+# bumped whenever the layout of the cache files changes
+CACHE_FORMAT = 2
+
+def plain_chunk(chunk_dict):
+    plain = dict()
+    for tag, records in chunk_dict.items():
+        plain[tag] = [plain_record(r) for r in records]
+    return plain
+
+# marshal only takes builtin types, records are stored as dicts
+def plain_record(record):
+    if type(record) is dict and 'children' not in record:
+        return record
+    record = dict(record)
+    if 'children' in record:
+        record['children'] = plain_chunk(record['children'])
+    return record
+
+def thaw_chunk(plain):
+    chunk_dict = defaultdict(list)
+    for tag, records in plain.items():
+        for record in records:
+            if 'children' in record:
+                record['children'] = thaw_chunk(record['children'])
+        chunk_dict[tag] = [make_record(tag, r) for r in records]
+    return chunk_dict
+
+def load_chunk(data):
+    return thaw_chunk(marshal.loads(data))
+
+class LevelCache(object):
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE, rebuild=False):
+        self.directory = directory
+        self.max_bytes = max_size * 1024 * 1024
+        self.rebuild = rebuild
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.sizes = dict()
+        for name in os.listdir(directory):
+            if name.endswith(CACHE_SUFFIX):
+                self.sizes[name] = os.path.getsize(os.path.join(directory, name))
+
+    def key(self, raw):
+        digest = hashlib.sha256()
+        digest.update('{}:{}:{}\0'.format(DECODER_VERSION, CACHE_FORMAT, marshal.version).encode())
+        digest.update(raw)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    # the cached items of a level, chunks are marshalled or None when no tool read them yet
+    def load(self, key):
+        if self.rebuild:
+            return None
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                items = marshal.loads(zlib.decompress(f.read()))
+        except (OSError, EOFError, ValueError, TypeError, zlib.error):
+            return None
+        # mark as recently used for eviction, a read only cache just evicts it sooner
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return items
+
+    def store(self, key, items):
+        data = zlib.compress(marshal.dumps(items), 6)
+        path = self.path(key)
+        temp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            # a read only cache stays as it is, the level is decoded again next time
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+        # levels sent to worker processes are stored from the thread pickling them
+        with self.lock:
+            self.sizes[os.path.basename(path)] = len(data)
+            self.evict()
+
+    def open_level(self, raw, chunk_types):
+        return CachedLevel(self, raw, chunk_types)
+
+    def evict(self):
+        total = sum(self.sizes.values())
+        if total <= self.max_bytes:
+            return
+        def mtime(name):
+            try:
+                return os.path.getmtime(os.path.join(self.directory, name))
+            except OSError:
+                return 0
+        for name in sorted(self.sizes.keys(), key=mtime):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= self.sizes.pop(name)
+
+# the items of one <entry> read through the cache, for mapxml.assemble_level:
+# cached chunks are unmarshalled when read, the other wanted chunks are
+# decoded from the raw entry when read and kept for save
+class CachedLevel(object):
+    def __init__(self, cache, raw, chunk_types):
+        self.cache = cache
+        self.raw = raw
+        self.chunk_types = chunk_types
+        self.key = cache.key(raw)
+        self.lock = threading.RLock()
+        self.entry_items = None
+        self.stored = cache.load(self.key)
+        self.changed = False
+        if self.stored is None:
+            # only the name and chunk headers until a chunk is read
+            self.stored = [i[:3] + [None] if 'chunk' == i[0] else i for i in self.parsed_items()]
+            self.changed = True
+        self.items = []
+        for index, item in enumerate(self.stored):
+            if 'chunk' == item[0]:
+                if item[3] is not None:
+                    item = item[:3] + [partial(load_chunk, item[3])]
+                elif item[1]['type'] in chunk_types:
+                    item = item[:3] + [CachedChunk(self, index)]
+            self.items.append(item)
+
+    # the entry parsed with ElementTree, its chunks decoded lazily
+    def parsed_items(self):
+        if self.entry_items is None:
+            self.entry_items = level_items(ET.fromstring(self.raw), self.chunk_types, lazy=True)
+        return self.entry_items
+
+    def decode(self, index):
+        with self.lock:
+            chunk_dict = self.parsed_items()[index][3]()
+            # marshalled now, the tools change the chunks they read
+            self.stored[index] = self.stored[index][:3] + [marshal.dumps(plain_chunk(chunk_dict))]
+            self.changed = True
+            return chunk_dict
+
+    # the marshalled chunk; a level pickled for another process has all its
+    # wanted chunks decoded here at once, so the cache still learns them
+    def marshalled(self, index):
+        with self.lock:
+            if self.stored[index][3] is None:
+                for item in self.items:
+                    if isinstance(item[3], CachedChunk) and self.stored[item[3].index][3] is None:
+                        self.decode(item[3].index)
+                self.save()
+            return self.stored[index][3]
+
+    def save(self):
+        with self.lock:
+            if self.changed:
+                self.cache.store(self.key, self.stored)
+                self.changed = False
+
+class CachedChunk(object):
+    def __init__(self, level, index):
+        self.level = level
+        self.index = index
+
+    def __call__(self):
+        return self.level.decode(self.index)
+
+    # sent to a worker as the marshalled chunk
+    def __reduce__(self):
+        return (partial, (load_chunk, self.level.marshalled(self.index)))
+
+def add_cache_arguments(parser):
+    parser.add_argument('--cache', dest='cache', action='store_true', help='reuse decoded levels from the cache directory and store the ones decoded')
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help='decode every level without reading or writing the cache (the default)')
+    parser.add_argument('--cache-dir', dest='cache_dir', type=str, default=DEFAULT_CACHE_DIR, help='where decoded levels are cached')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=DEFAULT_CACHE_SIZE, help='cache size limit in MB, least recently used levels are evicted')
+    parser.add_argument('--rebuild-cache', dest='rebuild_cache', action='store_true', help='ignore cached levels and store freshly decoded ones, implies --cache')
+
+def open_cache(args):
+    if not (args.cache or args.rebuild_cache):
+        return None
+    return LevelCache(args.cache_dir, args.cache_size, args.rebuild_cache)
@@ -0,0 +1,98 @@
+# build manifest of a site directory
+#
+# for each level the hashes of everything its output files are generated
+# from are recorded with the files, a later build skips a level whose inputs
+# are unchanged and whose files are still there, leaving them untouched
+#
+# files the manifest listed that no level lists any more, e.g. those of a
+# renamed or removed level, are deleted when it is saved
+#
+# {"version": 1, "levels": {"3": {"inputs": {...}, "name": ..., "base_name": ...,
+#   "outputs": ["03_Name.svg", ...]}, ...}}
+
+import errno
+import hashlib
+import json
+import os
+import sys
+
+MANIFEST_NAME = 'build-manifest.json'
+# bumped whenever the layout of the manifest changes
+MANIFEST_VERSION = 1
+
+# the modules output files are generated by, any change to them rebuilds every level
+GENERATOR_MODULES = ['map2svg', 'map2monsters', 'mapxml', 'wadfile', 'records', 'columnar', 'level']
+
+def generator_version():
+    digest = hashlib.sha256()
+    for name in GENERATOR_MODULES:
+        __import__(name)
+        with open(sys.modules[name].__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def file_digest(path):
+    if not path:
+        return None
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def value_digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+class Manifest(object):
+    def __init__(self, directory, rebuild=False):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        # a rebuild still reads the levels, for the files they leave behind
+        self.rebuild = rebuild
+        self.levels = dict()
+        self.outputs = set()
+        try:
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(manifest, dict) and MANIFEST_VERSION == manifest.get('version'):
+            self.levels = manifest['levels']
+            self.outputs = self.listed_outputs()
+
+    def listed_outputs(self):
+        return {o for level in self.levels.values() for o in level['outputs']}
+
+    # the recorded level when it was built from these inputs and its files exist
+    def current(self, level_number, inputs):
+        if self.rebuild:
+            return None
+        level = self.levels.get(level_number)
+        if level is None or inputs != level['inputs']:
+            return None
+        for output in level['outputs']:
+            if not os.path.exists(os.path.join(self.directory, output)):
+                return None
+        return level
+
+    def record(self, level_number, inputs, name, base_name, outputs):
+        self.levels[level_number] = {
+            'inputs': inputs,
+            'name': name,
+            'base_name': base_name,
+            'outputs': [o for o in outputs if os.path.exists(os.path.join(self.directory, o))],
+        }
+
+    # levels not in keep are dropped, e.g. levels removed from the map
+    def save(self, keep=None):
+        if keep is not None:
+            self.levels = {k: v for k, v in self.levels.items() if k in keep}
+        temp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'levels': self.levels}, f, indent=2, sort_keys=True)
+        os.replace(temp_path, self.path)
+        outputs = self.listed_outputs()
+        for output in sorted(self.outputs - outputs):
+            try:
+                os.remove(os.path.join(self.directory, output))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        self.outputs = outputs
@@ -1,16 +1,14 @@
 #!/usr/bin/env python
 
 import argparse
-import xml.etree.ElementTree as ET
 from collections import defaultdict
 from enum import IntFlag, IntEnum, auto
-import traceback
 import json
-import os
-import errno
-import sys
 import re
 
+from mapxml import iter_levels
+from levelcache import add_cache_arguments, open_cache
+
 class MonsterFlags(IntFlag):
     is_omniscent = auto() # ignores line-of-sight during find_closest_appropriate_target() */
     flys = auto()
@@ -200,31 +198,6 @@ CHUNK_TYPES = [
     'OBJS', # objects
     'MNpx', # monster definitions
 ]
-CHUNK_TYPES_IGNORED = [
-    'ambi', # ambient sounds
-    'bonk', # random sounds
-    'iidx', # map indices
-    'Minf', # map info
-
-    # physics related
-    'FXpx',
-    'PRpx',
-    'PXpx',
-    'WPpx',
-
-    'POLY', # polygons
-    'term', # terminals
-    'NOTE', # map annotations
-    'EPNT', # points
-    'PNTS', # points
-    'LINS', # lines
-    'LITE', # lights
-    'SIDS', # polygon sides
-    'plac', # monsters and items
-    'plat', # platforms
-    'PLAT', # platforms
-    'medi', # media
-]
 
 # {
 #     "class": "monster",
@@ -241,66 +214,16 @@ CHUNK_TYPES_IGNORED = [
 #                 },
 
 
-def fix_encoding(text):
-    return re.sub(
-        b'\xc3\xa2',
-        b'\xe2',
-        text.encode()
-    ).replace(
-        b'\xc2',
-        b''
-    ).decode()
-
 def process_map_file(map_xml_path, collections_path, base_prefix=''):
-    tree = ET.parse(map_xml_path)
-    root = tree.getroot()
-    if 'wadfile' != root.tag:
-        return
+    collections = read_collections_file(collections_path)
+    for map_type, level_number, name, level_dict in iter_levels(map_xml_path, CHUNK_TYPES, None, args.levels, open_cache(args)):
+        process_level(map_type, level_number, name, level_dict, collections, base_prefix)
+
+def read_collections_file(collections_path):
     with open(collections_path, 'r') as collections_file:
-        collections = json.load(collections_file)
-    map_type = None
-    level_count = None
-    preview = ''
-    map_info = {
-        'levels': []
-    }
-    level_dicts = list()
-    for child in root:
-        # <wadinfo type="0" size="3863054" count="37">Map</wadinfo>
-        if 'wadinfo' == child.tag:
-            map_type = int(child.attrib['type'])
-            level_count = int(child.attrib['count'])
-            continue
-        if 'entry' != child.tag:
-            continue
-        level_index = int(child.attrib['index'])
-        if args.levels and level_index not in args.levels:
-            continue
-        process_level(map_type, child, collections, base_prefix)
-
-def process_level(map_type, level_root, collections, base_prefix):
-    level_number = level_root.attrib['index']
-    name = None
-    level_dict = {}
-    for chunk in level_root:
-        if 'name' == chunk.tag:
-            name = chunk.text
-        if 'chunk' != chunk.tag or 'type' not in chunk.attrib:
-            continue
-        chunk_type = chunk.attrib['type']
-        if chunk_type in CHUNK_TYPES_IGNORED:
-            continue
-        if 'NAME' == chunk_type:
-            name = chunk.text
-        elif chunk_type in CHUNK_TYPES:
-            level_dict[chunk_type] = process_chunk(chunk)
-            pass
-        else:
-            print ('unhandled chunk: {}'.format(chunk.attrib))
-    for chunk_type in CHUNK_TYPES:
-        if chunk_type not in level_dict:
-            level_dict[chunk_type] = defaultdict(list)
-    name = fix_encoding(name)
+        return json.load(collections_file)
+
+def process_level(map_type, level_number, name, level_dict, collections, base_prefix):
     print ('{:0>2} {}'.format(level_number, name))
     monsters = set()
     for monster in level_dict['OBJS']['object']:
@@ -384,36 +307,13 @@ def find_collection_name(collections, key):
             return name
     return key
 
-def process_chunk(chunk_root):
-    chunk_dict = defaultdict(list)
-    for entry in chunk_root:
-        chunk_dict[entry.tag].append(entry.attrib)
-        if len(list(entry)) > 0:
-            chunk_dict[entry.tag][-1]['children'] = process_chunk(entry)
-        for key,val in chunk_dict[entry.tag][-1].items():
-            try:
-                chunk_dict[entry.tag][-1][key] = int(val)
-                continue
-            except:
-                pass
-            try:
-                chunk_dict[entry.tag][-1][key] = float(val)
-                continue
-            except:
-                pass
-        chunk_dict[entry.tag][-1]['text'] = entry.text
-        if 'index' not in chunk_dict[entry.tag][-1]:
-            chunk_dict[entry.tag][-1]['index'] = 0
-        if chunk_dict[entry.tag][-1]['index'] != len(chunk_dict[entry.tag])-1:
-            print ('out of order entry: {}'.format(chunk_dict[entry.tag]))
-    return chunk_dict
-
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Convert maps to SVG')
-    parser.add_argument('-m', '--map', dest='map', type=str, help='a map XML file')
+    parser.add_argument('-m', '--map', dest='map', type=str, help='a map XML file or binary map wadfile')
     parser.add_argument('-b', '--base_prefix', dest='base_prefix', type=str, help='base directory where map data will be written')
     parser.add_argument('-c', '--collections', dest='collections', type=str, help='a JSON file detailing collection names')
     parser.add_argument('-l', '--level', dest='levels', type=int, nargs='+', help='which levels to generate')
+    add_cache_arguments(parser)
     args = parser.parse_args()
 
     process_map_file(args.map, args.collections, args.base_prefix)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+# single pass driver for map2svg, map2dot and map2monsters
+#
+# each level is read and decoded once and handed to every requested output
+# instead of each tool parsing the whole map on its own
+#
+#   ./map2site.py -d ../_tmp/site/m3 -m ../_tmp/data/m3-map.xml -i M3_ignored_polys.txt -c map_info/m3-chapters.txt -b m3/ \
+#       --collections map_info/m3-collections.json --dot m3.dot
+
+import argparse
+from contextlib import redirect_stdout
+import os
+
+import map2dot
+import map2monsters
+import map2svg
+from mapxml import iter_levels
+from levelcache import add_cache_arguments, open_cache
+
+# map2dot and map2monsters only read a few chunks and don't report others,
+# so map2svg's ignore list is the only one that applies
+def merge_chunk_types(*tools):
+    chunk_types = []
+    for tool in tools:
+        for chunk_type in tool.CHUNK_TYPES:
+            if chunk_type not in chunk_types:
+                chunk_types.append(chunk_type)
+    chunk_types_ignored = [c for c in map2svg.CHUNK_TYPES_IGNORED if c not in chunk_types]
+    return (chunk_types, chunk_types_ignored)
+
+def process_map_file(map_xml_path, ignore_file, chapters_file, base_prefix='', collections_path=None, dot_path=None):
+    print ('map: {}'.format(map_xml_path))
+    tools = [map2svg]
+    if dot_path:
+        tools.append(map2dot)
+    if collections_path:
+        tools.append(map2monsters)
+        collections = map2monsters.read_collections_file(collections_path)
+        monsters_prefix = os.path.join(args.output_directory, '')
+        map2svg.mkdir_p(args.output_directory)
+    chunk_types, chunk_types_ignored = merge_chunk_types(*tools)
+
+    ignore_map = map2svg.read_ignore_file(ignore_file)
+    chapters_dict = map2svg.read_chapters_file(chapters_file)
+    map_info = {
+        'levels': []
+    }
+    previews = []
+    graph_levels = []
+    for map_type, level_number, name, level_dict in iter_levels(map_xml_path, chunk_types, chunk_types_ignored, args.levels, open_cache(args)):
+        # the graph and overlays only read the level, map2svg runs last
+        # as it fills in platform extrema and may convert to columnar
+        if dot_path:
+            graph_levels.append(map2dot.process_level(map_type, level_number, name, level_dict))
+        if collections_path:
+            map2monsters.process_level(map_type, level_number, name, level_dict, collections, monsters_prefix)
+        previews.append(map2svg.process_map_level(map_type, level_number, name, level_dict, ignore_map, chapters_dict, map_info, base_prefix))
+    map2svg.write_map_info(map_info, previews)
+    if dot_path:
+        with open(dot_path, 'w') as f, redirect_stdout(f):
+            print (map2dot.DOT_HEADER)
+            map2dot.generate_graph(graph_levels, chapters_dict)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert maps to SVG, a level graph and monster overlays in one pass')
+    parser.add_argument('-d', '--dir', dest='output_directory', help='specify the output directory')
+    parser.add_argument('-m', '--map', dest='map', type=str, help='a map XML file or binary map wadfile')
+    parser.add_argument('-i', '--ignore', dest='ignores', type=str, help='a file of polygons to ignore')
+    parser.add_argument('-c', '--chapters', dest='chapters', type=str, help='a file of chapter markers')
+    parser.add_argument('-b', '--base_prefix', dest='base_prefix', type=str, help='base directory where map data will be found')
+    parser.add_argument('-l', '--level', dest='levels', type=int, nargs='+', help='which levels to generate')
+    parser.add_argument('--collections', dest='collections', type=str, help='a JSON file detailing collection names, writes monster overlays to the output directory')
+    parser.add_argument('--dot', dest='dot', type=str, help='write the level graph to this DOT file')
+    add_cache_arguments(parser)
+    parser.add_argument('--columnar', dest='columnar', action='store_true', help='hold endpoints in NumPy arrays, requires numpy')
+    parser.add_argument('--precision', dest='precision', type=int, default=map2svg.DEFAULT_PRECISION, help='decimals written for coordinates (default {}), a negative value keeps full float precision'.format(map2svg.DEFAULT_PRECISION))
+    parser.add_argument('--precision-report', dest='precision_report', action='store_true', help='print the bytes saved by rounding for each level')
+    parser.add_argument('--merge-borders', dest='merge_borders', action='store_true', help='draw each border class as one path instead of a line per map line')
+    parser.add_argument('--legacy-json', dest='legacy_json', action='store_true', help='write indented level JSON with polygons keyed by index instead of the compact arrays')
+    args = parser.parse_args()
+
+    # the tools read their options from a module level args
+    map2svg.args = map2dot.args = map2monsters.args = args
+    process_map_file(args.map, args.ignores, args.chapters, args.base_prefix, args.collections, args.dot)
+    print ('done')
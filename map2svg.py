@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 
 import argparse
-import xml.etree.ElementTree as ET
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
 from enum import IntFlag, auto
 import json
 import os
@@ -13,6 +14,16 @@ import math
 import xmltodict
 import operator
 import html
+import io
+
+import levelcache
+import mapxml
+import wadfile
+from mapxml import iter_levels
+from levelcache import add_cache_arguments, open_cache
+from profiling import StageProfile
+from columnar import to_columnar, columns
+from records import indexed
 
 IGNORE_RE = re.compile('(?P<level>\d+): (?P<poly>[\d ]+)')
 
@@ -21,6 +32,9 @@ MAX_INT=32768
 MAX_POS=MAX_INT/SCALE
 ONE_WU=32
 ONE_SCALE_WU=SCALE/ONE_WU
+# one map unit is 1/MAX_POS (~0.03) in SVG space, this many decimals keep
+# every map position distinct
+DEFAULT_PRECISION=math.ceil(math.log10(MAX_POS))
 
 CHUNK_TYPES = [
     'NAME', # map name
@@ -103,6 +117,19 @@ class PlatformFlags(IntFlag):
     is_door = auto()
     floods_m1 = auto()
 
+# facts about a polygon or line that decide its class, see LevelClasses
+# plain int bits as they're combined for every polygon and line, IntFlag
+# arithmetic would cost more than the classification itself
+class ClassFlags(object):
+    ignored = 1 << 0 # listed in the ignore file, for lines: on both sides or missing
+    landscape = 1 << 1 # landscape floor and ceiling, for lines: a landscape side
+    platform = 1 << 2 # has a platform, for lines: on either side
+    secret = 1 << 3 # a secret platform
+    liquid = 1 << 4 # floor below its media
+    ouch = 1 << 5 # damaging floor
+    teleporter = 1 << 6
+    unseen = 1 << 7 # not a platform and no height
+
 def mkdir_p(path):
     try:
         os.makedirs(path)
@@ -145,18 +172,81 @@ def xml_unescape(text):
         ).decode()
     )
 
-def fix_encoding(text):
-    return re.sub(
-        b'\xc3\xa2',
-        b'\xe2',
-        text.encode()
-    ).replace(
-        b'\xc2',
-        b''
-    ).decode()
-
 def process_map_file(map_xml_path, ignore_file, chapters_file, base_prefix=''):
     print ('map: {}'.format(map_xml_path))
+    ignore_map = read_ignore_file(ignore_file)
+    chapters_dict = read_chapters_file(chapters_file)
+    map_info = {
+        'levels': []
+    }
+    levels = iter_levels(map_xml_path, CHUNK_TYPES, CHUNK_TYPES_IGNORED, args.levels, open_cache(args))
+    jobs = args.jobs or os.cpu_count()
+    profile = None
+    if args.profile:
+        # stages are timed in this process
+        jobs = 1
+        profile = StageProfile(args.profile_stats)
+        profile_stages(profile)
+        levels = profile.iter_levels(map_xml_path, levels)
+    if 1 < jobs:
+        previews = process_map_levels(levels, ignore_map, chapters_dict, map_info, base_prefix, jobs)
+    else:
+        previews = []
+        for map_type, level_number, name, level_dict in levels:
+            previews.append(process_map_level(map_type, level_number, name, level_dict, ignore_map, chapters_dict, map_info, base_prefix))
+    write_map_info(map_info, previews)
+    if profile is not None:
+        profile.write(args.profile)
+
+# the stages timed by --profile; each trigger and panel generator call is its own stage
+def profile_stages(profile):
+    this = sys.modules[__name__]
+    profile.wrap(mapxml, 'process_chunk')
+    profile.wrap(wadfile, 'decode_chunk')
+    profile.wrap(levelcache, 'load_chunk')
+    for name in [
+        'render_svg', 'generate_grid', 'generate_polygons', 'generate_lines', 'generate_terminal_lines',
+        'generate_objects', 'generate_panels', 'generate_annotations', 'encode_level_info', 'write_data',
+    ]:
+        profile.wrap(this, name)
+    profile.wrap(this, 'generate_trigger_lines', lambda *a: 'generate_trigger_lines {}'.format(a[5]))
+    profile.wrap(this, 'generate_panel_lines', lambda *a: 'generate_panel_lines {}'.format(a[4]))
+
+# generate levels in a pool of worker processes
+# levels are recorded in map_info and their logs printed in the order they
+# were read, so the output matches a serial run; at most two levels per
+# worker are in flight to keep memory bounded
+def process_map_levels(levels, ignore_map, chapters_dict, map_info, base_prefix, jobs):
+    previews = []
+    pending = []
+    def finish_level():
+        level_index, future = pending.pop(0)
+        level_name, base_name, log = future.result()
+        sys.stdout.write(log)
+        previews.append(record_level(level_index, level_name, base_name, chapters_dict, map_info, base_prefix))
+    with ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(args,)) as pool:
+        for map_type, level_number, name, level_dict in levels:
+            level_index = int(level_number)
+            if level_index not in ignore_map:
+                ignore_map[level_index] = set()
+            pending.append((level_index, pool.submit(generate_level_job, map_type, level_number, name, level_dict, ignore_map[level_index])))
+            if len(pending) >= 2 * jobs:
+                finish_level()
+        while pending:
+            finish_level()
+    return previews
+
+def init_worker(worker_args):
+    global args
+    args = worker_args
+
+def generate_level_job(map_type, level_number, name, level_dict, ignore_polys):
+    log = io.StringIO()
+    with redirect_stdout(log):
+        level_name, base_name = generate_level(map_type, level_number, name, level_dict, ignore_polys)
+    return (level_name, base_name, log.getvalue())
+
+def read_ignore_file(ignore_file):
     ignore_map = dict()
     if ignore_file:
         with open(ignore_file, 'r') as f:
@@ -166,17 +256,10 @@ def process_map_file(map_xml_path, ignore_file, chapters_file, base_prefix=''):
                     break
                 match = IGNORE_RE.match(line)
                 if match:
-                    ignore_map[int(match['level'])] = list(map(int, match['poly'].split(' ')))
-    tree = ET.parse(map_xml_path)
-    root = tree.getroot()
-    if 'wadfile' != root.tag:
-        return
-    map_type = None
-    level_count = None
-    preview = ''
-    map_info = {
-        'levels': []
-    }
+                    ignore_map[int(match['level'])] = set(map(int, match['poly'].split(' ')))
+    return ignore_map
+
+def read_chapters_file(chapters_file):
     chapters_dict = {}
     if chapters_file:
         with open(chapters_file, 'r') as f:
@@ -186,30 +269,34 @@ def process_map_file(map_xml_path, ignore_file, chapters_file, base_prefix=''):
                     break
                 level_index, chapter_name = line.strip().split(' ', 1)
                 chapters_dict[int(level_index)] = chapter_name
-    for child in root:
-        # <wadinfo type="0" size="3863054" count="37">Map</wadinfo>
-        if 'wadinfo' == child.tag:
-            map_type = int(child.attrib['type'])
-            level_count = int(child.attrib['count'])
-            continue
-        if 'entry' != child.tag:
-            continue
-        level_index = int(child.attrib['index'])
-        if args.levels and level_index not in args.levels:
-            continue
-        if level_index not in ignore_map:
-            ignore_map[level_index] = []
-        level_name, base_name = process_level(map_type, child, ignore_map[level_index])
-        if level_index in chapters_dict:
-            map_info['levels'].append({'separator': chapters_dict[level_index]})
-        map_info['levels'].append({
-            'index': level_index,
-            'name': level_name,
-            'base_name': base_prefix+base_name,
-        })
-        preview += '<h3>{:0>2} {}</h3><p><object type="image/svg+xml" data="{}.svg"></object></p>\n'.format(
-            level_index, level_name, base_name)
-    preview = preview_header + preview + '</body></html>'
+    return chapters_dict
+
+# generate one level and record it in map_info, returning its preview entry
+def process_map_level(map_type, level_number, name, level_dict, ignore_map, chapters_dict, map_info, base_prefix=''):
+    level_index = int(level_number)
+    if level_index not in ignore_map:
+        ignore_map[level_index] = set()
+    level_name, base_name = generate_level(map_type, level_number, name, level_dict, ignore_map[level_index])
+    return record_level(level_index, level_name, base_name, chapters_dict, map_info, base_prefix)
+
+def generate_level(map_type, level_number, name, level_dict, ignore_polys):
+    if args.columnar:
+        to_columnar(level_dict)
+    return process_level(map_type, level_number, name, level_dict, ignore_polys)
+
+def record_level(level_index, level_name, base_name, chapters_dict, map_info, base_prefix=''):
+    if level_index in chapters_dict:
+        map_info['levels'].append({'separator': chapters_dict[level_index]})
+    map_info['levels'].append({
+        'index': level_index,
+        'name': level_name,
+        'base_name': base_prefix+base_name,
+    })
+    return '<h3>{:0>2} {}</h3><p><object type="image/svg+xml" data="{}.svg"></object></p>\n'.format(
+        level_index, level_name, base_name)
+
+def write_map_info(map_info, previews):
+    preview = preview_header + ''.join(previews) + '</body></html>'
     out_path = os.path.join(args.output_directory, '_preview.html')
     write_data(out_path, preview)
     map_info_path = os.path.join(args.output_directory, 'map.json')
@@ -219,58 +306,40 @@ def process_map_file(map_xml_path, ignore_file, chapters_file, base_prefix=''):
         "map_info": map_info_path,
     }, indent=2))
 
-def process_level(map_type, level_root, ignore_polys):
-    level_number = level_root.attrib['index']
-    name = None
-    level_dict = {}
-    for chunk in level_root:
-        if 'name' == chunk.tag:
-            name = chunk.text
-        if 'chunk' != chunk.tag or 'type' not in chunk.attrib:
-            continue
-        chunk_type = chunk.attrib['type']
-        if chunk_type in CHUNK_TYPES_IGNORED:
-            continue
-        if 'NAME' == chunk_type:
-            name = chunk.text
-        elif chunk_type in CHUNK_TYPES:
-            level_dict[chunk_type] = process_chunk(chunk)
-            pass
-        else:
-            print ('unhandled chunk: {}'.format(chunk.attrib))
-    for chunk_type in CHUNK_TYPES:
-        if chunk_type not in level_dict:
-            level_dict[chunk_type] = defaultdict(list)
-    name = fix_encoding(name)
+def process_level(map_type, level_number, name, level_dict, ignore_polys):
     print ('{:0>2} {}'.format(level_number, name))
     base_name = re.sub('[^a-zA-Z0-9]', '', name)
     base_name = '{:0>2}_{}'.format(level_number, base_name)
     generate_svg(map_type, base_name, level_dict, ignore_polys)
     return (name, base_name)
 
-def process_chunk(chunk_root):
-    chunk_dict = defaultdict(list)
-    for entry in chunk_root:
-        chunk_dict[entry.tag].append(entry.attrib)
-        if len(list(entry)) > 0:
-            chunk_dict[entry.tag][-1]['children'] = process_chunk(entry)
-        for key,val in chunk_dict[entry.tag][-1].items():
-            try:
-                chunk_dict[entry.tag][-1][key] = int(val)
-                continue
-            except:
-                pass
-            try:
-                chunk_dict[entry.tag][-1][key] = float(val)
-                continue
-            except:
-                pass
-        chunk_dict[entry.tag][-1]['text'] = entry.text
-        if 'index' not in chunk_dict[entry.tag][-1]:
-            chunk_dict[entry.tag][-1]['index'] = 0
-        if chunk_dict[entry.tag][-1]['index'] != len(chunk_dict[entry.tag])-1:
-            print ('out of order entry: {}'.format(chunk_dict[entry.tag]))
-    return chunk_dict
+# coordinates are written with args.precision decimals, dropping trailing
+# zeros and the leading zero of fractions; a negative precision keeps the
+# full float repr
+def svg_number(value):
+    precision = args.precision
+    if precision < 0:
+        return str(value)
+    text = '{:.{}f}'.format(value, precision)
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    if text.startswith('0.'):
+        return text[1:]
+    if text.startswith('-0.'):
+        return '-' + text[2:]
+    if '-0' == text:
+        return '0'
+    return text
+
+# JSON has no leading dot, round and let json write the shortest repr
+def json_number(value):
+    precision = args.precision
+    if precision < 0:
+        return value
+    value = round(float(value), precision)
+    if value.is_integer():
+        return int(value)
+    return value
 
 def build_platform_map(platforms):
     plat_map = dict()
@@ -278,6 +347,10 @@ def build_platform_map(platforms):
         plat_map[platform['polygon_index']] = platform
     return plat_map
 
+# append a <g> wrapping fragments to svg, joined once into a single string
+def write_group(svg, gid, fragments):
+    svg.append(''.join(['<g id="{}">\n'.format(gid), *fragments, '<!-- end group: "{}" -->\n</g>\n'.format(gid)]))
+
 def generate_grid():
     max_dim = SCALE
     width = 2 * max_dim
@@ -335,23 +408,94 @@ def finalize_dimensions(level_info):
         min_y = max(-SCALE, (min_y / ONE_SCALE_WU - 1) * ONE_SCALE_WU)
         max_x = min( SCALE, (max_x / ONE_SCALE_WU + 1) * ONE_SCALE_WU)
         max_y = min( SCALE, (max_y / ONE_SCALE_WU + 1) * ONE_SCALE_WU)
-        level_info['dimensions'][k] = (min_x, min_y, max_x, max_y)
-        level_info['viewBox'][k] = ' '.join(map(str, [min_x, min_y, max_x - min_x, max_y - min_y]))
+        level_info['dimensions'][k] = tuple(map(json_number, (min_x, min_y, max_x, max_y)))
+        level_info['viewBox'][k] = ' '.join(map(svg_number, [min_x, min_y, max_x - min_x, max_y - min_y]))
 
-def update_dimensions(level_info, dim_type, x, y):
+# widen dimensions to cover an extent of (min_x, min_y, max_x, max_y)
+def update_dimensions(level_info, dim_type, extent):
+    if extent is None:
+        return
     current = level_info['dimensions'][dim_type]
     level_info['dimensions'][dim_type] = (
-        min(current[0], x),
-        min(current[1], y),
-        max(current[2], x),
-        max(current[3], y)
+        min(current[0], extent[0]),
+        min(current[1], extent[1]),
+        max(current[2], extent[2]),
+        max(current[3], extent[3])
     )
 
+def points_extent(xs, ys):
+    if not xs:
+        return None
+    return (min(xs), min(ys), max(xs), max(ys))
+
+# every endpoint transformed into SVG space once per level, polygons and
+# borders index into these instead of scaling and formatting shared points
+#
+# generators mark the endpoints that count towards the 'map' and 'lines'
+# dimensions, their extents are reduced once all polygons and lines are done
+#
+# line midpoints are halved in map units before scaling, as they always were,
+# and kept per line since panels and every line pointing at a side share them
+class EndpointGeometry(object):
+    def __init__(self, level_dict):
+        self.marks = {
+            'map': set(),
+            'lines': set(),
+        }
+        self.lines = level_dict['LINS']['line']
+        self.line_centers = {}
+        self.x_array = None
+        endpoint_columns = columns(level_dict, 'EPNT')
+        if endpoint_columns is not None:
+            map_x = endpoint_columns.column('x')
+            map_y = endpoint_columns.column('y')
+            self.map_x = map_x.tolist()
+            self.map_y = map_y.tolist()
+            self.x_array = map_x / MAX_POS
+            self.y_array = map_y / MAX_POS
+            self.x = self.x_array.tolist()
+            self.y = self.y_array.tolist()
+        else:
+            endpoints = level_dict['EPNT']['endpoint']
+            self.map_x = [e.x for e in endpoints]
+            self.map_y = [e.y for e in endpoints]
+            self.x = [x/MAX_POS for x in self.map_x]
+            self.y = [y/MAX_POS for y in self.map_y]
+        self.x_text = list(map(svg_number, self.x))
+        self.y_text = list(map(svg_number, self.y))
+        self.points = list(map('{},{}'.format, self.x_text, self.y_text))
+
+    def mark(self, dim_type, references):
+        self.marks[dim_type].update(references)
+
+    def line_center(self, line_index):
+        center = self.line_centers.get(line_index)
+        if center is None:
+            line = self.lines[line_index]
+            center = self.line_centers[line_index] = (
+                (self.map_x[line.endpoint1] + self.map_x[line.endpoint2]) / 2 / MAX_POS,
+                (self.map_y[line.endpoint1] + self.map_y[line.endpoint2]) / 2 / MAX_POS,
+            )
+        return center
+
+    def extent(self, dim_type):
+        references = list(self.marks[dim_type])
+        if not references:
+            return None
+        if self.x_array is not None:
+            xs = self.x_array[references]
+            ys = self.y_array[references]
+            return (xs.min().item(), ys.min().item(), xs.max().item(), ys.max().item())
+        return points_extent([self.x[r] for r in references], [self.y[r] for r in references])
+
+POLYGON_ENDPOINTS = operator.attrgetter(*indexed('endpoint_index', 8))
+POLYGON_ADJACENT = operator.attrgetter(*indexed('adjacent_polygon_index', 8))
+
 def update_player_position(level_info, player, polygons):
-    polygon = polygons[player['polygon_index']]
+    polygon = polygons[player.polygon_index]
     level_info['player'].append({
-        'index': player['index'],
-        'elevation': polygon['floor_height'] / MAX_INT,
+        'index': player.index,
+        'elevation': polygon.floor_height / MAX_INT,
     })
     level_info['player'] = sorted(level_info['player'], key=operator.itemgetter('index'))
 
@@ -397,20 +541,20 @@ def calculate_platform_extrema(level_dict, platform):
         if adjacent_poly_index < 1 or adjacent_poly_index > len(level_dict['POLY']['polygon']):
             continue
         adjacent_polygon = level_dict['POLY']['polygon'][adjacent_poly_index]
-        if adjacent_polygon['floor_height']<lowest_adjacent_floor:
-            lowest_adjacent_floor = adjacent_polygon['floor_height']
-        if adjacent_polygon['floor_height']>highest_adjacent_floor:
-            highest_adjacent_floor = adjacent_polygon['floor_height']
-        if adjacent_polygon['ceiling_height']<lowest_adjacent_ceiling:
-            lowest_adjacent_ceiling = adjacent_polygon['ceiling_height']
-        if adjacent_polygon['ceiling_height']>highest_adjacent_ceiling:
-            highest_adjacent_ceiling = adjacent_polygon['ceiling_height']
+        if adjacent_polygon.floor_height<lowest_adjacent_floor:
+            lowest_adjacent_floor = adjacent_polygon.floor_height
+        if adjacent_polygon.floor_height>highest_adjacent_floor:
+            highest_adjacent_floor = adjacent_polygon.floor_height
+        if adjacent_polygon.ceiling_height<lowest_adjacent_ceiling:
+            lowest_adjacent_ceiling = adjacent_polygon.ceiling_height
+        if adjacent_polygon.ceiling_height>highest_adjacent_ceiling:
+            highest_adjacent_ceiling = adjacent_polygon.ceiling_height
     # take into account the EXTENDS_FLOOR_TO_CEILING flag
     if PlatformFlags.extends_floor_to_ceiling & platform['static_flags']:
-        if poly['ceiling_height']>highest_adjacent_floor:
-            highest_adjacent_floor = poly['ceiling_height']
-        if poly['floor_height']<lowest_adjacent_ceiling:
-            lowest_adjacent_ceiling = poly['floor_height']
+        if poly.ceiling_height>highest_adjacent_floor:
+            highest_adjacent_floor = poly.ceiling_height
+        if poly.floor_height<lowest_adjacent_ceiling:
+            lowest_adjacent_ceiling = poly.floor_height
     #  calculate floor and ceiling min, max values as appropriate for the platform direction
     if PlatformFlags.comes_from_floor & platform['static_flags'] and PlatformFlags.comes_from_ceiling & platform['static_flags']:
         #  split platforms always meet in the center
@@ -420,34 +564,34 @@ def calculate_platform_extrema(level_dict, platform):
     else:
         if PlatformFlags.comes_from_floor & platform['static_flags']:
             if PlatformFlags.uses_native_polygon_heights & platform['static_flags']:
-                if poly['floor_height']<lowest_adjacent_floor or PlatformFlags.extends_floor_to_ceiling & platform['static_flags']:
-                    lowest_adjacent_floor= poly['floor_height']
+                if poly.floor_height<lowest_adjacent_floor or PlatformFlags.extends_floor_to_ceiling & platform['static_flags']:
+                    lowest_adjacent_floor= poly.floor_height
                 else:
-                    highest_adjacent_floor= poly['floor_height']
+                    highest_adjacent_floor= poly.floor_height
             platform['minimum_floor_height']= lowest_adjacent_floor if lowest_level==NONE else lowest_level
             platform['maximum_floor_height']= highest_adjacent_floor if highest_level==NONE else highest_level
-            platform['minimum_ceiling_height']= platform['maximum_ceiling_height']= poly['ceiling_height']
+            platform['minimum_ceiling_height']= platform['maximum_ceiling_height']= poly.ceiling_height
         elif PlatformFlags.comes_from_ceiling & platform['static_flags']:
             if PlatformFlags.uses_native_polygon_heights & platform['static_flags']:
-                if poly['ceiling_height']>highest_adjacent_ceiling or PlatformFlags.extends_floor_to_ceiling & platform['static_flags']:
-                    highest_adjacent_ceiling= poly['ceiling_height']
+                if poly.ceiling_height>highest_adjacent_ceiling or PlatformFlags.extends_floor_to_ceiling & platform['static_flags']:
+                    highest_adjacent_ceiling= poly.ceiling_height
                 else:
-                    lowest_adjacent_ceiling= poly['ceiling_height']
+                    lowest_adjacent_ceiling= poly.ceiling_height
             platform['minimum_ceiling_height']= lowest_adjacent_ceiling if lowest_level==NONE else lowest_level
             platform['maximum_ceiling_height']= highest_adjacent_ceiling if highest_level==NONE else highest_level
-            platform['minimum_floor_height']= platform['maximum_floor_height']= poly['floor_height']
+            platform['minimum_floor_height']= platform['maximum_floor_height']= poly.floor_height
 
 def update_poly_info(level_info, poly_index=None, poly=None, ids=None, platform=None):
     if poly_index is None and poly is not None:
-        poly_index = poly['index']
+        poly_index = poly.index
     if poly_index is None and platform is not None:
         poly_index = platform['polygon_index']
     if poly_index is None:
         raise Exception('cannot update poly info without poly index or polygon')
     poly_info = level_info['polygons'][poly_index]
     if poly is not None:
-        floor = poly['floor_height']/MAX_INT
-        ceiling = poly['ceiling_height']/MAX_INT
+        floor = poly.floor_height/MAX_INT
+        ceiling = poly.ceiling_height/MAX_INT
         poly_info['floor_height'] = floor
         poly_info['ceiling_height'] = ceiling
         update_elevations(level_info, floor, ceiling)
@@ -460,131 +604,112 @@ def update_poly_info(level_info, poly_index=None, poly=None, ids=None, platform=
     if ids:
         poly_info['connections'].update(ids)
 
-def generate_polygons(level_dict, platform_map, ignore_polys, map_type, level_info):
-    poly_svg = '<g id="polygons">\n'
+def generate_polygons(svg, level_dict, geometry, platform_map, classes, level_info):
+    poly_svg = []
     polys = level_dict['POLY']['polygon']
-    polys = sorted(polys, key=operator.itemgetter('floor_height', 'ceiling_height'))
-    for poly in polys:
-        type='line'
-        list_key='LINS'
-        type='endpoint'
-        list_key='EPNT'
-        css_class = calculate_poly_class(poly, platform_map, ignore_polys, level_dict['medi']['media'], map_type)
-        for index in range(0,poly['vertex_count']):
-            reference = poly['{}_index_{}'.format(type, index)]
-            entry = level_dict[list_key][type][reference]
-            x = entry['x']/MAX_POS
-            y = entry['y']/MAX_POS
-            if css_class not in ['ignore', 'landscape_']:
-                update_dimensions(level_info, 'map', x,y)
-            update_dimensions(level_info, 'lines', x,y)
-        points = range(0,poly['vertex_count'])
-        points = map(lambda p: poly['{}_index_{}'.format(type, p)], points)
-        points = map(lambda p: level_dict[list_key][type][p], points)
-        points = map(lambda p: (p['x']/MAX_POS, p['y']/MAX_POS), points)
-        points = map(lambda p: (str(p[0]),str(p[1])),points)
-        points = map(','.join, points)
+    order = sorted(range(len(polys)), key=lambda i: (polys[i].floor_height, polys[i].ceiling_height))
+    for position in order:
+        poly = polys[position]
+        css_class = POLYGON_CLASSES[classes.polygon_classes[position]]
+        references = POLYGON_ENDPOINTS(poly)[:poly.vertex_count]
+        if css_class not in ['ignore', 'landscape_']:
+            geometry.mark('map', references)
+        geometry.mark('lines', references)
+        points = [geometry.points[r] for r in references]
         extra = 'onmousemove="showTooltip(evt, \'{tooltip}\', {x}, {y});" onmouseout="hideTooltip();"'.format(
-            x=poly['center_x']/MAX_POS,
-            y=poly['center_y']/MAX_POS,
+            x=poly.center_x/MAX_POS,
+            y=poly.center_y/MAX_POS,
             tooltip='poly:{poly_index}'.format(
-                poly_index=poly['index']
+                poly_index=poly.index
             )
         )
         extra = ''
-        css_id = 'poly_{}'.format(poly['index'])
-        poly_svg += '<polygon points="{path}" id="{css_id}" class="{css_class}" {extra}/>\n'.format(
+        css_id = 'poly_{}'.format(poly.index)
+        poly_svg.append('<polygon points="{path}" id="{css_id}" class="{css_class}" {extra}/>\n'.format(
             path=' '.join(points),
             css_id=css_id,
             css_class=css_class,
             extra=extra,
-        )
+        ))
         update_overlays(level_info, selectors='polygon.{}'.format(css_class))
         update_poly_info(level_info, poly=poly, ids=[css_id])
-        if poly['type'] == 5:
-            platform = platform_map[poly['index']]
+        if poly.type == 5:
+            platform = platform_map[poly.index]
             calculate_platform_extrema(level_dict, platform)
             update_poly_info(level_info, platform=platform)
-    poly_svg += '<!-- end group: "polygons" -->\n</g>\n'
-    return poly_svg
+    write_group(svg, 'polygons', poly_svg)
 
-def generate_trigger_lines(level_dict, poly_type, css_class_base, level_info):
-    line_svg = ''
+def generate_trigger_lines(svg, level_dict, geometry, relations, poly_type, css_class_base, level_info):
+    line_svg = []
     platform_polys = []
     if 0 < len(level_dict['PLAT']):
         platform_polys = map(lambda p: p['polygon_index'], level_dict['PLAT']['platform'])
     if 0 < len(level_dict['plat']):
         platform_polys = map(lambda p: p['polygon_index'], level_dict['plat']['platform'])
     for poly in level_dict['POLY']['polygon']:
-        if poly['type'] != poly_type:
+        if poly.type != poly_type:
             continue
         tag_ids = set()
         poly_ids = set()
         light_ids = set()
         if poly_type == 10:
-            poly_ids = {poly['permutation']}
+            poly_ids = {poly.permutation}
         if poly_type in [7,9]:
             # exclude any platform triggers that don't point to platforms
-            poly_ids = [p['index'] for p in [level_dict['POLY']['polygon'][poly['permutation']]] if p['index'] in platform_polys or p['type'] == 5]
+            poly_ids = [p['index'] for p in [level_dict['POLY']['polygon'][poly.permutation]] if p['index'] in platform_polys or p['type'] == 5]
         if poly_type in [6,8]:
             # light triggers reference lights which might be used by multiple polygons
-            light_ids = {poly['permutation']}
-        line_svg += common_generate_lines(css_class_base, poly, poly_ids, light_ids, tag_ids, level_dict, level_info)
+            light_ids = {poly.permutation}
+        common_generate_lines(line_svg, css_class_base, poly, poly_ids, light_ids, tag_ids, level_dict, geometry, relations, level_info)
     if not line_svg:
-        return ''
+        return
     gid = 'poly_{}_lines'.format(css_class_base)
     update_overlays(level_info, classes=['poly_line'], groups=[gid])
-    return '<g id="{gid}">\n{content}<!-- end group: "{gid}" -->\n</g>\n'.format(
-        gid=gid,
-        content=line_svg
-    )
+    write_group(svg, gid, line_svg)
 
-def generate_panel_lines(level_dict, css_class_base, platform_map, map_type, level_info):
-    line_svg = ''
+def generate_panel_lines(svg, level_dict, geometry, relations, css_class_base, platform_map, map_type, level_info):
+    line_svg = []
     for side in level_dict['SIDS']['side']:
-        if not side['flags'] & 0x2:
+        if not side.flags & 0x2:
             continue
-        panel_type = panel_to_switch(map_type, side['panel_type'])
+        panel_type = panel_to_switch(map_type, side.panel_type)
         if not panel_type or panel_type != css_class_base:
             continue
         tag_ids = set()
         poly_ids = set()
         light_ids = set()
         if 'platform_switch' == panel_type:
-            poly_ids = {side['panel_permutation']}
+            poly_ids = {side.panel_permutation}
         if 'light_switch' == panel_type:
             # light triggers reference lights which might be used by multiple polygons
-            light_ids = {side['panel_permutation']}
+            light_ids = {side.panel_permutation}
         if 'tag_switch' == panel_type:
             # tag triggers reference tags which might be used by multiple polygons and lights
-            tag_ids = {side['panel_permutation']}
+            tag_ids = {side.panel_permutation}
         # common lines
-        line_svg += common_generate_lines(css_class_base, side, poly_ids, light_ids, tag_ids, level_dict, level_info)
+        common_generate_lines(line_svg, css_class_base, side, poly_ids, light_ids, tag_ids, level_dict, geometry, relations, level_info)
     if not line_svg:
-        return ''
+        return
     gid = 'panel_{}_lines'.format(css_class_base)
     # allow switch lines to be handled by level.js
 #     update_overlays(level_info, classes=['panel_line'], groups=[gid])
-    return '<g id="{gid}">\n{content}<!-- end group: "{gid}" -->\n</g>\n'.format(
-        gid=gid,
-        content=line_svg
-    )
+    write_group(svg, gid, line_svg)
 
-def generate_terminal_lines(level_dict, page_type, css_class_base, map_type, level_info):
+def generate_terminal_lines(svg, level_dict, geometry, relations, page_type, css_class_base, map_type, level_info):
     terminal_destination_map = defaultdict(list)
     for terminal in level_dict['term']['terminal']:
         for grouping in terminal['children']['grouping']:
             if grouping['type'] != page_type:
                 continue
             terminal_destination_map[terminal['index']].append(grouping['permutation'])
-    line_svg = ''
+    line_svg = []
     for side in level_dict['SIDS']['side']:
-        if not side['flags'] & 0x2:
+        if not side.flags & 0x2:
             continue
-        panel_type = panel_to_type(map_type, side['panel_type'])
+        panel_type = panel_to_type(map_type, side.panel_type)
         if not panel_type or panel_type != 'computer_terminal':
             continue
-        terminal_id = side['panel_permutation']
+        terminal_id = side.panel_permutation
         if terminal_id not in terminal_destination_map:
             continue
         tag_ids = set()
@@ -596,210 +721,327 @@ def generate_terminal_lines(level_dict, page_type, css_class_base, map_type, lev
             # tag control: reference tags which might be used by multiple polygons and lights
             tag_ids = terminal_destination_map[terminal_id]
         # common lines
-        line_svg += common_generate_lines(css_class_base, side, poly_ids, set(), tag_ids, level_dict, level_info)
+        common_generate_lines(line_svg, css_class_base, side, poly_ids, set(), tag_ids, level_dict, geometry, relations, level_info)
 
     if not line_svg:
-        return ''
+        return
     gid = '{}_lines'.format(css_class_base)
     # allow terminal lines to be handled by level.js
 #     update_overlays(level_info, classes=['terminal_line'], groups=[gid])
-    return '<g id="{gid}">\n{content}<!-- end group: "{gid}" -->\n</g>\n'.format(
-        gid=gid,
-        content=line_svg
-    )
-
-def common_build_destinations(polygons, lights, tags, level_dict):
-    tag_ids = set(tags)
-    poly_ids = set(polygons)
-    light_ids = set(lights)
-    side_ids = set()
-    media_ids = set()
-    platform_ids = set()
-    for tag_id in tag_ids:
-        light_ids.update([l['index'] for l in level_dict['LITE']['light'] if l['tag'] == tag_id])
-        if 0 < len(level_dict['PLAT']):
-            platform_ids.update([p['index'] for p in level_dict['PLAT']['platform'] if p['tag'] == tag_id])
-        if 0 < len(level_dict['plat']):
-            platform_ids.update([p['index'] for p in level_dict['plat']['platform'] if p['tag'] == tag_id])
-    for platform_id in platform_ids:
-        if 0 < len(level_dict['PLAT']):
-            poly_ids.update([level_dict['PLAT']['platform'][platform_id]['polygon_index']])
-        if 0 < len(level_dict['plat']):
-            poly_ids.update([level_dict['plat']['platform'][platform_id]['polygon_index']])
-    for light_id in light_ids:
-        poly_ids.update([p['index'] for p in level_dict['POLY']['polygon'] if any(map(lambda l: p[l] == light_id, ['floor_lightsource_index', 'ceiling_lightsource_index', 'media_lightsource_index']))])
-        side_ids.update([s['index'] for s in level_dict['SIDS']['side'] if any(map(lambda l: s[l] == light_id, ['primary_light', 'secondary_light', 'transparent_light']))])
-        media_ids.update([m['index'] for m in level_dict['medi']['media'] if m['light_index'] == light_id])
-    for media_id in media_ids:
-        poly_ids.update([p['index'] for p in level_dict['POLY']['polygon'] if p['media_index'] == media_id])
-    dest_polys = [p for p in level_dict['POLY']['polygon'] if p['index'] in poly_ids]
-    dest_sides = [s for s in level_dict['SIDS']['side'] if s['index'] in side_ids]
-    return dest_polys, dest_sides
-
-def common_generate_lines(css_class_base, source, poly_ids, light_ids, tag_ids, level_dict, level_info):
-    (dest_polys, dest_sides) = common_build_destinations(poly_ids, light_ids, tag_ids, level_dict)
-    line_svg = ''
+    write_group(svg, gid, line_svg)
+
+PLATFORM_ACTIVATES_ADJACENT = (
+    PlatformFlags.activates_adjacent_platforms_when_activating |
+    PlatformFlags.activates_adjacent_platforms_when_deactivating |
+    PlatformFlags.activates_adjacent_platforms_at_each_level
+)
+
+def node_key(node):
+    return (node[0], int(node[1:]))
+
+# node lists are written as one space separated string, the level JSON is
+# indented and would otherwise spend a line on every node
+def node_list(nodes):
+    return ' '.join(sorted(nodes, key=node_key))
+
+# reverse relationships between tags, lights, media, platforms, polygons and
+# sides, built once per level so every trigger, switch and terminal resolves
+# its destinations by lookup instead of rescanning the level
+#
+# it also collects the activation graph written to the level JSON, nodes are
+# 'p'olygons, 's'ides, 'l'ights, 't'ags, 'm'edia and 'P'latforms (by polygon)
+class RelationIndex(object):
+    def __init__(self, level_dict):
+        self.polygons = level_dict['POLY']['polygon']
+        self.sides = level_dict['SIDS']['side']
+        self.polygon_positions = {p.index: i for i, p in enumerate(self.polygons)}
+        self.side_positions = {s.index: i for i, s in enumerate(self.sides)}
+        self.tag_lights = defaultdict(set)
+        self.tag_platforms = defaultdict(set)
+        self.platform_polygons = defaultdict(set)
+        self.light_polygons = defaultdict(set)
+        self.light_sides = defaultdict(set)
+        self.light_media = defaultdict(set)
+        self.media_polygons = defaultdict(set)
+        self.polygon_platforms = dict()
+        self.sources = dict()
+        for light in level_dict['LITE']['light']:
+            # Marathon 1 lights have no tag
+            tag = light.get('tag')
+            if tag is None or tag < 0:
+                continue
+            self.tag_lights[tag].add(light['index'])
+        for platform_type in ['PLAT', 'plat']:
+            if 0 < len(level_dict[platform_type]):
+                for platform in level_dict[platform_type]['platform']:
+                    self.tag_platforms[platform['tag']].add(platform['index'])
+                    self.platform_polygons[platform['index']].add(platform['polygon_index'])
+                    self.polygon_platforms.setdefault(platform['polygon_index'], platform)
+        for poly in self.polygons:
+            for light_id in {poly.floor_lightsource_index, poly.ceiling_lightsource_index, poly.media_lightsource_index}:
+                self.light_polygons[light_id].add(poly.index)
+            self.media_polygons[poly.media_index].add(poly.index)
+        for side in self.sides:
+            for light_id in {side.primary_light, side.secondary_light, side.transparent_light}:
+                self.light_sides[light_id].add(side.index)
+        for media in level_dict['medi']['media']:
+            self.light_media[media['light_index']].add(media['index'])
+
+    # polygons and sides affected by the given polygons, lights and tags, in level order
+    def build_destinations(self, polygons, lights, tags):
+        poly_ids = set(polygons)
+        light_ids = set(lights)
+        side_ids = set()
+        media_ids = set()
+        platform_ids = set()
+        for tag_id in set(tags):
+            light_ids.update(self.tag_lights.get(tag_id, ()))
+            platform_ids.update(self.tag_platforms.get(tag_id, ()))
+        for platform_id in platform_ids:
+            poly_ids.update(self.platform_polygons[platform_id])
+        for light_id in light_ids:
+            poly_ids.update(self.light_polygons.get(light_id, ()))
+            side_ids.update(self.light_sides.get(light_id, ()))
+            media_ids.update(self.light_media.get(light_id, ()))
+        for media_id in media_ids:
+            poly_ids.update(self.media_polygons.get(media_id, ()))
+        dest_polys = [self.polygons[i] for i in sorted(self.polygon_positions[p] for p in poly_ids if p in self.polygon_positions)]
+        dest_sides = [self.sides[i] for i in sorted(self.side_positions[s] for s in side_ids if s in self.side_positions)]
+        return dest_polys, dest_sides
+
+    # record what a switch, trigger polygon or terminal points at
+    # teleports only lead to polygons, any other polygon target is activated
+    def add_source(self, source_id, teleport, poly_ids, light_ids, tag_ids):
+        source = self.sources.setdefault(source_id, {'targets': set()})
+        for poly_id in poly_ids:
+            kind = 'P' if not teleport and poly_id in self.polygon_platforms else 'p'
+            source['targets'].add('{}{}'.format(kind, poly_id))
+        source['targets'].update('l{}'.format(l) for l in light_ids)
+        source['targets'].update('t{}'.format(t) for t in tag_ids)
+
+    def node_targets(self, node):
+        kind, index = node[0], int(node[1:])
+        targets = set()
+        if 't' == kind:
+            targets.update('l{}'.format(l) for l in self.tag_lights.get(index, ()))
+            for platform_id in self.tag_platforms.get(index, ()):
+                targets.update('P{}'.format(p) for p in self.platform_polygons[platform_id])
+        elif 'l' == kind:
+            targets.update('p{}'.format(p) for p in self.light_polygons.get(index, ()))
+            targets.update('s{}'.format(s) for s in self.light_sides.get(index, ()))
+            targets.update('m{}'.format(m) for m in self.light_media.get(index, ()))
+        elif 'm' == kind:
+            targets.update('p{}'.format(p) for p in self.media_polygons.get(index, ()))
+        elif 'P' == kind:
+            targets.add('p{}'.format(index))
+            platform = self.polygon_platforms.get(index)
+            position = self.polygon_positions.get(index)
+            if platform is not None and position is not None:
+                poly = self.polygons[position]
+                if platform['static_flags'] & PLATFORM_ACTIVATES_ADJACENT:
+                    for adjacent in POLYGON_ADJACENT(poly)[:poly.vertex_count]:
+                        if adjacent in self.polygon_platforms:
+                            targets.add('P{}'.format(adjacent))
+                if platform['static_flags'] & PlatformFlags.activates_light:
+                    targets.update('l{}'.format(l) for l in [poly.floor_lightsource_index, poly.ceiling_lightsource_index] if l >= 0)
+        targets.discard(node)
+        return targets
+
+    # every source with what it reaches through tags, lights, media and
+    # platforms chaining into adjacent platforms, and the edges on the way
+    def activation_graph(self):
+        edges = dict()
+        sources = dict()
+        for source_id, source in sorted(self.sources.items(), key=lambda s: node_key(s[0])):
+            reached = set()
+            pending = list(source['targets'])
+            while pending:
+                node = pending.pop()
+                if node in reached:
+                    continue
+                reached.add(node)
+                if node not in edges:
+                    edges[node] = self.node_targets(node)
+                pending.extend(edges[node])
+            entry = {
+                'targets': node_list(source['targets']),
+                'affects': node_list(n for n in reached if n[0] in 'ps' and n != source_id),
+            }
+            if 'group' in source:
+                entry['group'] = source['group']
+            sources[source_id] = entry
+        return {
+            'sources': sources,
+            'edges': {n: node_list(t) for n, t in sorted(edges.items(), key=lambda e: node_key(e[0])) if t},
+        }
+
+def common_generate_lines(svg, css_class_base, source, poly_ids, light_ids, tag_ids, level_dict, geometry, relations, level_info):
+    (dest_polys, dest_sides) = relations.build_destinations(poly_ids, light_ids, tag_ids)
+    line_svg = []
     if 'vertex_count' in source:
-        source_id = 'p{}'.format(source['index'])
-        pcx = source['center_x'] / MAX_POS
-        pcy = source['center_y'] / MAX_POS
-        source_polys = [source['index']]
+        source_id = 'p{}'.format(source.index)
+        pcx = source.center_x / MAX_POS
+        pcy = source.center_y / MAX_POS
+        source_polys = [source.index]
     if 'line' in source:
-        source_id = 's{}'.format(source['index'])
-        line = level_dict['LINS']['line'][source['line']]
-        px1 = level_dict['EPNT']['endpoint'][line['endpoint1']]['x']
-        py1 = level_dict['EPNT']['endpoint'][line['endpoint1']]['y']
-        px2 = level_dict['EPNT']['endpoint'][line['endpoint2']]['x']
-        py2 = level_dict['EPNT']['endpoint'][line['endpoint2']]['y']
-        pcx = (px1 + px2) / 2 / MAX_POS
-        pcy = (py1 + py2) / 2 / MAX_POS
+        source_id = 's{}'.format(source.index)
+        line = level_dict['LINS']['line'][source.line]
+        (pcx, pcy) = geometry.line_center(source.line)
         source_polys = filter(
             lambda i: i >= 0,
             map(
-                lambda s: line[s],
+                lambda s: getattr(line, s),
                 ['cw_poly', 'ccw_poly']))
+    relations.add_source(source_id, css_class_base in ['teleporter', 'terminal_teleport'], poly_ids, light_ids, tag_ids)
+    pcx_text = svg_number(pcx)
+    pcy_text = svg_number(pcy)
     for dest_poly in dest_polys:
         # lines to the polys
-        if 'p{}'.format(dest_poly['index']) == source_id:
+        if 'p{}'.format(dest_poly.index) == source_id:
             continue
-        dcx=dest_poly['center_x'] / MAX_POS
-        dcy=dest_poly['center_y'] / MAX_POS
+        dcx=dest_poly.center_x / MAX_POS
+        dcy=dest_poly.center_y / MAX_POS
         if pcx == dcx and pcy == dcy:
 #             print ('skipping 0 length line')
             continue
-        gid = 'panel_{}_line_group_poly_{}_p{}'.format(css_class_base, source_id, dest_poly['index'])
+        gid = 'panel_{}_line_group_poly_{}_p{}'.format(css_class_base, source_id, dest_poly.index)
         group_class = 'panel_line panel_line-{css_class_base} panel_line_poly-{css_class_base}'.format(
             css_class_base=css_class_base
         )
         for source in source_polys:
             update_poly_info(level_info, poly_index=source, ids=[gid])
-        update_poly_info(level_info, poly_index=dest_poly['index'], ids=[gid])
-        line_svg += '<g id="{g_id}">\n'.format(
+        update_poly_info(level_info, poly_index=dest_poly.index, ids=[gid])
+        line_svg.append('<g id="{g_id}">\n'.format(
             g_id=gid
-        )
+        ))
         rotation = math.atan2(dcy-pcy, dcx-pcx) * 180 / math.pi
+        dcx_text = svg_number(dcx)
+        dcy_text = svg_number(dcy)
         transform = 'transform="rotate({rotation} {cx} {cy})" '.format(
-            rotation=rotation,
-            cx=dcx,
-            cy=dcy,
+            rotation=svg_number(rotation),
+            cx=dcx_text,
+            cy=dcy_text,
         )
-        line_svg += '<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" id="{css_id}" class="{css_class}" />\n'.format(
-            x1=pcx, y1=pcy, x2=dcx, y2=dcy,
-            css_id='panel_{}_border_{}_p{}'.format(css_class_base, source_id, dest_poly['index']),
+        line_svg.append('<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" id="{css_id}" class="{css_class}" />\n'.format(
+            x1=pcx_text, y1=pcy_text, x2=dcx_text, y2=dcy_text,
+            css_id='panel_{}_border_{}_p{}'.format(css_class_base, source_id, dest_poly.index),
             css_class='{}_border'.format(css_class_base)
-        )
-        line_svg += '<use xlink:href="../resources/svg/common.svg#{symbol}" x="{cx}" y="{cy}" id="{css_id}" class="{css_class}" {transform}/>\n'.format(
+        ))
+        line_svg.append('<use xlink:href="../resources/svg/common.svg#{symbol}" x="{cx}" y="{cy}" id="{css_id}" class="{css_class}" {transform}/>\n'.format(
             symbol='arrow',
-            cx=dcx,
-            cy=dcy,
+            cx=dcx_text,
+            cy=dcy_text,
             transform=transform,
-            css_id='panel_{}_head_{}_p{}'.format(css_class_base, source_id, dest_poly['index']),
+            css_id='panel_{}_head_{}_p{}'.format(css_class_base, source_id, dest_poly.index),
             css_class='{}_line'.format(css_class_base),
-        )
-        line_svg += '<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" id="{css_id}" class="{css_class}" />\n'.format(
-            x1=pcx, y1=pcy, x2=dcx, y2=dcy,
-            css_id='panel_{}_line_{}_p{}'.format(css_class_base, source_id, dest_poly['index']),
+        ))
+        line_svg.append('<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" id="{css_id}" class="{css_class}" />\n'.format(
+            x1=pcx_text, y1=pcy_text, x2=dcx_text, y2=dcy_text,
+            css_id='panel_{}_line_{}_p{}'.format(css_class_base, source_id, dest_poly.index),
             css_class='{}_line'.format(css_class_base)
-        )
-        line_svg += '<!-- end group: "{g_id}" -->\n</g>\n'.format(
+        ))
+        line_svg.append('<!-- end group: "{g_id}" -->\n</g>\n'.format(
             g_id=gid
-        )
+        ))
     for dest_side in dest_sides:
         # lines to the sides
-        if 's{}'.format(dest_side['index']) == source_id:
+        if 's{}'.format(dest_side.index) == source_id:
             continue
-        dest_line = level_dict['LINS']['line'][dest_side['line']]
-        x1 = level_dict['EPNT']['endpoint'][dest_line['endpoint1']]['x']
-        y1 = level_dict['EPNT']['endpoint'][dest_line['endpoint1']]['y']
-        x2 = level_dict['EPNT']['endpoint'][dest_line['endpoint2']]['x']
-        y2 = level_dict['EPNT']['endpoint'][dest_line['endpoint2']]['y']
-        dcx = (x1 + x2) / 2 / MAX_POS
-        dcy = (y1 + y2) / 2 / MAX_POS
+        (dcx, dcy) = geometry.line_center(dest_side.line)
         if pcx == dcx and pcy == dcy:
 #             print ('skipping 0 length line')
             continue
-        gid = 'panel_{}_line_group_side_{}_s{}'.format(css_class_base, source_id, dest_side['index'])
+        gid = 'panel_{}_line_group_side_{}_s{}'.format(css_class_base, source_id, dest_side.index)
         group_class = 'panel_line panel_line-{css_class_base} panel_line_side-{css_class_base}'.format(
             css_class_base=css_class_base
         )
-        side_line = level_dict['LINS']['line'][dest_side['line']]
+        side_line = level_dict['LINS']['line'][dest_side.line]
         for source in source_polys:
             update_poly_info(level_info, poly_index=source, ids=[gid])
         dest_polys = filter(
             lambda i: i >= 0,
             map(
-                lambda s: level_dict['LINS']['line'][dest_side['line']][s],
+                lambda s: getattr(level_dict['LINS']['line'][dest_side.line], s),
                 ['cw_poly', 'ccw_poly']))
         for dest_poly in dest_polys:
             update_poly_info(level_info, poly_index=dest_poly, ids=[gid])
-        line_svg += '<g id="{g_id}" class="{g_class}">\n'.format(
+        line_svg.append('<g id="{g_id}" class="{g_class}">\n'.format(
             g_id=gid,
             g_class=group_class
-        )
+        ))
         rotation = math.atan2(dcy-pcy, dcx-pcx) * 180 / math.pi
+        dcx_text = svg_number(dcx)
+        dcy_text = svg_number(dcy)
         transform = 'transform="rotate({rotation} {cx} {cy})" '.format(
-            rotation=rotation,
-            cx=dcx,
-            cy=dcy,
+            rotation=svg_number(rotation),
+            cx=dcx_text,
+            cy=dcy_text,
         )
-        line_svg += '<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" id="{css_id}" class="{css_class}" />\n'.format(
-            x1=pcx, y1=pcy, x2=dcx, y2=dcy,
-            css_id='panel_{}_border_{}_s{}'.format(css_class_base, source_id, dest_side['index']),
+        line_svg.append('<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" id="{css_id}" class="{css_class}" />\n'.format(
+            x1=pcx_text, y1=pcy_text, x2=dcx_text, y2=dcy_text,
+            css_id='panel_{}_border_{}_s{}'.format(css_class_base, source_id, dest_side.index),
             css_class='{}_border'.format(css_class_base)
-        )
-        line_svg += '<use xlink:href="../resources/svg/common.svg#{symbol}" x="{cx}" y="{cy}" id="{css_id}" class="{css_class}" {transform}/>\n'.format(
+        ))
+        line_svg.append('<use xlink:href="../resources/svg/common.svg#{symbol}" x="{cx}" y="{cy}" id="{css_id}" class="{css_class}" {transform}/>\n'.format(
             symbol='arrow',
-            cx=dcx,
-            cy=dcy,
+            cx=dcx_text,
+            cy=dcy_text,
             transform=transform,
-            css_id='panel_{}_head_{}_s{}'.format(css_class_base, source_id, dest_side['index']),
+            css_id='panel_{}_head_{}_s{}'.format(css_class_base, source_id, dest_side.index),
             css_class='{}_line'.format(css_class_base),
-        )
-        line_svg += '<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" id="{css_id}" class="{css_class}" />\n'.format(
-            x1=pcx, y1=pcy, x2=dcx, y2=dcy,
-            css_id='panel_{}_line_{}_s{}'.format(css_class_base, source_id, dest_side['index']),
+        ))
+        line_svg.append('<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" id="{css_id}" class="{css_class}" />\n'.format(
+            x1=pcx_text, y1=pcy_text, x2=dcx_text, y2=dcy_text,
+            css_id='panel_{}_line_{}_s{}'.format(css_class_base, source_id, dest_side.index),
             css_class='{}_line'.format(css_class_base)
-        )
-        line_svg += '<!-- end group: "{g_id}" -->\n</g>\n'.format(
+        ))
+        line_svg.append('<!-- end group: "{g_id}" -->\n</g>\n'.format(
             g_id=gid
-        )
+        ))
     if not line_svg:
-        return ''
+        return
     gid = 'panel_{}_lines_{}'.format(css_class_base, source_id)
-    return '<g id="{}">\n'.format(gid) + line_svg + '<!-- end group: "{}" -->\n</g>\n'.format(gid)
+    relations.sources[source_id]['group'] = gid
+    write_group(svg, gid, line_svg)
 
-def generate_lines(level_dict, platform_map, ignore_polys, level_info):
+def generate_lines(svg, level_dict, geometry, classes, level_info):
     lines = defaultdict(list)
-    for line in level_dict['LINS']['line']:
-        endpoint1_ref = line['endpoint1']
-        endpoint2_ref = line['endpoint2']
-        x1 = level_dict['EPNT']['endpoint'][endpoint1_ref]['x']/MAX_POS
-        y1 = level_dict['EPNT']['endpoint'][endpoint1_ref]['y']/MAX_POS
-        x2 = level_dict['EPNT']['endpoint'][endpoint2_ref]['x']/MAX_POS
-        y2 = level_dict['EPNT']['endpoint'][endpoint2_ref]['y']/MAX_POS
-        css_class = calculate_line_class(line, level_dict['SIDS']['side'], level_dict['POLY']['polygon'], platform_map, ignore_polys)
+    for position, line in enumerate(level_dict['LINS']['line']):
+        endpoint1_ref = line.endpoint1
+        endpoint2_ref = line.endpoint2
+        x1 = geometry.x[endpoint1_ref]
+        y1 = geometry.y[endpoint1_ref]
+        x2 = geometry.x[endpoint2_ref]
+        y2 = geometry.y[endpoint2_ref]
+        css_class = LINE_CLASSES[classes.line_classes[position]]
         if x1 == x2 and y1 == y2:
             css_class = 'pointless'
         if 'solid' == css_class:
-            update_dimensions(level_info, 'map', x1,y1)
-            update_dimensions(level_info, 'map', x2,y2)
-        css_id = 'line_{}'.format(line['index'])
-        line_svg = '<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" id="{css_id}" class="{css_class}" />'.format(
-            x1=x1, y1=y1, x2=x2, y2=y2,
-            css_id=css_id,
-            css_class=css_class
-        )
-        lines[css_class].append(line_svg)
+            geometry.mark('map', (endpoint1_ref, endpoint2_ref))
+        css_id = 'line_{}'.format(line.index)
+        if args.merge_borders:
+            # one subpath per line, the viewer maps them back through level_info['borders']
+            lines[css_class].append('M{},{}L{},{}'.format(
+                geometry.x_text[endpoint1_ref], geometry.y_text[endpoint1_ref],
+                geometry.x_text[endpoint2_ref], geometry.y_text[endpoint2_ref],
+            ))
+            level_info['borders'][css_class].append(line.index)
+        else:
+            lines[css_class].append('<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" id="{css_id}" class="{css_class}" />\n'.format(
+                x1=geometry.x_text[endpoint1_ref], y1=geometry.y_text[endpoint1_ref],
+                x2=geometry.x_text[endpoint2_ref], y2=geometry.y_text[endpoint2_ref],
+                css_id=css_id,
+                css_class=css_class
+            ))
         polys = filter(
             lambda i: i >= 0,
             map(
-                lambda s: line[s],
+                lambda s: getattr(line, s),
                 ['cw_poly', 'ccw_poly']))
         for poly in polys:
             update_poly_info(level_info, poly_index=poly, ids=[css_id])
-        update_dimensions(level_info, 'lines', x1, y1)
-        update_dimensions(level_info, 'lines', x2, y2)
-    lines_svg = '<g id="borders">\n'
+        geometry.mark('lines', (endpoint1_ref, endpoint2_ref))
+    lines_svg = []
     for line_type in [
         'pointless',
         'unconnected',
@@ -814,33 +1056,32 @@ def generate_lines(level_dict, platform_map, ignore_polys, level_info):
             del lines[line_type]
             continue
         update_overlays(level_info, groups='border_'+line_type)
-        lines_svg += '<g id="border_{}">\n'.format(line_type)
-        for line in lines[line_type]:
-            lines_svg += line + '\n'
-        lines_svg += '<!-- end group: "border_{}" -->\n</g>\n'.format(line_type)
+        if args.merge_borders:
+            lines[line_type] = ['<path d="{}" id="border_{}_path" class="border {}" />\n'.format(
+                ''.join(lines[line_type]), line_type, line_type)]
+        write_group(lines_svg, 'border_'+line_type, lines[line_type])
         del lines[line_type]
     if 0 < len(lines):
         print ('leftover lines: {}'.format(set(lines.keys())))
-    lines_svg += '<!-- end group: "borders" -->\n</g>\n'
-    return lines_svg
+    write_group(svg, 'borders', lines_svg)
 
-def generate_annotations(notes, level_info):
-    notes_svg = ''
+def generate_annotations(svg, notes, level_info):
+    notes_svg = []
     for note in notes:
         css_id = 'annotation_{}'.format(note['index'])
         css_class = 'annotation'
-        notes_svg += '<text x="{x}" y="{y}" id="{css_id}" class="{css_class}">{note}</text>\n'.format(
-            x=note['location_x']/MAX_POS,
-            y=note['location_y']/MAX_POS,
+        notes_svg.append('<text x="{x}" y="{y}" id="{css_id}" class="{css_class}">{note}</text>\n'.format(
+            x=svg_number(note['location_x']/MAX_POS),
+            y=svg_number(note['location_y']/MAX_POS),
             css_class=css_class,
             css_id=css_id,
             note=note['text'],
-        )
+        ))
         update_poly_info(level_info, poly_index=note['polygon_index'], ids=[css_id])
         update_overlays(level_info, css_class)
     if not notes_svg:
-        return ''
-    return '<g id="annotations">\n' + notes_svg + '<!-- end group: "annotations" -->\n</g>\n'
+        return
+    write_group(svg, 'annotations', notes_svg)
 
 PANELS_m1 = [
     'oxygen_refuel', 'shield_refuel', 'double_shield_refuel',
@@ -888,121 +1129,119 @@ def panel_to_type(map_type, panel_type):
         panel_types = PANELS_m1
     return panel_types[panel_type]
 
-def generate_panels(level_dict, ignore_polys, map_type, level_info):
+def generate_panels(svg, level_dict, geometry, ignore_polys, map_type, level_info):
     panel_types = PANELS
     if map_type < 2:
         panel_types = PANELS_m1
-    panel_svg = '<g id="panels">\n'
+    panel_svg = []
     for side in level_dict['SIDS']['side']:
-        if not side['flags'] & 0x2:
+        if not side.flags & 0x2:
             continue
-#         if side['poly'] < len(level_dict['POLY']['polygon']) and is_hidden_poly(level_dict['POLY']['polygon'][side['poly']], ignore_polys):
+#         if side.poly < len(level_dict['POLY']['polygon']) and is_hidden_poly(level_dict['POLY']['polygon'][side.poly], ignore_polys):
 #             continue
-        line = level_dict['LINS']['line'][side['line']]
-        x1 = level_dict['EPNT']['endpoint'][line['endpoint1']]['x']
-        y1 = level_dict['EPNT']['endpoint'][line['endpoint1']]['y']
-        x2 = level_dict['EPNT']['endpoint'][line['endpoint2']]['x']
-        y2 = level_dict['EPNT']['endpoint'][line['endpoint2']]['y']
-        css_id = 'side_{}'.format(side['index'])
-        css_class = 'panel-{}'.format(panel_types[side['panel_type']])
+        line = level_dict['LINS']['line'][side.line]
+        (cx, cy) = geometry.line_center(side.line)
+        css_id = 'side_{}'.format(side.index)
+        css_class = 'panel-{}'.format(panel_types[side.panel_type])
         hover = ''
         if '_switch' in css_class or css_class == 'panel-computer_terminal':
             hover = 'onmouseover="{mouseover}" onmouseout="{mouseout}" '.format(
                 mouseover="m_over('{}');".format(css_id),
                 mouseout="m_out('{}');".format(css_id),
             )
-        panel_svg += '<use xlink:href="../resources/svg/common.svg#panel" x="{cx}" y="{cy}" id="{css_id}" class="{css_class}" {hover}/>\n'.format(
-            cx = (x1 + x2) / 2 / MAX_POS,
-            cy = (y1 + y2) / 2 / MAX_POS,
+        panel_svg.append('<use xlink:href="../resources/svg/common.svg#panel" x="{cx}" y="{cy}" id="{css_id}" class="{css_class}" {hover}/>\n'.format(
+            cx = svg_number(cx),
+            cy = svg_number(cy),
             css_id=css_id,
             css_class = css_class,
             hover=hover,
-        )
+        ))
         source_polys = filter(
             lambda i: i >= 0,
             map(
-                lambda s: line[s],
+                lambda s: getattr(line, s),
                 ['cw_poly', 'ccw_poly']))
         for source in source_polys:
             update_poly_info(level_info, poly_index=source, ids=[css_id])
         update_overlays(level_info, ['panel', css_class])
-    panel_svg += '<!-- end group: "panels" -->\n</g>\n'
-    return panel_svg
+    write_group(svg, 'panels', panel_svg)
 
-def generate_objects(objects, polygons, ignore_polys, level_info):
+def generate_objects(svg, objects, polygons, ignore_polys, level_info):
     entries = defaultdict(list)
+    items_x = []
+    items_y = []
     for obj in objects:
         symbol = None
         css_class = None
-        order = obj['type']
-        if 0 == obj['type']:
+        order = obj.type
+        if 0 == obj.type:
             symbol = 'monster'
-            css_class = 'monster monster-{}'.format(obj['object_index'])
+            css_class = 'monster monster-{}'.format(obj.object_index)
             order = symbol
-        if 1 == obj['type']:
+        if 1 == obj.type:
             symbol = 'object'
-            css_class = 'object object-{}'.format(obj['object_index'])
+            css_class = 'object object-{}'.format(obj.object_index)
             order = symbol
-        if 2 == obj['type']:
+        if 2 == obj.type:
             symbol = 'item'
-            css_class = 'item item-{}'.format(obj['object_index'])
+            css_class = 'item item-{}'.format(obj.object_index)
             order = symbol
-        if 3 == obj['type']:
+        if 3 == obj.type:
             symbol = 'monster'
             css_class = 'player'
             order = 'player'
             update_player_position(level_info, obj, polygons)
-        if 4 == obj['type']:
+        if 4 == obj.type:
             symbol = 'goal'
             css_class = 'goal'
             order = symbol
-        if 5 == obj['type']:
+        if 5 == obj.type:
             symbol = 'sound'
             css_class = 'sound'
-            css_class = 'sound sound-{}'.format(obj['object_index'])
+            css_class = 'sound sound-{}'.format(obj.object_index)
             order = symbol
         if symbol is None:
             symbol = 'unknown'
             css_class = 'unknown'
             order = symbol
-#         if is_hidden_poly(polygons[obj['polygon_index']], ignore_polys):
+#         if is_hidden_poly(polygons[obj.polygon_index], ignore_polys):
 #             css_class += ' hidden'
-        cx=obj['location_x'] / MAX_POS
-        cy=obj['location_y'] / MAX_POS
+        cx=obj.location_x / MAX_POS
+        cy=obj.location_y / MAX_POS
+        cx_text = svg_number(cx)
+        cy_text = svg_number(cy)
         transform = ''
-        if 'sound' != symbol and 0 != obj['facing']:
+        if 'sound' != symbol and 0 != obj.facing:
             transform = 'transform="rotate({rotation} {cx} {cy})" '.format(
-                rotation=obj['facing'] / 512 * 360,
-                cx=cx,
-                cy=cy,
+                rotation=svg_number(obj.facing / 512 * 360),
+                cx=cx_text,
+                cy=cy_text,
             )
-        css_id = 'object_{}'.format(obj['index'])
-        entry = '<use xlink:href="../resources/svg/common.svg#{symbol}" x="{cx}" y="{cy}" id="{css_id}" class="{css_class}" {transform}/>'.format(
+        css_id = 'object_{}'.format(obj.index)
+        entry = '<use xlink:href="../resources/svg/common.svg#{symbol}" x="{cx}" y="{cy}" id="{css_id}" class="{css_class}" {transform}/>\n'.format(
             symbol=symbol,
-            cx=cx,
-            cy=cy,
+            cx=cx_text,
+            cy=cy_text,
             transform=transform,
             css_id=css_id,
             css_class=css_class,
         )
-        update_poly_info(level_info, poly_index=obj['polygon_index'], ids=[css_id])
-        update_dimensions(level_info, 'items', cx, cy)
+        update_poly_info(level_info, poly_index=obj.polygon_index, ids=[css_id])
+        items_x.append(cx)
+        items_y.append(cy)
         update_overlays(level_info, css_class.split(' '))
         entries[order].append(entry)
-    object_svg = '<g id="objects">\n'
+    update_dimensions(level_info, 'items', points_extent(items_x, items_y))
+    object_svg = []
     for symbol in ['unknown', 'sound', 'object', 'item', 'monster', 'goal', 'player']:
         if not entries[symbol]:
             del entries[symbol]
             continue
-        object_svg += '<g id="objects_{}">\n'.format(symbol)
-        for entry in entries[symbol]:
-            object_svg += entry + '\n'
-        object_svg += '<!-- end group: "objects_{}" -->\n</g>\n'.format(symbol)
+        write_group(object_svg, 'objects_'+symbol, entries[symbol])
         del entries[symbol]
     if 0 < len(entries):
         print ('leftover objects: {}'.format(set(entries.keys())))
-    object_svg += '<!-- end group: "objects" -->\n</g>\n'
-    return object_svg
+    write_group(svg, 'objects', object_svg)
 
 def update_level_info(map_info, level_info):
     if EnvironmentFlags.rebellion & map_info[0]['environment_flags']:
@@ -1011,7 +1250,33 @@ def update_level_info(map_info, level_info):
 def generate_svg(map_type, base_name, level_dict, ignore_polys):
     out_path = os.path.join(args.output_directory, base_name+'.svg')
     json_path = os.path.join(args.output_directory, base_name+'.json')
+    level_svg, level_json = render_svg(map_type, level_dict, ignore_polys)
+    write_data(json_path, level_json)
+    write_data(out_path, level_svg)
+    if args.precision_report:
+        report_precision(base_name, level_svg, level_json, map_type, level_dict, ignore_polys)
+    return out_path
 
+# render the level again with full precision and print what rounding saved
+def report_precision(base_name, level_svg, level_json, map_type, level_dict, ignore_polys):
+    precision = args.precision
+    args.precision = -1
+    try:
+        full_svg, full_json = render_svg(map_type, level_dict, ignore_polys)
+    finally:
+        args.precision = precision
+    sizes = [
+        sum(len(f.encode()) for f in full_svg),
+        sum(len(f.encode()) for f in level_svg),
+        len(full_json.encode()),
+        len(level_json.encode()),
+    ]
+    print ('{} precision {}: svg {} -> {} bytes, json {} -> {} bytes, {:.1%} saved'.format(
+        base_name, precision, *sizes,
+        1 - (sizes[1] + sizes[3]) / (sizes[0] + sizes[2])))
+
+# the SVG fragments and JSON text of a level
+def render_svg(map_type, level_dict, ignore_polys):
     platform_map = dict()
     if 0 < len(level_dict['plat']):
         platform_map = build_platform_map(level_dict['plat'])
@@ -1044,32 +1309,43 @@ def generate_svg(map_type, base_name, level_dict, ignore_polys):
         })
     }
 
+    if args.merge_borders:
+        # border class -> line indexes in the order of its merged path
+        level_info['borders'] = defaultdict(list)
+
     update_overlays(level_info, groups='background-grid')
 
-    level_svg = ''
+    # one string per group, written out once the viewBox is known at the end
+    level_svg = []
 
-    level_svg += generate_grid()
-    level_svg += generate_polygons(level_dict, platform_map, ignore_polys, map_type, level_info)
-    level_svg += generate_lines(level_dict, platform_map, ignore_polys, level_info)
+    level_svg.append(generate_grid())
+    geometry = EndpointGeometry(level_dict)
+    classes = LevelClasses(level_dict, platform_map, ignore_polys, map_type)
+    generate_polygons(level_svg, level_dict, geometry, platform_map, classes, level_info)
+    generate_lines(level_svg, level_dict, geometry, classes, level_info)
+    update_dimensions(level_info, 'map', geometry.extent('map'))
+    update_dimensions(level_info, 'lines', geometry.extent('lines'))
 
-    level_svg += generate_trigger_lines(level_dict,  6, 'light_on', level_info)
-    level_svg += generate_trigger_lines(level_dict,  8, 'light_off', level_info)
-    level_svg += generate_trigger_lines(level_dict,  7, 'platform_on', level_info)
-    level_svg += generate_trigger_lines(level_dict,  9, 'platform_off', level_info)
-    level_svg += generate_trigger_lines(level_dict, 10, 'teleporter', level_info)
+    relations = RelationIndex(level_dict)
+    generate_trigger_lines(level_svg, level_dict, geometry, relations,  6, 'light_on', level_info)
+    generate_trigger_lines(level_svg, level_dict, geometry, relations,  8, 'light_off', level_info)
+    generate_trigger_lines(level_svg, level_dict, geometry, relations,  7, 'platform_on', level_info)
+    generate_trigger_lines(level_svg, level_dict, geometry, relations,  9, 'platform_off', level_info)
+    generate_trigger_lines(level_svg, level_dict, geometry, relations, 10, 'teleporter', level_info)
 
-    level_svg += generate_panel_lines(level_dict, 'light_switch', platform_map, map_type, level_info)
-    level_svg += generate_panel_lines(level_dict, 'platform_switch', platform_map, map_type, level_info)
-    level_svg += generate_panel_lines(level_dict, 'tag_switch', platform_map, map_type, level_info)
+    generate_panel_lines(level_svg, level_dict, geometry, relations, 'light_switch', platform_map, map_type, level_info)
+    generate_panel_lines(level_svg, level_dict, geometry, relations, 'platform_switch', platform_map, map_type, level_info)
+    generate_panel_lines(level_svg, level_dict, geometry, relations, 'tag_switch', platform_map, map_type, level_info)
 
     if 'term' in level_dict:
-        level_svg += generate_terminal_lines(level_dict, 7, 'terminal_teleport', map_type, level_info)
+        generate_terminal_lines(level_svg, level_dict, geometry, relations, 7, 'terminal_teleport', map_type, level_info)
         # no actual panel tags found
-        #level_svg += generate_terminal_lines(level_dict, 16, 'terminal_tag_switch', map_type)
+        #generate_terminal_lines(level_svg, level_dict, geometry, relations, 16, 'terminal_tag_switch', map_type)
 
-    level_svg += generate_objects(level_dict['OBJS']['object'], level_dict['POLY']['polygon'], ignore_polys, level_info)
-    level_svg += generate_panels(level_dict, ignore_polys, map_type, level_info)
-    level_svg += generate_annotations(level_dict['NOTE']['annotation'], level_info)
+    generate_objects(level_svg, level_dict['OBJS']['object'], level_dict['POLY']['polygon'], ignore_polys, level_info)
+    generate_panels(level_svg, level_dict, geometry, ignore_polys, map_type, level_info)
+    generate_annotations(level_svg, level_dict['NOTE']['annotation'], level_info)
+    level_info['activation'] = relations.activation_graph()
 
     if 'Minf' in level_dict:
         update_level_info(level_dict['Minf']['mapinfo'], level_info)
@@ -1089,18 +1365,60 @@ def generate_svg(map_type, base_name, level_dict, ignore_polys):
     svg_prefix += '<!-- generated by map2svg: github.com/fracai/marathon-svg -->\n'
     svg_prefix += '<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" version="1.1"'
     svg_size = '\n    viewBox="{vbminx} {vbminy} {vbheight} {vbwidth}">\n'.format(
-        vbminx=min_x,
-        vbminy=min_y,
-        vbheight=max_x-min_x,
-        vbwidth=max_y-min_y,
+        vbminx=svg_number(min_x),
+        vbminy=svg_number(min_y),
+        vbheight=svg_number(max_x-min_x),
+        vbwidth=svg_number(max_y-min_y),
     )
     svg_style = '<link xmlns="http://www.w3.org/1999/xhtml" rel="stylesheet" href="../resources/css/styles.css" type="text/css" />\n'
     svg_style += '<style id="dynamic-style" />\n'
     svg_end = '</svg>'
-    level_svg = svg_prefix + svg_size + svg_style + level_svg + svg_js + svg_end
-    write_data(json_path, json.dumps(level_info, default=set_default, indent=2))
-    write_data(out_path, level_svg)
-    return out_path
+    level_svg[:0] = [svg_prefix, svg_size, svg_style]
+    level_svg += [svg_js, svg_end]
+    return (level_svg, encode_level_info(level_info))
+
+def encode_level_info(level_info):
+    if args.legacy_json:
+        return json.dumps(level_info, default=set_default, indent=2)
+    level_info['polygons'], level_info['strings'] = pack_polygons(level_info['polygons'])
+    level_info['elevation_index'] = elevation_index(level_info['polygons'])
+    return json.dumps(level_info, default=set_default, separators=(',', ':'))
+
+# the compact level JSON holds polygons as parallel arrays, the connections of
+# the i-th polygon are strings[c] for c in
+# connections[connection_offsets[i]:connection_offsets[i+1]], heights are null
+# for entries that only collected connections
+def pack_polygons(polygons):
+    strings = sorted(set().union(*[p['connections'] for p in polygons.values()]))
+    string_ids = {s: i for i, s in enumerate(strings)}
+    packed = {
+        'index': [],
+        'floor_height': [],
+        'ceiling_height': [],
+        'connection_offsets': [0],
+        'connections': [],
+    }
+    for index in sorted(polygons):
+        poly_info = polygons[index]
+        packed['index'].append(index)
+        packed['floor_height'].append(poly_info['floor_height'])
+        packed['ceiling_height'].append(poly_info['ceiling_height'])
+        packed['connections'].extend(sorted(string_ids[c] for c in poly_info['connections']))
+        packed['connection_offsets'].append(len(packed['connections']))
+    return (packed, strings)
+
+# packed polygon positions ordered by floor and by ceiling height, the polygons
+# hidden by the elevation slider are a prefix of one order and a suffix of the
+# other so the viewer can find them by binary search
+#
+# entries without heights, e.g. for an annotation or object outside any
+# polygon, are left out of both orders and never hidden
+def elevation_index(packed):
+    positions = [i for i, h in enumerate(packed['floor_height']) if h is not None and packed['ceiling_height'][i] is not None]
+    return {
+        'by_floor': sorted(positions, key=packed['floor_height'].__getitem__),
+        'by_ceiling': sorted(positions, key=packed['ceiling_height'].__getitem__),
+    }
 
 media_map = {
     0: 'water',
@@ -1110,59 +1428,113 @@ media_map = {
     4: 'jjaro',
 }
 
-def calculate_poly_class(poly, platform_map, ignore_polys, liquids, map_type):
-    if is_ignored_poly(poly, ignore_polys):
-        return 'ignore'
+POLYGON_CLASSES = [
+    'ignore', 'minor_ouch', 'major_ouch', *media_map.values(), 'hill',
+    'landscape_', 'secret_platform', 'platform', 'teleporter', 'plain',
+]
+POLYGON_CLASS_IDS = {c: i for i, c in enumerate(POLYGON_CLASSES)}
+LINE_CLASSES = [
+    'unconnected', 'ignore', 'solid', 'plain', 'landscape_', 'elevation', 'ceiling',
+]
+LINE_CLASS_IDS = {c: i for i, c in enumerate(LINE_CLASSES)}
+
+# flags and a class id for every polygon and line, by list position,
+# computed once per level so lines read their neighbours' flags instead of
+# classifying them again
+class LevelClasses(object):
+    def __init__(self, level_dict, platform_map, ignore_polys, map_type):
+        polygons = level_dict['POLY']['polygon']
+        sides = level_dict['SIDS']['side']
+        liquids = level_dict['medi']['media']
+        ignore_polys = set(ignore_polys)
+        self.polygon_flags = [polygon_flags(p, platform_map, ignore_polys, liquids, map_type) for p in polygons]
+        self.polygon_classes = [
+            POLYGON_CLASS_IDS[calculate_poly_class(p, f, liquids, map_type)]
+            for p, f in zip(polygons, self.polygon_flags)]
+        self.line_flags = []
+        self.line_classes = []
+        for line in level_dict['LINS']['line']:
+            flags = line_flags(line, sides, self.polygon_flags)
+            self.line_flags.append(flags)
+            self.line_classes.append(LINE_CLASS_IDS[calculate_line_class(line, flags, polygons)])
+
+def polygon_flags(poly, platform_map, ignore_polys, liquids, map_type):
+    flags = 0
+    if poly.index in ignore_polys:
+        flags |= ClassFlags.ignored
+    if is_landscape_poly(poly):
+        flags |= ClassFlags.landscape
+    if poly.index in platform_map:
+        flags |= ClassFlags.platform
+        if platform_map[poly.index]['static_flags'] & PlatformFlags.is_secret:
+            flags |= ClassFlags.secret
     if map_type < 2:
-        if poly['type'] == 3:
-            return 'minor_ouch'
-        if poly['type'] == 4:
-            return 'major_ouch'
+        if poly.type in [3, 4]:
+            flags |= ClassFlags.ouch
     else:
-        if poly['type'] == 19:
-            return 'minor_ouch'
-        if poly['type'] == 20:
-            return 'major_ouch'
-        if 0 < len(liquids) and poly['media_index'] >= 0:
-            media = liquids[poly['media_index']]
-            if poly['floor_height'] <= media['low']:
-                if media['type'] in media_map:
-                    return media_map[media['type']]
-        if poly['type'] == 3:
-            return 'hill'
-    if is_landscape_poly(poly):
+        if poly.type in [19, 20]:
+            flags |= ClassFlags.ouch
+        if 0 <= poly.media_index < len(liquids):
+            media = liquids[poly.media_index]
+            if poly.floor_height <= media['low'] and media['type'] in media_map:
+                flags |= ClassFlags.liquid
+    if poly.type == 10:
+        flags |= ClassFlags.teleporter
+    if is_unseen_poly(poly):
+        flags |= ClassFlags.unseen
+    return flags
+
+def calculate_poly_class(poly, flags, liquids, map_type):
+    if flags & ClassFlags.ignored:
+        return 'ignore'
+    if flags & ClassFlags.ouch:
+        return 'minor_ouch' if poly.type in [3, 19] else 'major_ouch'
+    if flags & ClassFlags.liquid:
+        return media_map[liquids[poly.media_index]['type']]
+    if map_type >= 2 and poly.type == 3:
+        return 'hill'
+    if flags & ClassFlags.landscape:
         return 'landscape_'
-    if poly['index'] in platform_map:
-        if platform_map[poly['index']]['static_flags'] & PlatformFlags.is_secret:
+    if flags & ClassFlags.platform:
+        if flags & ClassFlags.secret:
             return 'secret_platform'
         else:
             return 'platform'
-    if poly['type'] == 5:
+    if poly.type == 5:
         return 'platform'
-    if poly['type'] == 10:
+    if flags & ClassFlags.teleporter:
         return 'teleporter'
     return 'plain'
 
-def calculate_line_class(line, sides, polygons, platform_map, ignore_polys):
-    if line['cw_poly'] < 0 and line['ccw_poly'] < 0:
+def line_flags(line, sides, polygon_flags):
+    cw_flags = polygon_flags[line.cw_poly] if line.cw_poly >= 0 else ClassFlags.ignored
+    ccw_flags = polygon_flags[line.ccw_poly] if line.ccw_poly >= 0 else ClassFlags.ignored
+    flags = cw_flags & ccw_flags & ClassFlags.ignored
+    flags |= (cw_flags | ccw_flags) & ClassFlags.platform
+    if is_landscape_line(line, sides):
+        flags |= ClassFlags.landscape
+    return flags
+
+def calculate_line_class(line, flags, polygons):
+    if line.cw_poly < 0 and line.ccw_poly < 0:
         return 'unconnected'
-    cw_poly_ref = line['cw_poly']
-    ccw_poly_ref = line['ccw_poly']
-    cw_poly = polygons[cw_poly_ref] if cw_poly_ref >= 0 else None
-    ccw_poly = polygons[ccw_poly_ref] if ccw_poly_ref >= 0 else None
-    if (not cw_poly or is_ignored_poly(cw_poly, ignore_polys)) and (not ccw_poly or is_ignored_poly(ccw_poly, ignore_polys)):
+    if flags & ClassFlags.ignored:
         return 'ignore'
-    if (cw_poly and cw_poly['index'] in platform_map) or (ccw_poly and ccw_poly['index'] in platform_map):
+    if flags & ClassFlags.platform:
         return 'solid'
-    if line['cw_side'] < 0 and line['ccw_side'] < 0:
+    if line.cw_side < 0 and line.ccw_side < 0:
         return 'plain'
-    if is_landscape_line(line, sides):
+    if flags & ClassFlags.landscape:
         return 'landscape_'
-    if line['flags'] & 0x4000 or not cw_poly or not ccw_poly or 5 == cw_poly['type'] or 5 == ccw_poly['type']:
+    if line.flags & 0x4000 or line.cw_poly < 0 or line.ccw_poly < 0:
         return 'solid'
-    if cw_poly['floor_height'] != ccw_poly['floor_height']:
+    cw_poly = polygons[line.cw_poly]
+    ccw_poly = polygons[line.ccw_poly]
+    if 5 == cw_poly.type or 5 == ccw_poly.type:
+        return 'solid'
+    if cw_poly.floor_height != ccw_poly.floor_height:
         return 'elevation'
-    if cw_poly['ceiling_height'] != ccw_poly['ceiling_height']:
+    if cw_poly.ceiling_height != ccw_poly.ceiling_height:
         return 'ceiling'
     return 'plain'
 
@@ -1175,19 +1547,19 @@ def is_landscape_side(line, side_type, sides):
     return 9 == sides[line[side_type]]['primary_transfer']
 
 def is_landscape_floor(poly):
-    return 9 == poly['floor_transfer_mode']
+    return 9 == poly.floor_transfer_mode
 
 def is_landscape_ceiling(poly):
-    return 9 == poly['ceiling_transfer_mode']
+    return 9 == poly.ceiling_transfer_mode
 
 def is_landscape_poly(poly):
     return is_landscape_floor(poly) and is_landscape_ceiling(poly)
 
 def is_unseen_poly(poly):
-    return poly['type'] != 5 and poly['floor_height'] == poly['ceiling_height']
+    return poly.type != 5 and poly.floor_height == poly.ceiling_height
 
 def is_ignored_poly(poly, ignore_polys):
-    return poly['index'] in ignore_polys
+    return poly.index in ignore_polys
 
 def is_hidden_poly(poly, ignore_polys):
     return is_landscape_poly(poly) or is_unseen_poly(poly) or is_ignored_poly(poly, ignore_polys)
@@ -1208,20 +1580,33 @@ def process_mml_file(mml_path):
     mml_data = {k:v for k,v in mml_data.items() if k in MML_TAGS}
     return mml_data
 
+# data is a string or a list of string fragments
 def write_data(path, data):
     mkdir_p(os.path.dirname(path))
     with open(path, 'w') as f:
-        f.write(data)
+        if isinstance(data, str):
+            f.write(data)
+        else:
+            f.writelines(data)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Convert maps to SVG')
     parser.add_argument('-d', '--dir', dest='output_directory', help='specify the output directory')
-    parser.add_argument('-m', '--map', dest='map', type=str, help='a map XML file')
+    parser.add_argument('-m', '--map', dest='map', type=str, help='a map XML file or binary map wadfile')
     parser.add_argument('-M', '--mml', dest='mml', type=str, help='an MML file')
     parser.add_argument('-i', '--ignore', dest='ignores', type=str, help='a file of polygons to ignore')
     parser.add_argument('-c', '--chapters', dest='chapters', type=str, help='a file of chapter markers')
     parser.add_argument('-b', '--base_prefix', dest='base_prefix', type=str, help='base directory where map data will be found')
     parser.add_argument('-l', '--level', dest='levels', type=int, nargs='+', help='which levels to generate')
+    add_cache_arguments(parser)
+    parser.add_argument('--columnar', dest='columnar', action='store_true', help='hold endpoints in NumPy arrays, requires numpy')
+    parser.add_argument('--precision', dest='precision', type=int, default=DEFAULT_PRECISION, help='decimals written for coordinates (default {}), a negative value keeps full float precision'.format(DEFAULT_PRECISION))
+    parser.add_argument('--precision-report', dest='precision_report', action='store_true', help='print the bytes saved by rounding for each level')
+    parser.add_argument('--merge-borders', dest='merge_borders', action='store_true', help='draw each border class as one path instead of a line per map line')
+    parser.add_argument('--legacy-json', dest='legacy_json', action='store_true', help='write indented level JSON with polygons keyed by index instead of the compact arrays')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='generate levels in this many processes, 0 for one per CPU')
+    parser.add_argument('--profile', dest='profile', type=str, help='write the wall time and call count of each stage of each level to this JSON file, levels are generated serially')
+    parser.add_argument('--profile-stats', dest='profile_stats', type=str, help='with --profile, run each level under cProfile and dump the pstats of the slowest one here')
     args = parser.parse_args()
 
     if args.mml:
@@ -0,0 +1,429 @@
+# shared reader for the wadfile XML written by map2xml.pl
+# binary wadfiles are handed off to wadfile.py
+
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from functools import partial
+import hashlib
+import json
+import mmap
+import os
+import re
+
+from level import Level
+from records import ENDPOINT_FIELDS, LINE_FIELDS, SIDE_FIELDS, POLYGON_FIELDS, OBJECT_FIELDS, RECORD_TYPES, record_filler
+from wadfile import WadFile, is_wadfile
+
+# bumped whenever the decoded level structure changes, invalidating cached levels
+DECODER_VERSION = 2
+
+WADFILE_RE = re.compile(rb'<wadfile\b')
+WADINFO_RE = re.compile(rb'<wadinfo\b[^>]*\btype="(-?\d+)"')
+ENTRY_RE = re.compile(rb'<entry\b[^>]*\bindex="(\d+)"[^>]*>.*?</entry>', re.DOTALL)
+
+# sidecar written next to the map XML, bumped whenever its layout changes
+INDEX_SUFFIX = '.index'
+INDEX_VERSION = 1
+# the fields of an entry index and their types, a sidecar missing any is stale
+INDEX_FIELDS = {
+    'size': int,
+    'mtime_ns': int,
+    'sha256': str,
+    'map_type': (int, type(None)),
+    'entries': list,
+}
+
+def fix_encoding(text):
+    return re.sub(
+        b'\xc3\xa2',
+        b'\xe2',
+        text.encode()
+    ).replace(
+        b'\xc2',
+        b''
+    ).decode()
+
+# stream the wadfile, yielding each wanted <entry> as soon as it closes
+# the entry is released once the caller is done with it, so memory is bounded
+# by the largest level rather than the whole scenario
+def iter_entries(map_xml_path, levels=None):
+    map_type = None
+    root = None
+    depth = 0
+    skipping = False
+    for event, elem in ET.iterparse(map_xml_path, events=('start', 'end')):
+        if 'start' == event:
+            depth += 1
+            if 1 == depth:
+                if 'wadfile' != elem.tag:
+                    return
+                root = elem
+            elif 2 == depth and 'entry' == elem.tag:
+                skipping = bool(levels) and int(elem.attrib['index']) not in levels
+            continue
+        depth -= 1
+        if 1 < depth:
+            # drop everything inside an unwanted entry as soon as it closes
+            if skipping:
+                elem.clear()
+            continue
+        if 1 != depth:
+            continue
+        # <wadinfo type="0" size="3863054" count="37">Map</wadinfo>
+        if 'wadinfo' == elem.tag:
+            map_type = int(elem.attrib['type'])
+        elif 'entry' == elem.tag and not skipping:
+            yield map_type, elem
+        skipping = False
+        root.clear()
+
+# generic coercion used for attributes without a schema entry
+def decode_value(val):
+    try:
+        return int(val)
+    except ValueError:
+        pass
+    try:
+        return float(val)
+    except ValueError:
+        return val
+
+# fractional attributes; only integral looking values are tried as int
+def decode_fixed(val):
+    if val.lstrip('-').isdigit():
+        return int(val)
+    return float(val)
+
+def int_fields(*names):
+    return {name: int for name in names}
+
+# attribute converters for each element of each known chunk type
+# attributes missing from a schema are decoded with decode_value
+CHUNK_SCHEMAS = {
+    'EPNT': {
+        'endpoint': int_fields(*ENDPOINT_FIELDS),
+    },
+    'PNTS': {
+        'point': int_fields('index', 'x', 'y'),
+    },
+    'LINS': {
+        'line': int_fields(*LINE_FIELDS),
+    },
+    'SIDS': {
+        'side': int_fields(*SIDE_FIELDS),
+    },
+    'POLY': {
+        'polygon': int_fields(*POLYGON_FIELDS),
+    },
+    'OBJS': {
+        'object': int_fields(*OBJECT_FIELDS),
+    },
+    'plac': {
+        'placement': int_fields(
+            'index', 'flags', 'initial_count', 'minimum_count', 'maximum_count',
+            'random_count', 'random_chance',
+        ),
+    },
+    'PLAT': {
+        'platform': int_fields(
+            'index', 'type', 'speed', 'delay', 'maximum_height', 'minimum_height',
+            'static_flags', 'polygon_index', 'tag',
+        ),
+    },
+    'plat': {
+        'platform': int_fields(
+            'index', 'type', 'static_flags', 'speed', 'delay',
+            'minimum_floor_height', 'maximum_floor_height',
+            'minimum_ceiling_height', 'maximum_ceiling_height',
+            'polygon_index', 'dynamic_flags', 'floor_height', 'ceiling_height',
+            'ticks_until_restart', 'parent_platform_index', 'tag',
+        ),
+    },
+    'LITE': {
+        'light': {
+            **int_fields('index', 'type', 'flags', 'phase', 'tag'),
+            'intensity': decode_fixed,
+        },
+    },
+    'medi': {
+        'media': {
+            **int_fields(
+                'index', 'type', 'flags', 'light_index', 'current_direction',
+                'low', 'high', 'origin_x', 'origin_y', 'height', 'texture', 'transfer_mode',
+            ),
+            'current_magnitude': decode_fixed,
+            'minimum_light_intensity': decode_fixed,
+        },
+    },
+    'NOTE': {
+        'annotation': int_fields('index', 'type', 'location_x', 'location_y', 'polygon_index'),
+    },
+    'term': {
+        'terminal': int_fields('index', 'flags', 'lines_per_page'),
+        'grouping': int_fields('index', 'flags', 'type', 'permutation', 'start_index', 'length', 'maximum_index'),
+        'font_change': int_fields('index', 'offset', 'face', 'color'),
+    },
+    'Minf': {
+        'mapinfo': int_fields(
+            'index', 'environment_code', 'physics_model', 'song_index',
+            'mission_flags', 'environment_flags', 'entry_point_flags',
+        ),
+    },
+}
+
+# decodes the attributes of one element tag; the converters and constructor
+# are looked up once per attribute order, so each value is converted
+# without a schema lookup or fallback
+class ElementDecoder(object):
+    def __init__(self, tag, converters):
+        self.record_type = RECORD_TYPES.get(tag)
+        self.converters = converters
+        self.plans = dict()
+
+    def __call__(self, attrib):
+        keys = tuple(attrib)
+        plan = self.plans.get(keys)
+        if plan is None:
+            plan = self.plans[keys] = self.compile(keys)
+        convert, build = plan
+        try:
+            return build(*convert(attrib.values()))
+        except ValueError:
+            # the schema guessed wrong for this element, decode it generically
+            return build(*[decode_value(val) for val in attrib.values()])
+
+    def compile(self, keys):
+        converters = [self.converters.get(key, decode_value) for key in keys]
+        if 1 == len(set(converters)):
+            convert = partial(map, converters[0])
+        else:
+            def convert(values):
+                return [converter(val) for converter, val in zip(converters, values)]
+        if self.record_type is None:
+            def build(*values):
+                return dict(zip(keys, values))
+        elif 'index' in keys:
+            build = record_filler(self.record_type, keys)
+        else:
+            # records always have an index, so reading it stays a slot access
+            fill = record_filler(self.record_type, keys + ('index',))
+            def build(*values):
+                return fill(*values, 0)
+        return convert, build
+
+# element decoders by chunk type and tag, built on first use
+DECODERS = dict()
+
+def element_decoder(chunk_type, tag):
+    decoder = DECODERS.get((chunk_type, tag))
+    if decoder is None:
+        decoder = DECODERS[(chunk_type, tag)] = ElementDecoder(tag, CHUNK_SCHEMAS.get(chunk_type, {}).get(tag, {}))
+    return decoder
+
+def process_chunk(chunk_root, chunk_type=None):
+    if chunk_type is None:
+        chunk_type = chunk_root.attrib.get('type')
+    chunk_dict = defaultdict(list)
+    decoders = dict()
+    for entry in chunk_root:
+        entries = chunk_dict[entry.tag]
+        decoder = decoders.get(entry.tag)
+        if decoder is None:
+            decoder = decoders[entry.tag] = element_decoder(chunk_type, entry.tag)
+        record = decoder(entry.attrib)
+        entries.append(record)
+        if len(entry) > 0:
+            record['children'] = process_chunk(entry, chunk_type)
+        if decoder.record_type is None:
+            record['text'] = entry.text
+            index = record.setdefault('index', 0)
+        else:
+            # records only keep text an element actually has
+            if entry.text is not None:
+                record['text'] = entry.text
+            index = record.index
+        if index != len(entries)-1:
+            print ('out of order entry: {}'.format(entries))
+    return chunk_dict
+
+# the <name> and <chunk> children of an entry, in document order
+# chunks are decoded when chunk_types is None or lists their type,
+# with lazy the decoded chunk is replaced by a function that decodes it
+def level_items(level_root, chunk_types=None, lazy=False):
+    items = []
+    for chunk in level_root:
+        if 'name' == chunk.tag:
+            items.append(['name', chunk.text])
+        if 'chunk' != chunk.tag or 'type' not in chunk.attrib:
+            continue
+        chunk_dict = None
+        if chunk_types is None or chunk.attrib['type'] in chunk_types:
+            if lazy:
+                chunk_dict = partial(process_chunk, chunk)
+            else:
+                chunk_dict = process_chunk(chunk)
+        items.append(['chunk', dict(chunk.attrib), chunk.text, chunk_dict])
+    return items
+
+# chunks outside chunk_types are skipped, and reported unless
+# chunk_types_ignored is None or lists them
+def assemble_level(items, chunk_types, chunk_types_ignored=None):
+    name = None
+    level_dict = Level()
+    for item in items:
+        if 'name' == item[0]:
+            name = item[1]
+            continue
+        _, attrib, text, chunk_dict = item
+        chunk_type = attrib['type']
+        if chunk_types_ignored and chunk_type in chunk_types_ignored:
+            continue
+        if 'NAME' == chunk_type:
+            name = text
+        elif chunk_type in chunk_types:
+            if callable(chunk_dict):
+                level_dict.defer(chunk_type, chunk_dict)
+            else:
+                level_dict[chunk_type] = chunk_dict
+        elif chunk_types_ignored is not None:
+            print ('unhandled chunk: {}'.format(attrib))
+    for chunk_type in chunk_types:
+        if chunk_type not in level_dict:
+            level_dict[chunk_type] = defaultdict(list)
+    return fix_encoding(name), level_dict
+
+def decode_level(level_root, chunk_types, chunk_types_ignored=None):
+    return assemble_level(level_items(level_root, chunk_types, lazy=True), chunk_types, chunk_types_ignored)
+
+# byte ranges of every <entry> in a map XML, so single levels can be sliced out
+# binary wadfiles don't need one, their directory already holds the offsets
+#
+# {"version": 1, "size": ..., "mtime_ns": ..., "sha256": ..., "map_type": 2,
+#  "entries": [[index, start, end], ...]}
+def entry_index_path(map_xml_path):
+    return map_xml_path + INDEX_SUFFIX
+
+def build_entry_index(data):
+    entry_index = {
+        'version': INDEX_VERSION,
+        'map_type': None,
+        'entries': [],
+    }
+    if not WADFILE_RE.search(data):
+        return entry_index
+    wadinfo = WADINFO_RE.search(data)
+    if wadinfo:
+        entry_index['map_type'] = int(wadinfo[1])
+    for match in ENTRY_RE.finditer(data):
+        entry_index['entries'].append([int(match[1]), match.start(), match.end()])
+    return entry_index
+
+def read_entry_index(path):
+    try:
+        with open(path, 'r') as f:
+            entry_index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry_index, dict) or INDEX_VERSION != entry_index.get('version'):
+        return None
+    for key, value_type in INDEX_FIELDS.items():
+        if key not in entry_index or not isinstance(entry_index[key], value_type):
+            return None
+    for entry in entry_index['entries']:
+        if not isinstance(entry, list) or 3 != len(entry) or not all(isinstance(v, int) for v in entry):
+            return None
+    return entry_index
+
+def write_entry_index(path, entry_index):
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(temp_path, 'w') as f:
+            json.dump(entry_index, f)
+        os.replace(temp_path, path)
+    except OSError:
+        # a read only map directory only costs the rescan next time
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+# the entry index for the mapped map XML, rebuilt when the size differs or the
+# mtime differs and the contents hash does too
+def load_entry_index(map_xml_path, data):
+    stat = os.stat(map_xml_path)
+    path = entry_index_path(map_xml_path)
+    entry_index = read_entry_index(path)
+    if entry_index is not None and stat.st_size == entry_index['size']:
+        if stat.st_mtime_ns == entry_index['mtime_ns']:
+            return entry_index
+        digest = hashlib.sha256(data).hexdigest()
+        if digest == entry_index['sha256']:
+            # touched but unchanged, e.g. by a fresh checkout
+            entry_index['mtime_ns'] = stat.st_mtime_ns
+            write_entry_index(path, entry_index)
+            return entry_index
+    entry_index = build_entry_index(data)
+    entry_index['size'] = stat.st_size
+    entry_index['mtime_ns'] = stat.st_mtime_ns
+    entry_index['sha256'] = hashlib.sha256(data).hexdigest()
+    write_entry_index(path, entry_index)
+    return entry_index
+
+# raw bytes of each wanted <entry>, sliced out using the entry index
+def iter_entry_bytes(map_xml_path, levels=None):
+    with open(map_xml_path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        entry_index = load_entry_index(map_xml_path, data)
+        for level_index, start, end in entry_index['entries']:
+            if levels and level_index not in levels:
+                continue
+            yield entry_index['map_type'], str(level_index), data[start:end]
+    finally:
+        data.close()
+
+# yield (map_type, level_number, sha256) of the raw entry of each wanted level,
+# in the order iter_levels yields them, so a build can tell which levels
+# changed without decoding any
+def iter_level_digests(map_path, levels=None):
+    if is_wadfile(map_path):
+        with WadFile(map_path) as wad:
+            for level_index in sorted(wad.entries.keys()):
+                if levels and level_index not in levels:
+                    continue
+                yield wad.map_type, str(level_index), hashlib.sha256(wad.entry(level_index)).hexdigest()
+        return
+    for map_type, level_number, raw in iter_entry_bytes(map_path, levels):
+        yield map_type, level_number, hashlib.sha256(raw).hexdigest()
+
+# yield (map_type, level_number, name, level_dict) for each wanted level of
+# either a map2xml.pl wadfile XML or a binary wadfile
+# level_dict is a Level, its chunks are decoded as they are read
+# decoded XML levels are reused from a levelcache.LevelCache when given one
+def iter_levels(map_path, chunk_types, chunk_types_ignored=None, levels=None, cache=None):
+    if is_wadfile(map_path):
+        with WadFile(map_path) as wad:
+            for level_index in sorted(wad.entries.keys()):
+                if levels and level_index not in levels:
+                    continue
+                name, level_dict = wad.decode_level(level_index, chunk_types, chunk_types_ignored)
+                yield wad.map_type, str(level_index), name, level_dict
+        return
+    if cache is not None:
+        # only chunks missing from the cache are decoded, when first read, and
+        # the level's cache entry is updated once the caller moves on
+        for map_type, level_number, raw in iter_entry_bytes(map_path, levels):
+            cached = cache.open_level(raw, chunk_types)
+            name, level_dict = assemble_level(cached.items, chunk_types, chunk_types_ignored)
+            yield map_type, level_number, name, level_dict
+            cached.save()
+        return
+    if levels:
+        # seek straight to the wanted entries rather than streaming the whole file
+        for map_type, level_number, raw in iter_entry_bytes(map_path, levels):
+            name, level_dict = decode_level(ET.fromstring(raw), chunk_types, chunk_types_ignored)
+            yield map_type, level_number, name, level_dict
+        return
+    for map_type, entry in iter_entries(map_path):
+        name, level_dict = decode_level(entry, chunk_types, chunk_types_ignored)
+        yield map_type, entry.attrib['index'], name, level_dict
@@ -0,0 +1,107 @@
+# wall time and call counts of the build stages of each level, for --profile
+#
+# stage functions are wrapped in place for the run, so a build without a
+# profile runs the plain functions; a call nested in a call of the same stage,
+# like process_chunk decoding child elements, is counted but not timed twice;
+# stages can still contain others, e.g. render_svg holds the generators
+#
+# {"levels": [{"map": ..., "level": "3", "name": ..., "seconds": ...,
+#   "stages": {"parse": {"calls": 1, "seconds": ...}, ...}}, ...],
+#  "totals": {"parse": {"calls": ..., "seconds": ...}, ...},
+#  "stats": {"path": ..., "map": ..., "level": ...}}
+
+import cProfile
+from collections import defaultdict
+from functools import wraps
+import json
+import time
+
+class StageProfile(object):
+    # with stats_path every level also runs under cProfile and the stats of
+    # the slowest one are dumped there
+    def __init__(self, stats_path=None):
+        self.stats_path = stats_path
+        self.levels = []
+        self.level = None
+        self.depth = defaultdict(int)
+        self.slowest = None
+
+    # stage gives the stage name from the call's arguments, the function name by default
+    def wrap(self, module, name, stage=None):
+        function = getattr(module, name)
+        @wraps(function)
+        def timed(*args, **kwargs):
+            key = name if stage is None else stage(*args, **kwargs)
+            self.depth[key] += 1
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                self.depth[key] -= 1
+                self.add(key, 0 if self.depth[key] else seconds)
+        setattr(module, name, timed)
+
+    def add(self, stage, seconds):
+        if self.level is None:
+            return
+        entry = self.level['stages'].setdefault(stage, {'calls': 0, 'seconds': 0})
+        entry['calls'] += 1
+        entry['seconds'] += seconds
+
+    # pass through iter_levels, timing the reading of each level as its parse
+    # stage and everything up to the next level as the level's seconds
+    def iter_levels(self, map_path, levels):
+        levels = iter(levels)
+        while True:
+            # chunks decoded while reading count towards the level being read
+            self.level = {
+                'map': map_path,
+                'level': None,
+                'name': None,
+                'seconds': 0,
+                'stages': {},
+            }
+            profiler = None
+            if self.stats_path:
+                profiler = cProfile.Profile()
+                profiler.enable()
+            start = time.perf_counter()
+            try:
+                level = next(levels)
+            except StopIteration:
+                if profiler is not None:
+                    profiler.disable()
+                self.level = None
+                return
+            self.add('parse', time.perf_counter() - start)
+            self.level['level'] = level[1]
+            self.level['name'] = level[2]
+            self.levels.append(self.level)
+            yield level
+            if profiler is not None:
+                profiler.disable()
+            self.level['seconds'] = time.perf_counter() - start
+            if profiler is not None and (self.slowest is None or self.level['seconds'] > self.slowest[0]):
+                self.slowest = (self.level['seconds'], self.level, profiler)
+
+    def totals(self):
+        totals = dict()
+        for level in self.levels:
+            for stage, entry in level['stages'].items():
+                total = totals.setdefault(stage, {'calls': 0, 'seconds': 0})
+                total['calls'] += entry['calls']
+                total['seconds'] += entry['seconds']
+        return totals
+
+    def write(self, path):
+        report = {
+            'levels': self.levels,
+            'totals': self.totals(),
+        }
+        if self.slowest is not None:
+            _, level, profiler = self.slowest
+            profiler.dump_stats(self.stats_path)
+            report['stats'] = {'path': self.stats_path, 'map': level['map'], 'level': level['level']}
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,191 @@
+# compact record types for the bulky level elements
+#
+# endpoints, lines, sides, polygons and objects make up most of a level, so
+# instead of a dict per element they get a class with __slots__ for the known
+# attributes; generators read them as attributes, everything else can keep
+# using them as dicts
+
+from collections.abc import MutableMapping
+
+def indexed(name, count):
+    return ['{}_{}'.format(name, i) for i in range(count)]
+
+ENDPOINT_FIELDS = (
+    'index', 'flags', 'highest_adjacent_floor_height', 'lowest_adjacent_ceiling_height',
+    'x', 'y', 'transformed_x', 'transformed_y', 'supporting_polygon_index',
+)
+LINE_FIELDS = (
+    'index', 'endpoint1', 'endpoint2', 'flags', 'length',
+    'highest_adjacent_floor', 'lowest_adjacent_ceiling',
+    'cw_side', 'ccw_side', 'cw_poly', 'ccw_poly',
+)
+SIDE_FIELDS = (
+    'index', 'type', 'flags', 'poly', 'line',
+    'primary_texture', 'primary_x', 'primary_y',
+    'secondary_texture', 'secondary_x', 'secondary_y',
+    'transparent_texture', 'transparent_x', 'transparent_y',
+    'exclusion_zone_e0_x', 'exclusion_zone_e0_y', 'exclusion_zone_e1_x', 'exclusion_zone_e1_y',
+    'exclusion_zone_e2_x', 'exclusion_zone_e2_y', 'exclusion_zone_e3_x', 'exclusion_zone_e3_y',
+    'control_panel_type', 'control_panel_permutation', 'panel_type', 'panel_permutation',
+    'primary_transfer', 'secondary_transfer', 'transparent_transfer',
+    'primary_light', 'secondary_light', 'transparent_light', 'ambient_delta',
+)
+POLYGON_FIELDS = (
+    'index', 'type', 'flags', 'permutation', 'vertex_count',
+    *indexed('endpoint_index', 8),
+    *indexed('line_index', 8),
+    'floor_texture', 'ceiling_texture', 'floor_height', 'ceiling_height',
+    'floor_lightsource_index', 'ceiling_lightsource_index', 'area',
+    'first_object', 'first_exclusion_zone_index',
+    'line_exclusion_zone_count', 'point_exclusion_zone_count',
+    'floor_transfer_mode', 'ceiling_transfer_mode',
+    *indexed('adjacent_polygon_index', 8),
+    'first_neighbor_index', 'neighbor_count', 'center_x', 'center_y',
+    *indexed('side_index', 8),
+    'floor_origin_x', 'floor_origin_y', 'ceiling_origin_x', 'ceiling_origin_y',
+    'media_index', 'media_lightsource_index', 'sound_source_indexes',
+    'ambient_sound_image_index', 'random_sound_image_index',
+)
+OBJECT_FIELDS = (
+    'index', 'type', 'object_index', 'facing', 'polygon_index',
+    'location_x', 'location_y', 'location_z', 'flags',
+)
+
+class Record(MutableMapping):
+    # attributes outside a record's fields, rare enough to live in a dict
+    __slots__ = ('extra',)
+    fields = ()
+    known = frozenset()
+    # (field, slot descriptor) pairs, read directly so unset fields don't
+    # fall through to __getattr__
+    slots = ()
+
+    def __init__(self, values=None):
+        if values:
+            for key, value in values.items():
+                try:
+                    setattr(self, key, value)
+                except AttributeError:
+                    self[key] = value
+
+    def __getitem__(self, key):
+        if key in self.known:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        try:
+            return self.extra[key]
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.known:
+            setattr(self, key, value)
+            return
+        try:
+            self.extra[key] = value
+        except AttributeError:
+            self.extra = {key: value}
+
+    def __delitem__(self, key):
+        try:
+            if key in self.known:
+                delattr(self, key)
+            else:
+                del self.extra[key]
+        except AttributeError:
+            raise KeyError(key)
+
+    def __getattr__(self, name):
+        # only reached for unset fields and attributes outside them
+        if 'extra' != name:
+            try:
+                return self.extra[name]
+            except (AttributeError, KeyError):
+                pass
+        raise AttributeError(name)
+
+    def __iter__(self):
+        for key, slot in self.slots:
+            try:
+                slot.__get__(self)
+            except AttributeError:
+                continue
+            yield key
+        try:
+            yield from self.extra
+        except AttributeError:
+            pass
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    # every record has an index, don't count fields just to test truth
+    def __bool__(self):
+        return True
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, dict(self))
+
+# the bulky elements have neither text nor children, should one turn up it
+# lands in extra like any other unknown attribute
+def record_type(name, fields):
+    fields = tuple(fields)
+    # named after this module so records can be pickled
+    cls = type(name, (Record,), {
+        '__module__': __name__,
+        '__slots__': fields,
+        'fields': fields,
+        'known': frozenset(fields),
+    })
+    cls.slots = tuple((f, cls.__dict__[f]) for f in fields)
+    return cls
+
+Endpoint = record_type('Endpoint', ENDPOINT_FIELDS)
+Line = record_type('Line', LINE_FIELDS)
+Side = record_type('Side', SIDE_FIELDS)
+Polygon = record_type('Polygon', POLYGON_FIELDS)
+MapObject = record_type('MapObject', OBJECT_FIELDS)
+
+# element tag -> record type, other elements stay plain dicts
+RECORD_TYPES = {
+    'endpoint': Endpoint,
+    'line': Line,
+    'side': Side,
+    'polygon': Polygon,
+    'object': MapObject,
+}
+
+# functions that build a record from values given in the order of keys,
+# generated once per record type and key order: the known fields are stored
+# straight into their slots and the other keys go to extra
+FILLERS = dict()
+
+def record_filler(record_type, keys):
+    filler = FILLERS.get((record_type, keys))
+    if filler is None:
+        filler = FILLERS[(record_type, keys)] = compile_filler(record_type, keys)
+    return filler
+
+def compile_filler(record_type, keys):
+    values = ['v{}'.format(i) for i in range(len(keys))]
+    lines = ['def fill({}):'.format(', '.join(values)), '    record = new(record_type)']
+    extra = []
+    for key, value in zip(keys, values):
+        if key in record_type.known:
+            lines.append('    record.{} = {}'.format(key, value))
+        else:
+            extra.append('{!r}: {}'.format(key, value))
+    if extra:
+        lines.append('    record.extra = {{{}}}'.format(', '.join(extra)))
+    lines.append('    return record')
+    namespace = {'new': record_type.__new__, 'record_type': record_type}
+    exec('\n'.join(lines), namespace)
+    return namespace['fill']
+
+def make_record(tag, values):
+    record_type = RECORD_TYPES.get(tag)
+    if record_type is None:
+        return values
+    return record_filler(record_type, tuple(values))(*values.values())
@@ -2,9 +2,26 @@
 
 hide_lines();
 
+// the activation graph from the level JSON, when the map page embeds this level
+function activation_sources() {
+    try {
+        return window.parent.level_json.activation.sources;
+    } catch (e) {
+        return null;
+    }
+}
 function find_lines_group(id) {
     const split_id = id.split('_',2);
-    const search_id = '_lines_'+split_id[0].substring(0,1)+split_id[1];
+    const source_id = split_id[0].substring(0,1)+split_id[1];
+    const sources = activation_sources();
+    if (null != sources) {
+        const source = sources[source_id];
+        if (undefined == source || undefined == source.group) {
+            return null;
+        }
+        return document.getElementById(source.group);
+    }
+    const search_id = '_lines_'+source_id;
     const elements = document.querySelectorAll('g[id$='+search_id+']');
     if (elements.length <= 0) {
         return null;
@@ -25,6 +42,15 @@ function m_out(id) {
     set_display(id, 'none');
 }
 function hide_lines() {
+    const sources = activation_sources();
+    if (null != sources) {
+        Object.entries(sources)
+            .filter(([id, source]) => id.startsWith('s') && undefined != source.group)
+            .map(([id, source]) => document.getElementById(source.group))
+            .filter(e => null != e)
+            .forEach(e => e.style.display = 'none');
+        return;
+    }
     const search_id = '_lines_s';
     [...document.querySelectorAll('*')]
         .filter(e => e.id.indexOf(search_id) > -1)
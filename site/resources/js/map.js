@@ -6,6 +6,8 @@ var level_json = null;
 var level_MNov = null;
 var overlay_json = null;
 var overlay_style_map = {};
+var border_segments = null;
+var elevation_state = null;
 
 function load_common(path, callback, data_extractor) {
     // fetch the path
@@ -422,38 +424,238 @@ function out_of_bounds(floor, ceiling, comparison_min, comparison_max) {
         || Math.fround(ceiling) < Math.fround(comparison_max);
 }
 function process_polygons(hovered = []) {
+    if ('elevation_index' in level_json) {
+        return '';
+    }
+    const to_disable = hidden_connections();
+    if (to_disable.size == 0) {
+        return '';
+    }
+    return [...to_disable].map(item => '#' + item + ' {display: none;}');
+}
+function polygon_visible(elevation_type, floor, ceiling, floor_height, ceiling_height) {
+    if (null == floor_height || null == ceiling_height) {
+        // connections outside any polygon, never hidden
+        return true;
+    }
+    if ('intersection' == elevation_type) {
+        return !out_of_bounds(floor, ceiling, ceiling_height, floor_height);
+    }
+    if ('contained' == elevation_type) {
+        return !out_of_bounds(floor, ceiling, floor_height, ceiling_height);
+    }
+    if ('ceiling' == elevation_type) {
+        return !out_of_bounds(floor, ceiling, ceiling_height, ceiling_height);
+    }
+    if ('floor' == elevation_type) {
+        return !out_of_bounds(floor, ceiling, floor_height, floor_height);
+    }
+    return true;
+}
+function hidden_connections() {
     const slider = document.getElementById('elevation-slider');
     const values = slider.noUiSlider.get(true);
     const floor = values[0] /32;
     const ceiling = values[1] / 32;
     const elevation_type = document.querySelector('input[name="elevation"]:checked').value;
+    const polygons = level_json.polygons;
+    if ('elevation_index' in level_json) {
+        return update_elevation_state(elevation_type, floor, ceiling).hidden;
+    }
+    if ('strings' in level_json) {
+        // compact format: parallel height arrays, connections as offsets into a string table
+        const strings = level_json.strings;
+        const offsets = polygons.connection_offsets;
+        const connections = polygons.connections;
+        const enabled = new Uint8Array(strings.length);
+        const disabled = new Uint8Array(strings.length);
+        for (let i = 0; i < polygons.floor_height.length; i++) {
+            const visible = polygon_visible(elevation_type, floor, ceiling, polygons.floor_height[i], polygons.ceiling_height[i]);
+            const marks = visible ? enabled : disabled;
+            for (let c = offsets[i]; c < offsets[i+1]; c++) {
+                marks[connections[c]] = 1;
+            }
+        }
+        const to_disable = new Set();
+        for (let s = 0; s < strings.length; s++) {
+            if (disabled[s] && !enabled[s]) {
+                to_disable.add(strings[s]);
+            }
+        }
+        return to_disable;
+    }
     const enabled = new Set();
     const disabled = new Set();
-    for (const [id, poly] of Object.entries(level_json.polygons)) {
-        let visible = true;
-        if ('intersection' == elevation_type && out_of_bounds(floor, ceiling, poly.ceiling_height, poly.floor_height)) {
-            visible = false;
+    for (const [id, poly] of Object.entries(polygons)) {
+        if (polygon_visible(elevation_type, floor, ceiling, poly.floor_height, poly.ceiling_height)) {
+            poly.connections.forEach(c => enabled.add(c));
+        } else {
+            poly.connections.forEach(c => disabled.add(c));
         }
-        else if ('contained' == elevation_type && out_of_bounds(floor, ceiling, poly.floor_height, poly.ceiling_height)) {
-            visible = false;
+    }
+    return new Set([...disabled].filter(x => !enabled.has(x)));
+}
+// the hidden polygons are a prefix of one height order and a suffix of the
+// other, a slider move only visits the polygons between the old and new cuts
+// and keeps a count of visible polygons for each connection
+function elevation_orders(elevation_type) {
+    // [order compared with the floor handle, order compared with the ceiling handle]
+    const index = level_json.elevation_index;
+    const polygons = level_json.polygons;
+    const by_floor = [index.by_floor, polygons.floor_height];
+    const by_ceiling = [index.by_ceiling, polygons.ceiling_height];
+    if ('intersection' == elevation_type) {
+        return [by_ceiling, by_floor];
+    }
+    if ('contained' == elevation_type) {
+        return [by_floor, by_ceiling];
+    }
+    if ('ceiling' == elevation_type) {
+        return [by_ceiling, by_ceiling];
+    }
+    if ('floor' == elevation_type) {
+        return [by_floor, by_floor];
+    }
+    return null;
+}
+function count_below(order, heights, value, or_equal) {
+    // the same float comparison as out_of_bounds, fround keeps the order sorted
+    const limit = Math.fround(value);
+    let low = 0;
+    let high = order.length;
+    while (low < high) {
+        const middle = (low + high) >>> 1;
+        const height = Math.fround(heights[order[middle]]);
+        if (height < limit || (or_equal && height == limit)) {
+            low = middle + 1;
+        } else {
+            high = middle;
         }
-        else if ('ceiling' == elevation_type && out_of_bounds(floor, ceiling, poly.ceiling_height, poly.ceiling_height)) {
-            visible = false;
+    }
+    return low;
+}
+function new_elevation_state() {
+    const polygons = level_json.polygons;
+    const visible = new Int32Array(level_json.strings.length);
+    for (const c of polygons.connections) {
+        visible[c] += 1;
+    }
+    return {
+        level: level_json,
+        doc: null,
+        type: null,
+        orders: null,
+        lower: 0,
+        // polygons without heights are in neither order
+        upper: level_json.elevation_index.by_floor.length,
+        reasons: new Uint8Array(polygons.index.length),
+        visible: visible,
+        hidden: new Set(),
+        changed: new Set(),
+    };
+}
+function toggle_polygon(state, position, hide) {
+    // both handles can hide a polygon, its connections only change on the first and last
+    state.reasons[position] += hide ? 1 : -1;
+    if (state.reasons[position] != (hide ? 1 : 0)) {
+        return;
+    }
+    const polygons = level_json.polygons;
+    for (let c = polygons.connection_offsets[position]; c < polygons.connection_offsets[position+1]; c++) {
+        const s = polygons.connections[c];
+        state.visible[s] += hide ? -1 : 1;
+        if (hide && 0 == state.visible[s]) {
+            state.hidden.add(level_json.strings[s]);
+            state.changed.add(s);
+        } else if (!hide && 1 == state.visible[s]) {
+            state.hidden.delete(level_json.strings[s]);
+            state.changed.add(s);
         }
-        else if ('floor' == elevation_type && out_of_bounds(floor, ceiling, poly.floor_height, poly.floor_height)) {
-            visible = false;
+    }
+}
+function move_cuts(state, lower, upper) {
+    const orders = state.orders;
+    for (let k = lower; k < state.lower; k++) {
+        toggle_polygon(state, orders[0][0][k], false);
+    }
+    for (let k = state.upper; k < upper; k++) {
+        toggle_polygon(state, orders[1][0][k], false);
+    }
+    for (let k = state.lower; k < lower; k++) {
+        toggle_polygon(state, orders[0][0][k], true);
+    }
+    for (let k = upper; k < state.upper; k++) {
+        toggle_polygon(state, orders[1][0][k], true);
+    }
+    state.lower = lower;
+    state.upper = upper;
+}
+function update_elevation_state(elevation_type, floor, ceiling) {
+    if (null == elevation_state || elevation_state.level != level_json) {
+        elevation_state = new_elevation_state();
+    }
+    const state = elevation_state;
+    const count = level_json.elevation_index.by_floor.length;
+    if (state.type != elevation_type) {
+        move_cuts(state, 0, count);
+        state.type = elevation_type;
+        state.orders = elevation_orders(elevation_type);
+    }
+    if (null == state.orders) {
+        return state;
+    }
+    // hidden below the floor handle in the first order, above the ceiling handle in the second
+    move_cuts(state,
+        count_below(...state.orders[0], floor, false),
+        count_below(...state.orders[1], ceiling, true));
+    return state;
+}
+function apply_elevation(svg_doc) {
+    // indexed levels hide elements directly instead of through the dynamic
+    // style, only those whose visibility changed since the last update
+    if (!('elevation_index' in level_json)) {
+        return;
+    }
+    if (null != elevation_state && (elevation_state.level != level_json || elevation_state.doc != svg_doc)) {
+        if (elevation_state.doc == svg_doc) {
+            // same document, new level JSON: start over from everything shown
+            elevation_state.hidden.forEach(id => set_element_display(svg_doc, id, ''));
         }
-        if (visible) {
-            poly.connections.forEach(c => enabled.add(c));
-        } else {
-            poly.connections.forEach(c => disabled.add(c));
+        elevation_state = null;
+    }
+    hidden_connections();
+    const state = elevation_state;
+    state.doc = svg_doc;
+    for (const s of state.changed) {
+        set_element_display(svg_doc, level_json.strings[s], 0 == state.visible[s] ? 'none' : '');
+    }
+    state.changed.clear();
+}
+function set_element_display(svg_doc, id, display) {
+    const element = svg_doc.getElementById(id);
+    if (null != element) {
+        element.style.display = display;
+    }
+}
+function update_border_paths(svg_doc) {
+    // merged borders can't be hidden by id, rebuild each path from its visible lines
+    if (!('borders' in level_json)) {
+        return;
+    }
+    if (null == border_segments) {
+        border_segments = {};
+        for (const [css_class, lines] of Object.entries(level_json.borders)) {
+            const path = svg_doc.getElementById('border_'+css_class+'_path');
+            if (null == path) {continue;}
+            const segments = path.getAttribute('d').split('M').slice(1);
+            border_segments[css_class] = lines.map((line, i) => ['line_'+line, 'M'+segments[i]]);
         }
     }
-    const to_disable = new Set([...disabled].filter(x => !enabled.has(x)));
-    if (to_disable.size == 0) {
-        return '';
+    const hidden = hidden_connections();
+    for (const [css_class, segments] of Object.entries(border_segments)) {
+        const path = svg_doc.getElementById('border_'+css_class+'_path');
+        path.setAttribute('d', segments.filter(s => !hidden.has(s[0])).map(s => s[1]).join(''));
     }
-    return [...to_disable].map(item => '#' + item + ' {display: none;}');
 }
 function update_svg_style(hovered = []) {
     const svg_obj = document.getElementById('map_object');
@@ -461,11 +663,16 @@ function update_svg_style(hovered = []) {
     const svg_doc = svg_obj.contentDocument;
     if (null == svg_doc) {return;}
     const old_style = svg_doc.getElementById('dynamic-style');
+    if (null == old_style) {
+        return;
+    }
+    apply_elevation(svg_doc);
     const new_style = generate_dynamic_style(hovered);
-    if (null == old_style || null == new_style) {
+    if (null == new_style) {
         return;
     }
     old_style.textContent = new_style;
+    update_border_paths(svg_doc);
 }
 function update_url() {
     const map_selector = document.getElementById('select_map');
@@ -486,6 +693,7 @@ function update_url() {
     document.title = new_title;
 }
 function svg_loaded() {
+    border_segments = null;
     update_url();
     set_initial_elevation();
     update_svg_style();
@@ -0,0 +1,497 @@
+# reader for binary Marathon map wadfiles (Map.scen, Map.sceA), with or without
+# a MacBinary wrapper, producing the same level structures as mapxml.py
+#
+# layouts follow the saved structures in Aleph One:
+# https://github.com/Aleph-One-Marathon/alephone/blob/e9c3c4903bb662a4d7c84e6b8cf587efc84293e3/Source_Files/GameWorld/map.h
+# https://github.com/Aleph-One-Marathon/alephone/blob/e9c3c4903bb662a4d7c84e6b8cf587efc84293e3/Source_Files/Files/wad.h
+
+from collections import defaultdict
+from functools import partial
+import mmap
+import os
+import struct
+
+from level import Level
+from records import Endpoint, Line, Side, Polygon, MapObject, record_filler
+
+MACBINARY_HEADER_SIZE = 128
+
+# version, data_version, file_name, checksum, directory_offset, wad_count,
+# application_specific_directory_data_size, entry_header_size,
+# directory_entry_base_size, parent_checksum, unused
+WAD_HEADER = struct.Struct('>hh64sIihhhhI40x')
+
+# offset_to_start, length, (index, only from WADFILE_HAS_DIRECTORY_ENTRY on)
+DIRECTORY_ENTRY = {
+    8: struct.Struct('>ii'),
+    10: struct.Struct('>iih'),
+}
+# tag, next_offset, length, (offset, only from WADFILE_SUPPORTS_OVERLAYS on)
+ENTRY_HEADER = {
+    12: struct.Struct('>4sii'),
+    16: struct.Struct('>4siii'),
+}
+
+MARATHON_ONE_DATA_VERSION = 0
+# up to WADFILE_HAS_INFINITY_STUFF and MARATHON_INFINITY_DATA_VERSION
+MAXIMUM_WADFILE_VERSION = 4
+MAXIMUM_DATA_VERSION = 2
+
+# size is that of the whole file when data only holds its start
+def is_macbinary(data, size=None):
+    if size is None:
+        size = len(data)
+    if len(data) < MACBINARY_HEADER_SIZE:
+        return False
+    if data[0] != 0 or data[74] != 0 or data[82] != 0:
+        return False
+    if not 1 <= data[1] <= 63:
+        return False
+    data_length = struct.unpack_from('>I', data, 83)[0]
+    return MACBINARY_HEADER_SIZE + data_length <= size
+
+def is_wad_header(data, size):
+    if len(data) < WAD_HEADER.size:
+        return False
+    version, data_version, _, _, directory_offset, wad_count = WAD_HEADER.unpack_from(data, 0)[:6]
+    return (0 <= version <= MAXIMUM_WADFILE_VERSION
+        and 0 <= data_version <= MAXIMUM_DATA_VERSION
+        and 0 <= wad_count
+        and WAD_HEADER.size <= directory_offset <= size)
+
+def indexed(name, count):
+    return ['{}_{}'.format(name, i) for i in range(count)]
+
+def fixed(value):
+    value = value / 65536
+    return int(value) if value.is_integer() else value
+
+class Layout(object):
+    # a big-endian record layout built from (names, format) pairs
+    def __init__(self, *fields, fixed_fields=(), record_type=dict):
+        self.record_type = record_type
+        self.names = []
+        fmt = '>'
+        for names, code in fields:
+            if isinstance(names, str):
+                names = [names]
+            self.names.extend(names)
+            fmt += code * len(names) if names else code
+        self.record = struct.Struct(fmt)
+        self.fixed_fields = [self.names.index(name) for name in fixed_fields]
+
+    # deferred chunks hold a layout, structs can't be pickled so send the format
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['record'] = self.record.format
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.record = struct.Struct(self.record)
+
+    def unpack(self, data):
+        count = len(data) // self.record.size
+        records = []
+        filler = None
+        if dict is not self.record_type:
+            filler = record_filler(self.record_type, tuple(self.names) + ('index',))
+        for index, values in enumerate(self.record.iter_unpack(data[:count * self.record.size])):
+            if self.fixed_fields:
+                values = list(values)
+                for field in self.fixed_fields:
+                    values[field] = fixed(values[field])
+            if filler is not None:
+                records.append(filler(*values, index))
+                continue
+            record = dict(zip(self.names, values))
+            record.setdefault('text', None)
+            record['index'] = index
+            records.append(record)
+        return records
+
+ENDPOINT = Layout(
+    ('flags', 'H'),
+    (['highest_adjacent_floor_height', 'lowest_adjacent_ceiling_height'], 'h'),
+    (['x', 'y', 'transformed_x', 'transformed_y', 'supporting_polygon_index'], 'h'),
+    record_type=Endpoint,
+)
+POINT = Layout(
+    (['x', 'y'], 'h'),
+)
+LINE = Layout(
+    (['endpoint1', 'endpoint2'], 'h'),
+    ('flags', 'H'),
+    (['length', 'highest_adjacent_floor', 'lowest_adjacent_ceiling'], 'h'),
+    (['cw_side', 'ccw_side', 'cw_poly', 'ccw_poly'], 'h'),
+    ([], '12x'),
+    record_type=Line,
+)
+SIDE = Layout(
+    ('type', 'h'),
+    ('flags', 'H'),
+    (['primary_x', 'primary_y'], 'h'), ('primary_texture', 'H'),
+    (['secondary_x', 'secondary_y'], 'h'), ('secondary_texture', 'H'),
+    (['transparent_x', 'transparent_y'], 'h'), ('transparent_texture', 'H'),
+    ([
+        'exclusion_zone_e0_x', 'exclusion_zone_e0_y', 'exclusion_zone_e1_x', 'exclusion_zone_e1_y',
+        'exclusion_zone_e2_x', 'exclusion_zone_e2_y', 'exclusion_zone_e3_x', 'exclusion_zone_e3_y',
+    ], 'h'),
+    (['panel_type', 'panel_permutation'], 'h'),
+    (['primary_transfer', 'secondary_transfer', 'transparent_transfer'], 'h'),
+    (['poly', 'line'], 'h'),
+    (['primary_light', 'secondary_light', 'transparent_light'], 'h'),
+    ('ambient_delta', 'i'),
+    ([], '2x'),
+    fixed_fields=['ambient_delta'],
+    record_type=Side,
+)
+POLYGON = Layout(
+    ('type', 'h'),
+    ('flags', 'H'),
+    ('permutation', 'h'),
+    ('vertex_count', 'H'),
+    (indexed('endpoint_index', 8), 'h'),
+    (indexed('line_index', 8), 'h'),
+    (['floor_texture', 'ceiling_texture'], 'H'),
+    (['floor_height', 'ceiling_height'], 'h'),
+    (['floor_lightsource_index', 'ceiling_lightsource_index'], 'h'),
+    ('area', 'i'),
+    (['first_object', 'first_exclusion_zone_index', 'line_exclusion_zone_count', 'point_exclusion_zone_count'], 'h'),
+    (['floor_transfer_mode', 'ceiling_transfer_mode'], 'h'),
+    (indexed('adjacent_polygon_index', 8), 'h'),
+    (['first_neighbor_index', 'neighbor_count'], 'h'),
+    (['center_x', 'center_y'], 'h'),
+    (indexed('side_index', 8), 'h'),
+    (['floor_origin_x', 'floor_origin_y', 'ceiling_origin_x', 'ceiling_origin_y'], 'h'),
+    (['media_index', 'media_lightsource_index', 'sound_source_indexes'], 'h'),
+    (['ambient_sound_image_index', 'random_sound_image_index'], 'h'),
+    ([], '2x'),
+    record_type=Polygon,
+)
+OBJECT = Layout(
+    (['type', 'object_index', 'facing', 'polygon_index'], 'h'),
+    (['location_x', 'location_y', 'location_z'], 'h'),
+    ('flags', 'H'),
+    record_type=MapObject,
+)
+PLACEMENT = Layout(
+    ('flags', 'H'),
+    (['initial_count', 'minimum_count', 'maximum_count', 'random_count'], 'h'),
+    ('random_chance', 'H'),
+)
+ANNOTATION = Layout(
+    (['type', 'location_x', 'location_y', 'polygon_index'], 'h'),
+    ('text', '64s'),
+)
+MEDIA = Layout(
+    ('type', 'h'),
+    ('flags', 'H'),
+    (['light_index', 'current_direction', 'current_magnitude', 'low', 'high'], 'h'),
+    (['origin_x', 'origin_y', 'height'], 'h'),
+    ('minimum_light_intensity', 'i'),
+    ('texture', 'H'),
+    ('transfer_mode', 'h'),
+    ([], '4x'),
+    fixed_fields=['minimum_light_intensity'],
+)
+LIGHT_FUNCTIONS = [
+    'primary_active', 'secondary_active', 'becoming_active',
+    'primary_inactive', 'secondary_inactive', 'becoming_inactive',
+]
+LIGHTING_FUNCTION = Layout(
+    (['function', 'period', 'delta_period'], 'h'),
+    (['intensity', 'delta_intensity'], 'i'),
+    fixed_fields=['intensity', 'delta_intensity'],
+)
+LIGHT = Layout(
+    ('type', 'h'),
+    ('flags', 'H'),
+    ('phase', 'h'),
+    ([], '{}x'.format(len(LIGHT_FUNCTIONS) * LIGHTING_FUNCTION.record.size)),
+    ('tag', 'h'),
+    ([], '8x'),
+)
+LIGHT_M1 = Layout(
+    ('flags', 'H'),
+    (['type', 'mode', 'phase'], 'h'),
+    (['minimum_intensity', 'maximum_intensity'], 'i'),
+    ('period', 'h'),
+    ('intensity', 'i'),
+    ([], '10x'),
+    fixed_fields=['minimum_intensity', 'maximum_intensity', 'intensity'],
+)
+STATIC_PLATFORM = Layout(
+    (['type', 'speed', 'delay', 'maximum_height', 'minimum_height'], 'h'),
+    ('static_flags', 'I'),
+    (['polygon_index', 'tag'], 'h'),
+    ([], '14x'),
+)
+PLATFORM = Layout(
+    ('type', 'h'),
+    ('static_flags', 'I'),
+    (['speed', 'delay'], 'h'),
+    (['minimum_floor_height', 'maximum_floor_height', 'minimum_ceiling_height', 'maximum_ceiling_height'], 'h'),
+    ('polygon_index', 'h'),
+    ('dynamic_flags', 'H'),
+    (['floor_height', 'ceiling_height', 'ticks_until_restart'], 'h'),
+    ([], '64x'),
+    (['parent_platform_index', 'tag'], 'h'),
+    ([], '44x'),
+)
+MAP_INFO = Layout(
+    (['environment_code', 'physics_model', 'song_index', 'mission_flags', 'environment_flags'], 'h'),
+    ([], '8x'),
+    ('level_name', '66s'),
+    ('entry_point_flags', 'I'),
+)
+TERMINAL_HEADER = struct.Struct('>hhhhh')
+GROUPING = Layout(
+    (['flags', 'type', 'permutation', 'start_index', 'length', 'maximum_index'], 'h'),
+)
+FONT_CHANGE = Layout(
+    (['offset', 'face', 'color'], 'h'),
+)
+# only the fields map2monsters reads, the same ones the map XML holds
+MONSTER_DEFINITION = Layout(
+    ('collection', 'h'),
+    # vitality, immunities, weaknesses
+    ([], '10x'),
+    ('flags', 'I'),
+    (['class', 'friends', 'enemies'], 'i'),
+    # sounds, dimensions, effects, vision, movement, shrapnel and the first five shapes
+    ([], '86x'),
+    ('stationary_shape', 'H'),
+    # moving and teleport shapes, attack frequency
+    ([], '8x'),
+    ('melee_attack_type', 'h'),
+    ([], '14x'),
+    ('ranged_attack_type', 'h'),
+    ([], '14x'),
+)
+
+def c_string(data):
+    return bytes(data).split(b'\0', 1)[0].decode('mac_roman')
+
+def decode_lights(data):
+    records = LIGHT.unpack(data)
+    for record in records:
+        start = record['index'] * LIGHT.record.size + 6
+        functions = LIGHTING_FUNCTION.unpack(data[start:start + len(LIGHT_FUNCTIONS) * LIGHTING_FUNCTION.record.size])
+        children = defaultdict(list)
+        for name, function in zip(LIGHT_FUNCTIONS, functions):
+            function['index'] = 0
+            children[name].append(function)
+        record['children'] = children
+    return records
+
+# Marathon 1 lights have no tag, -1 keeps them out of every tag switch
+def decode_lights_m1(data):
+    records = LIGHT_M1.unpack(data)
+    for record in records:
+        record['tag'] = -1
+    return records
+
+def decode_terminal_text(data, flags):
+    text = bytearray(data)
+    # _text_is_encoded_flag
+    if flags & 0x1:
+        for i in range(len(text) // 4 * 4):
+            if i % 4 == 2:
+                text[i] ^= 0xfe
+            elif i % 4 == 3:
+                text[i] ^= 0xed
+        for i in range(len(text) // 4 * 4, len(text)):
+            text[i] ^= 0xfe
+    return c_string(bytes(text))
+
+def decode_terminals(data):
+    records = []
+    offset = 0
+    while offset + TERMINAL_HEADER.size <= len(data):
+        total_length, flags, lines_per_page, grouping_count, font_changes_count = TERMINAL_HEADER.unpack_from(data, offset)
+        if total_length <= 0:
+            break
+        start = offset + TERMINAL_HEADER.size
+        groupings_end = start + grouping_count * GROUPING.record.size
+        fonts_end = groupings_end + font_changes_count * FONT_CHANGE.record.size
+        children = defaultdict(list)
+        children['grouping'] = GROUPING.unpack(data[start:groupings_end])
+        children['font_change'] = FONT_CHANGE.unpack(data[groupings_end:fonts_end])
+        records.append({
+            'flags': flags,
+            'lines_per_page': lines_per_page,
+            'children': children,
+            'text': decode_terminal_text(data[fonts_end:offset + total_length], flags),
+            'index': len(records),
+        })
+        offset += total_length
+    return records
+
+def decode_annotations(data):
+    records = ANNOTATION.unpack(data)
+    for record in records:
+        record['text'] = c_string(record['text'])
+    return records
+
+def decode_monster_definitions(data):
+    records = MONSTER_DEFINITION.unpack(data)
+    for record in records:
+        # the shape of the shape descriptor, its low byte
+        record['stationary_shape_shape'] = record.pop('stationary_shape') & 0xff
+    return records
+
+def decode_map_info(data):
+    records = MAP_INFO.unpack(data)
+    for record in records:
+        record['level_name'] = c_string(record['level_name'])
+    return records
+
+# chunk type -> (element tag, decoder)
+CHUNK_DECODERS = {
+    'EPNT': ('endpoint', ENDPOINT.unpack),
+    'PNTS': ('point', POINT.unpack),
+    'LINS': ('line', LINE.unpack),
+    'SIDS': ('side', SIDE.unpack),
+    'POLY': ('polygon', POLYGON.unpack),
+    'OBJS': ('object', OBJECT.unpack),
+    'plac': ('placement', PLACEMENT.unpack),
+    'NOTE': ('annotation', decode_annotations),
+    'medi': ('media', MEDIA.unpack),
+    'LITE': ('light', decode_lights),
+    'PLAT': ('platform', STATIC_PLATFORM.unpack),
+    'plat': ('platform', PLATFORM.unpack),
+    'term': ('terminal', decode_terminals),
+    'Minf': ('mapinfo', decode_map_info),
+    'MNpx': ('monster_definition', decode_monster_definitions),
+}
+CHUNK_DECODERS_M1 = dict(CHUNK_DECODERS, LITE=('light', decode_lights_m1))
+
+class WadFile(object):
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = memoryview(self.mmap)
+        if is_macbinary(data):
+            data_length = struct.unpack_from('>I', data, 83)[0]
+            data = data[MACBINARY_HEADER_SIZE:MACBINARY_HEADER_SIZE + data_length]
+        self.data = data
+        (
+            self.version,
+            self.data_version,
+            file_name,
+            self.checksum,
+            directory_offset,
+            wad_count,
+            application_data_size,
+            self.entry_header_size,
+            directory_entry_base_size,
+            self.parent_checksum,
+        ) = WAD_HEADER.unpack_from(data, 0)
+        self.file_name = c_string(file_name)
+        # pre-directory wadfiles leave the sizes unset
+        if not directory_entry_base_size:
+            directory_entry_base_size = 8 if 0 == self.version else 10
+        if not self.entry_header_size:
+            self.entry_header_size = 12 if self.version < 2 else 16
+        directory_entry = DIRECTORY_ENTRY[directory_entry_base_size]
+        self.entry_header = ENTRY_HEADER[self.entry_header_size]
+        self.entries = dict()
+        stride = directory_entry_base_size + application_data_size
+        for position in range(wad_count):
+            values = directory_entry.unpack_from(data, directory_offset + position * stride)
+            index = values[2] if len(values) > 2 else position
+            self.entries[index] = (values[0], values[1])
+
+    @property
+    def map_type(self):
+        return self.version
+
+    def close(self):
+        self.data.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            # a chunk view is still alive (e.g. in a traceback), it is unmapped once collected
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def entry(self, index):
+        offset, length = self.entries[index]
+        return self.data[offset:offset + length]
+
+    def chunks(self, index):
+        entry = self.entry(index)
+        chunk_offset = 0
+        while chunk_offset + self.entry_header.size <= len(entry):
+            header = self.entry_header.unpack_from(entry, chunk_offset)
+            tag, next_offset, chunk_length = header[:3]
+            start = chunk_offset + self.entry_header.size
+            yield tag.decode('mac_roman'), entry[start:start + chunk_length]
+            if not next_offset:
+                break
+            chunk_offset = next_offset
+
+    def decode_level(self, index, chunk_types, chunk_types_ignored=None):
+        decoders = CHUNK_DECODERS
+        if MARATHON_ONE_DATA_VERSION == self.data_version:
+            decoders = CHUNK_DECODERS_M1
+        name = None
+        level_dict = Level()
+        for chunk_type, data in self.chunks(index):
+            if chunk_types_ignored and chunk_type in chunk_types_ignored:
+                continue
+            if 'NAME' == chunk_type:
+                name = c_string(data)
+            elif chunk_type in chunk_types and chunk_type in decoders:
+                # copied so the level outlives the mapping
+                level_dict.defer(chunk_type, partial(decode_chunk, decoders[chunk_type], bytes(data)))
+            elif chunk_type in chunk_types:
+                print ('unhandled chunk: {}'.format({'type': chunk_type, 'size': len(data)}))
+        if 'EPNT' in chunk_types and 'EPNT' not in level_dict and 'PNTS' in level_dict:
+            level_dict.defer('EPNT', partial(expand_points, level_dict))
+        for chunk_type in chunk_types:
+            if chunk_type not in level_dict:
+                level_dict[chunk_type] = defaultdict(list)
+        return name, level_dict
+
+def decode_chunk(decoder, data):
+    tag, decode = decoder
+    chunk_dict = defaultdict(list)
+    chunk_dict[tag] = decode(data)
+    return chunk_dict
+
+# Marathon 1 levels only store points, expand them to endpoints the same way Aleph One does
+def expand_points(level_dict):
+    endpoints = defaultdict(list)
+    for point in level_dict['PNTS']['point']:
+        endpoints['endpoint'].append(Endpoint({
+            'flags': 0,
+            'highest_adjacent_floor_height': 0,
+            'lowest_adjacent_ceiling_height': 0,
+            'x': point['x'],
+            'y': point['y'],
+            'transformed_x': point['x'],
+            'transformed_y': point['y'],
+            'supporting_polygon_index': -1,
+            'index': point['index'],
+        }))
+    return endpoints
+
+# sniffed from the wad header, anything else is read as map XML
+def is_wadfile(path):
+    with open(path, 'rb') as f:
+        start = f.read(MACBINARY_HEADER_SIZE + WAD_HEADER.size)
+        size = os.fstat(f.fileno()).st_size
+    if is_wad_header(start, size):
+        return True
+    if is_macbinary(start, size):
+        data_length = struct.unpack_from('>I', start, 83)[0]
+        return is_wad_header(start[MACBINARY_HEADER_SIZE:], data_length)
+    return False
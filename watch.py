@@ -0,0 +1,174 @@
+# polling file watcher and a local server that reloads the browser, for build_site.py --watch
+#
+# HTML pages are served with a small script listening on /__reload for
+# server-sent events; the server sends the current build on connect and on
+# every reload, and the page reloads itself when the build it sees changes,
+# including after the process is restarted
+
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import os
+import sys
+import threading
+import time
+
+POLL_SECONDS = 0.2
+# a comment is sent this often so closed connections are noticed
+KEEPALIVE_SECONDS = 15
+RELOAD_PATH = '/__reload'
+RELOAD_SCRIPT = '''<script>
+(function() {
+    var build = null;
+    new EventSource('RELOAD_PATH').onmessage = function(event) {
+        if (null !== build && build !== event.data) {
+            location.reload();
+        }
+        build = event.data;
+    };
+})();
+</script>
+'''.replace('RELOAD_PATH', RELOAD_PATH).encode()
+
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+# files under directory, skipping the directories in exclude
+def iter_files(directory, exclude=()):
+    exclude = {os.path.abspath(d) for d in exclude}
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) not in exclude]
+        for name in files:
+            yield os.path.join(root, name)
+
+class FileWatcher(object):
+    # list_paths is called on every poll, so files can come and go; a missing
+    # file is watched for being created
+    def __init__(self, list_paths):
+        self.list_paths = list_paths
+        self.stamps = self.scan()
+
+    def scan(self):
+        return {p: file_stamp(p) for p in self.list_paths()}
+
+    # the paths added, removed or modified since the last call
+    def changed(self):
+        stamps = self.scan()
+        changed = [p for p in set(stamps) | set(self.stamps) if stamps.get(p) != self.stamps.get(p)]
+        self.stamps = stamps
+        return changed
+
+    # block until something changes, then until it settles for a poll, so a
+    # file is not read while an editor is still writing it
+    def wait(self):
+        changed = set()
+        while True:
+            time.sleep(POLL_SECONDS)
+            more = self.changed()
+            if not more and changed:
+                return sorted(changed)
+            changed.update(more)
+
+class ReloadHandler(SimpleHTTPRequestHandler):
+    def __init__(self, server_state, *handler_args, **kwargs):
+        self.server_state = server_state
+        super().__init__(*handler_args, **kwargs)
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0].split('#', 1)[0]
+        if RELOAD_PATH == path:
+            self.send_events()
+            return
+        file_path = self.translate_path(path)
+        if path.endswith('/') and os.path.isdir(file_path):
+            file_path = os.path.join(file_path, 'index.html')
+        if file_path.endswith('.html') and os.path.isfile(file_path):
+            self.send_page(file_path)
+            return
+        super().do_GET()
+
+    def send_page(self, file_path):
+        with open(file_path, 'rb') as f:
+            page = f.read()
+        end = page.rfind(b'</body>')
+        if end < 0:
+            end = len(page)
+        page = page[:end] + RELOAD_SCRIPT + page[end:]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def send_events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        build = None
+        try:
+            # reconnect quickly after a restart
+            self.wfile.write(b'retry: 500\n\n')
+            while True:
+                current = self.server_state.wait(build, KEEPALIVE_SECONDS)
+                if current != build:
+                    self.wfile.write('data: {}\n\n'.format(current).encode())
+                    build = current
+                else:
+                    self.wfile.write(b': keepalive\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    # every file is fetched again on reload
+    def end_headers(self):
+        self.send_header('Cache-Control', 'no-store')
+        super().end_headers()
+
+    # only errors are logged
+    def log_request(self, code='-', size='-'):
+        pass
+
+class ReloadServer(object):
+    def __init__(self, directory, port):
+        self.port = port
+        # unique across restarts
+        self.started = time.time_ns()
+        self.generation = 0
+        self.build = self.build_id()
+        self.condition = threading.Condition()
+        self.server = ThreadingHTTPServer(('localhost', port), partial(ReloadHandler, self, directory=directory))
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def build_id(self):
+        return '{}.{}'.format(self.started, self.generation)
+
+    def start(self):
+        self.thread.start()
+        print ('serving http://localhost:{}/'.format(self.port))
+
+    # tell every open page to reload
+    def reload(self):
+        with self.condition:
+            self.generation += 1
+            self.build = self.build_id()
+            self.condition.notify_all()
+
+    # the current build, once it differs from build or after timeout seconds
+    def wait(self, build, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.build != build, timeout)
+            return self.build
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# run the same command again, picking up changed modules
+def restart():
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execv(sys.executable, [sys.executable] + sys.argv)